@@ -5,6 +5,7 @@ Professional medical-grade backend API
 
 import os
 import logging
+import click
 from flask import Flask, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -41,6 +42,14 @@ def create_app(config_name=None):
     cors.init_app(app, origins=app.config['CORS_ORIGINS'])
     ma.init_app(app)
     
+    # Initialize the event broker used by the SSE streams
+    from services.events import broker
+    broker.init_app(app)
+    
+    # Initialize the report export workers
+    from services.reports import report_runner
+    report_runner.init_app(app)
+    
     # Configure logging
     configure_logging(app)
     
@@ -165,6 +174,7 @@ def register_blueprints(app):
     from routes.patient_routes import patient_bp
     from routes.prescription_routes import prescription_bp
     from routes.rare_medicine_routes import rare_medicine_bp
+    from routes.sales_routes import sales_bp
     from routes.notification_routes import notification_bp
     from routes.analytics_routes import analytics_bp
     from routes.translation_routes import translation_bp
@@ -177,6 +187,7 @@ def register_blueprints(app):
     app.register_blueprint(patient_bp, url_prefix='/api/patients')
     app.register_blueprint(prescription_bp, url_prefix='/api/prescriptions')
     app.register_blueprint(rare_medicine_bp, url_prefix='/api/rare-medicines')
+    app.register_blueprint(sales_bp, url_prefix='/api/sales')
     app.register_blueprint(notification_bp, url_prefix='/api/notifications')
     app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
     app.register_blueprint(translation_bp, url_prefix='/api/translation')
@@ -198,6 +209,7 @@ def register_blueprints(app):
                 'patients': '/api/patients',
                 'prescriptions': '/api/prescriptions',
                 'rare_medicines': '/api/rare-medicines',
+                'sales': '/api/sales',
                 'notifications': '/api/notifications',
                 'analytics': '/api/analytics',
                 'translation': '/api/translation'
@@ -229,6 +241,7 @@ def register_blueprints(app):
                 'patients': '/api/patients',
                 'prescriptions': '/api/prescriptions',
                 'rare_medicines': '/api/rare-medicines',
+                'sales': '/api/sales',
                 'notifications': '/api/notifications',
                 'analytics': '/api/analytics',
                 'translation': '/api/translation'
@@ -251,6 +264,147 @@ def register_cli_commands(app):
         from models import Pharmacy, Medicine, Patient
         # Add sample data creation logic here
         print("Database seeded successfully!")
+    
+    @app.cli.command('find-duplicate-patients')
+    @click.option('--min-score', default=0.6, help='Minimum match score (0-1)')
+    @click.option('--limit', default=100, help='Maximum candidate pairs to print')
+    def find_duplicate_patients(min_score, limit):
+        """Report candidate duplicate patient records"""
+        from services.patient_dedup import find_duplicate_candidates
+        candidates = find_duplicate_candidates(min_score=min_score, limit=limit)
+        for candidate in candidates:
+            print(f"{candidate['score']:.3f}  {' <-> '.join(candidate['patient_ids'])}  ({', '.join(candidate['matched_on'])})")
+        print(f"Found {len(candidates)} candidate duplicate pairs")
+    
+    @app.cli.command('backfill-prescription-items')
+    @click.option('--chunk-size', default=500, help='Prescriptions converted per transaction')
+    def backfill_prescription_items(chunk_size):
+        """Convert historical prescription medicines JSON into PrescriptionItem rows"""
+        from services.prescription_items import backfill_prescription_items as backfill
+        prescriptions, items = backfill(chunk_size=chunk_size)
+        print(f"Backfilled {items} prescription items from {prescriptions} prescriptions")
+    
+    @app.cli.command('fan-out-rare-requests')
+    @click.option('--limit', default=100, help='Maximum requests to process')
+    def fan_out_rare_requests(limit):
+        """Notify candidate pharmacies about pending rare medicine requests, most urgent first"""
+        from services.rare_medicine_fanout import fan_out_pending_requests
+        requests, notifications = fan_out_pending_requests(limit=limit)
+        print(f"Fanned out {requests} rare medicine requests ({notifications} notifications)")
+    
+    @app.cli.command('normalize-rare-request-status')
+    def normalize_rare_request_status():
+        """Rewrite lowercase 'pending' rare medicine requests so the queue sees them (one-off)"""
+        from services.rare_medicine_queue import normalize_pending_statuses
+        updated = normalize_pending_statuses()
+        db.session.commit()
+        print(f"Normalized {updated} rare medicine requests")
+    
+    @app.cli.command('load-postal-codes')
+    @click.argument('csv_path', type=click.Path(exists=True))
+    def load_postal_codes(csv_path):
+        """Load the offline geocoding table from a CSV (postal_code, latitude, longitude[, place_name, district, state])"""
+        import csv
+        import uuid
+        from models import PostalCodeLocation
+        with open(csv_path, newline='', encoding='utf-8') as csv_file:
+            rows = {}
+            for row in csv.DictReader(csv_file):
+                rows[row['postal_code'].strip()] = {
+                    'id': uuid.uuid4(),
+                    'postal_code': row['postal_code'].strip(),
+                    'latitude': float(row['latitude']),
+                    'longitude': float(row['longitude']),
+                    'place_name': row.get('place_name'),
+                    'district': row.get('district'),
+                    'state': row.get('state')
+                }
+        db.session.execute(db.delete(PostalCodeLocation).where(PostalCodeLocation.postal_code.in_(list(rows))))
+        db.session.execute(db.insert(PostalCodeLocation), list(rows.values()))
+        db.session.commit()
+        print(f"Loaded {len(rows)} postal code locations")
+    
+    @app.cli.command('geocode-pharmacies')
+    @click.option('--overwrite', is_flag=True, help='Re-geocode pharmacies that already have coordinates')
+    def geocode_pharmacies(overwrite):
+        """Fill pharmacy coordinates from the offline postal code table"""
+        from services.geo_index import geocode_pharmacies as geocode
+        updated = geocode(overwrite=overwrite)
+        db.session.commit()
+        print(f"Geocoded {updated} pharmacies")
+    
+    @app.cli.command('compact-sales-rollups')
+    @click.option('--rebuild', is_flag=True, help='Recompute all rollups from sales transactions instead')
+    def compact_sales_rollups(rebuild):
+        """Merge past days' sales rollup deltas (run nightly)"""
+        from services.sales_rollups import compact_rollups, rebuild_rollups
+        if rebuild:
+            days = rebuild_rollups()
+            print(f"Rebuilt sales rollups for {days} pharmacy-days")
+        else:
+            removed = compact_rollups()
+            print(f"Compacted sales rollups ({removed} delta rows merged)")
+    
+    @app.cli.command('forecast-demand')
+    @click.option('--lead-time', type=int, default=None, help='Lead time in days (default: REORDER_LEAD_TIME_DAYS)')
+    def forecast_demand(lead_time):
+        """Recompute demand forecasts and reorder points for every medicine (run nightly)"""
+        from services.demand_forecast import run_forecasts
+        summary = run_forecasts(lead_time_days=lead_time)
+        print(f"Forecast {summary['series']} series ({summary['croston_series']} intermittent) "
+              f"in {summary['total_seconds']}s; lead time {summary['lead_time_days']} days")
+    
+    @app.cli.command('score-expiry-risk')
+    def score_expiry_risk_command():
+        """Estimate units and value of each batch expiring unsold (run nightly, after forecast-demand)"""
+        from services.expiry_risk import score_expiry_risk
+        summary = score_expiry_risk()
+        print(f"Scored {summary['batches']} batches: {summary['batches_at_risk']} at risk, "
+              f"{summary['units_at_risk']} units worth {summary['value_at_risk']:.2f}")
+    
+    @app.cli.command('purge-reports')
+    @click.option('--days', type=int, default=None, help='Retention in days (default: REPORT_RETENTION_DAYS)')
+    def purge_reports_command(days):
+        """Delete exported report files and their jobs past retention"""
+        from services.reports import fail_stale_jobs, purge_reports
+        failed = fail_stale_jobs(app.config['REPORT_JOB_TIMEOUT_MINUTES'])
+        db.session.commit()
+        print(f"Failed {failed} interrupted report jobs")
+        removed = purge_reports(days if days is not None else app.config['REPORT_RETENTION_DAYS'])
+        print(f"Purged {removed} report jobs")
+    
+    @app.cli.command('rebuild-notification-counters')
+    def rebuild_notification_counters_command():
+        """Recompute unread notification counters from the notifications table"""
+        from services.notifications import rebuild_unread_counters
+        rows = rebuild_unread_counters()
+        print(f"Rebuilt {rows} notification counters")
+    
+    @app.cli.command('partition-notifications')
+    def partition_notifications_command():
+        """Convert notifications to monthly partitions (PostgreSQL, one-off)"""
+        from services.notification_retention import (
+            ensure_partitions, partition_notifications_table, supports_partitioning
+        )
+        if not supports_partitioning():
+            print("Partitioning needs PostgreSQL; purge-notifications still deletes expired rows")
+            return
+        if partition_notifications_table():
+            print("Partitioned notifications by month")
+        else:
+            print("notifications is already partitioned")
+        created = ensure_partitions(app.config['NOTIFICATION_PARTITION_MONTHS_AHEAD'])
+        print(f"Created {len(created)} partitions")
+    
+    @app.cli.command('purge-notifications')
+    @click.option('--days', type=int, default=None, help='Retention in days (default: NOTIFICATION_RETENTION_DAYS)')
+    def purge_notifications_command(days):
+        """Remove notifications past expiry or retention (run nightly)"""
+        from services.notification_retention import run_retention
+        summary = run_retention(days)
+        print(f"Created {len(summary['partitions_created'])} partitions, "
+              f"removed {len(summary['partitions_removed'])} partitions, "
+              f"deleted {summary['rows_deleted']} notifications")
 
 # Request/Response middleware
 def register_middleware(app):
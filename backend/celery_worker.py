@@ -0,0 +1,15 @@
+"""
+Celery worker entry point for report exports (REPORT_EXECUTOR=celery)
+
+    celery -A celery_worker.celery worker
+"""
+
+from app import create_app
+
+app = create_app()
+if 'celery' not in app.extensions:
+    raise RuntimeError(
+        'Report exports are not using Celery: set REPORT_EXECUTOR=celery in the '
+        "worker's environment, install celery and configure CELERY_BROKER_URL"
+    )
+celery = app.extensions['celery']
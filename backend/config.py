@@ -30,6 +30,28 @@ class Config:
     DEFAULT_PAGE_SIZE = 20
     MAX_PAGE_SIZE = 100
     
+    # Analytics
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL') or 60)  # seconds
+    ANALYTICS_STALE_TTL = int(os.environ.get('ANALYTICS_STALE_TTL') or 300)  # seconds a stale result may be served while refreshing
+    
+    # Sales
+    DEFAULT_SALES_TAX_RATE = os.environ.get('DEFAULT_SALES_TAX_RATE') or '0'  # percent, applied after discount
+    TRANSACTION_NUMBER_BLOCK_SIZE = 50  # numbers each worker reserves per database round trip
+    
+    # Top-N medicine sketches: a sketch with capacity k over-counts by at most total/k
+    HEAVY_HITTERS_CAPACITY = 64
+    HEAVY_HITTERS_PERSIST_SECONDS = 60
+    
+    # Demand forecasting and reorder points
+    FORECAST_HISTORY_DAYS = 180
+    FORECAST_SMOOTHING_ALPHA = 0.2
+    # Series with less history than this keep their manual minimum_threshold
+    FORECAST_MIN_HISTORY_DAYS = 14
+    FORECAST_MIN_DEMAND_DAYS = 3
+    REORDER_LEAD_TIME_DAYS = int(os.environ.get('REORDER_LEAD_TIME_DAYS') or 7)
+    REORDER_SERVICE_LEVEL = 0.95  # probability of not stocking out during a lead time
+    LOW_STOCK_THRESHOLD_SOURCE = os.environ.get('LOW_STOCK_THRESHOLD_SOURCE') or 'manual'  # manual, forecast
+    
     # File Upload
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
@@ -51,10 +73,34 @@ class Config:
     # Redis Configuration (for caching and background tasks)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
     
+    # Event streaming (Server-Sent Events)
+    # 'memory' delivers events within one worker process; use 'postgres'
+    # (LISTEN/NOTIFY) when running several workers
+    EVENT_BACKEND = os.environ.get('EVENT_BACKEND') or 'memory'
+    SSE_KEEPALIVE_SECONDS = 15
+    
     # Celery Configuration
     CELERY_BROKER_URL = REDIS_URL
     CELERY_RESULT_BACKEND = REDIS_URL
     
+    # Report exports
+    # 'thread' generates reports on an in-process pool; 'celery' sends them to
+    # the Celery workers (falling back to the pool if the broker is unreachable)
+    REPORT_EXECUTOR = os.environ.get('REPORT_EXECUTOR') or 'thread'
+    REPORT_WORKERS = 2
+    REPORT_FOLDER = os.environ.get('REPORT_FOLDER') or os.path.join(os.path.dirname(__file__), 'reports')
+    REPORT_RETENTION_DAYS = 7
+    REPORT_JOB_TIMEOUT_MINUTES = 60
+    
+    # Notification retention (flask purge-notifications, run nightly)
+    # On PostgreSQL notifications is partitioned by month; whole partitions
+    # past retention are dropped, or only detached when archiving
+    NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS') or 180)
+    NOTIFICATION_PARTITION_MONTHS_AHEAD = 3
+    NOTIFICATION_ARCHIVE_PARTITIONS = os.environ.get('NOTIFICATION_ARCHIVE_PARTITIONS', 'false').lower() in ['true', 'on', '1']
+    NOTIFICATION_PURGE_BATCH_SIZE = 5000
+    NOTIFICATION_LOCK_TIMEOUT = '5s'
+    
     # Security
     WTF_CSRF_ENABLED = True
     SESSION_COOKIE_SECURE = True
@@ -34,6 +34,9 @@ class Pharmacy(BaseModel):
     owner_name = db.Column(db.String(255), nullable=False)
     gst_number = db.Column(db.String(50))
     password_hash = db.Column(db.String(255), nullable=False)
+    latitude = db.Column(db.Float)  # Filled from PostalCodeLocation or set explicitly
+    longitude = db.Column(db.Float)
+    timezone = db.Column(db.String(64), nullable=False, default='Asia/Kolkata')  # IANA name used for reporting buckets
     
     # Relationships
     inventory = db.relationship('Inventory', backref='pharmacy', lazy='dynamic', cascade='all, delete-orphan')
@@ -51,6 +54,9 @@ class Pharmacy(BaseModel):
             'email': self.email,
             'owner_name': self.owner_name,
             'gst_number': self.gst_number,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'timezone': self.timezone,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -139,6 +145,8 @@ class Inventory(BaseModel):
         db.CheckConstraint('expiry_date > manufacture_date', name='check_valid_dates'),
         db.CheckConstraint('unit_price > 0 AND mrp > 0', name='check_positive_prices'),
         db.UniqueConstraint('pharmacy_id', 'medicine_id', 'batch_number', name='unique_batch_per_pharmacy'),
+        db.Index('idx_inventory_pharmacy_medicine', 'pharmacy_id', 'medicine_id'),
+        db.Index('idx_inventory_medicine_pharmacy', 'medicine_id', 'pharmacy_id', 'expiry_date'),
     )
     
     @property
@@ -350,6 +358,17 @@ class RareMedicineRequest(BaseModel):
     estimated_delivery = db.Column(db.Date)  # Estimated delivery date
     supplier_info = db.Column(db.Text)  # Supplier information
     date_completed = db.Column(db.DateTime(timezone=True))  # When request was completed
+    fanned_out_at = db.Column(db.DateTime(timezone=True))  # When candidate pharmacies were notified
+    leased_by = db.Column(db.String(255))  # Staff member currently processing the request
+    lease_expires_at = db.Column(db.DateTime(timezone=True))  # Lease returns to the queue after this
+    
+    # Constraints
+    __table_args__ = (
+        db.Index('idx_rare_requests_fanout', 'urgency_level', 'requested_date',
+                 postgresql_where=db.text('fanned_out_at IS NULL')),
+        db.Index('idx_rare_requests_queue', 'requested_date', 'id',
+                 postgresql_where=db.text("status = 'Pending'")),
+    )
     
     # Relationships
     responses = db.relationship('RareMedicineResponse', backref='request', lazy='dynamic', cascade='all, delete-orphan')
@@ -378,6 +397,8 @@ class RareMedicineRequest(BaseModel):
             'estimated_cost': float(self.estimated_cost) if self.estimated_cost else None,
             'estimated_delivery': self.estimated_delivery.isoformat() if self.estimated_delivery else None,
             'supplier_info': self.supplier_info,
+            'leased_by': self.leased_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -403,6 +424,22 @@ class RareMedicineResponse(BaseModel):
         db.UniqueConstraint('request_id', 'pharmacy_id', name='unique_response_per_pharmacy'),
     )
     
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'id': str(self.id),
+            'request_id': str(self.request_id),
+            'pharmacy_id': str(self.pharmacy_id),
+            'status': self.status,
+            'estimated_availability_date': self.estimated_availability_date.isoformat() if self.estimated_availability_date else None,
+            'estimated_price': float(self.estimated_price) if self.estimated_price else None,
+            'pharmacy_notes': self.pharmacy_notes,
+            'contact_person': self.contact_person,
+            'contact_phone': self.contact_phone,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+    
     def __repr__(self):
         return f'<RareMedicineResponse {self.status} - {self.pharmacy.name if self.pharmacy else "Unknown"}>'
 
@@ -423,10 +460,40 @@ class SalesTransaction(BaseModel):
     payment_status = db.Column(db.String(50), default='Paid')  # Pending, Paid, Partial, Refunded
     cashier_name = db.Column(db.String(255))
     notes = db.Column(db.Text)
+    idempotency_key = db.Column(db.String(255))  # Client-supplied key that makes checkout retries safe
     
     # Relationships
     items = db.relationship('SalesTransactionItem', backref='transaction', lazy='dynamic', cascade='all, delete-orphan')
     
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'idempotency_key', name='unique_idempotency_key_per_pharmacy'),
+    )
+    
+    def to_dict(self, include_items=True):
+        """Convert to dictionary for JSON serialization"""
+        result = {
+            'id': str(self.id),
+            'pharmacy_id': str(self.pharmacy_id),
+            'patient_id': str(self.patient_id) if self.patient_id else None,
+            'prescription_id': str(self.prescription_id) if self.prescription_id else None,
+            'transaction_number': self.transaction_number,
+            'transaction_date': self.transaction_date.isoformat() if self.transaction_date else None,
+            'subtotal': float(self.subtotal),
+            'tax_amount': float(self.tax_amount or 0),
+            'discount_amount': float(self.discount_amount or 0),
+            'total_amount': float(self.total_amount),
+            'payment_method': self.payment_method,
+            'payment_status': self.payment_status,
+            'cashier_name': self.cashier_name,
+            'notes': self.notes,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+        if include_items:
+            result['items'] = [item.to_dict() for item in self.items]
+        return result
+    
     def __repr__(self):
         return f'<SalesTransaction {self.transaction_number} - ₹{self.total_amount}>'
 
@@ -448,9 +515,252 @@ class SalesTransactionItem(BaseModel):
         db.CheckConstraint('unit_price > 0', name='check_positive_unit_price'),
     )
     
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'id': str(self.id),
+            'transaction_id': str(self.transaction_id),
+            'inventory_id': str(self.inventory_id) if self.inventory_id else None,
+            'medicine_name': self.medicine_name,
+            'batch_number': self.batch_number,
+            'quantity_sold': self.quantity_sold,
+            'unit_price': float(self.unit_price),
+            'total_price': float(self.total_price)
+        }
+    
     def __repr__(self):
         return f'<SalesTransactionItem {self.medicine_name} x{self.quantity_sold}>'
 
+class DailySalesRollup(BaseModel):
+    """Per-pharmacy daily sales totals; checkouts append deltas, compaction merges them"""
+    __tablename__ = 'daily_sales_rollups'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    sales_date = db.Column(db.Date, nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    discount_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    tax_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    total_revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('idx_daily_sales_pharmacy_date', 'pharmacy_id', 'sales_date'),
+    )
+    
+    def __repr__(self):
+        return f'<DailySalesRollup {self.sales_date} - ₹{self.total_revenue}>'
+
+class DailyMedicineSalesRollup(BaseModel):
+    """Per-pharmacy, per-medicine daily quantities and revenue"""
+    __tablename__ = 'daily_medicine_sales_rollups'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    sales_date = db.Column(db.Date, nullable=False)
+    medicine_id = db.Column(UUID(as_uuid=True), db.ForeignKey('medicines.id', ondelete='SET NULL'))
+    medicine_name = db.Column(db.String(255), nullable=False)
+    quantity_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('idx_daily_medicine_sales_pharmacy_date', 'pharmacy_id', 'sales_date'),
+    )
+    
+    def __repr__(self):
+        return f'<DailyMedicineSalesRollup {self.sales_date} {self.medicine_name} x{self.quantity_sold}>'
+
+class HeavyHitterSketch(BaseModel):
+    """Persisted Space-Saving sketch of one worker's events for one pharmacy-day"""
+    __tablename__ = 'heavy_hitter_sketches'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)  # sales, dispensed
+    window_date = db.Column(db.Date, nullable=False)
+    node_id = db.Column(db.String(255), nullable=False)  # Worker that produced the sketch
+    total = db.Column(db.Integer, nullable=False, default=0)
+    counters = db.Column(db.JSON, nullable=False)  # {item: [count, error]}
+    
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'kind', 'window_date', 'node_id', name='unique_sketch_per_node_day'),
+    )
+    
+    def __repr__(self):
+        return f'<HeavyHitterSketch {self.kind} {self.window_date} ({self.node_id})>'
+
+class DemandForecast(BaseModel):
+    """Forecast daily demand and derived reorder point per pharmacy and medicine"""
+    __tablename__ = 'demand_forecasts'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    medicine_id = db.Column(UUID(as_uuid=True), db.ForeignKey('medicines.id', ondelete='CASCADE'), nullable=False)
+    method = db.Column(db.String(20), nullable=False)  # ses, croston
+    daily_demand = db.Column(db.Float, nullable=False, default=0)
+    demand_std = db.Column(db.Float, nullable=False, default=0)  # One-day-ahead forecast error
+    lead_time_days = db.Column(db.Integer, nullable=False)
+    safety_stock = db.Column(db.Integer, nullable=False, default=0)
+    reorder_point = db.Column(db.Integer, nullable=False, default=0)
+    history_days = db.Column(db.Integer, nullable=False, default=0)
+    demand_days = db.Column(db.Integer, nullable=False, default=0)  # Days with at least one unit sold
+    forecast_date = db.Column(db.Date, nullable=False)
+    
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'medicine_id', name='unique_forecast_per_medicine'),
+    )
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'medicine_id': str(self.medicine_id),
+            'method': self.method,
+            'daily_demand': round(self.daily_demand, 3),
+            'demand_std': round(self.demand_std, 3),
+            'lead_time_days': self.lead_time_days,
+            'safety_stock': self.safety_stock,
+            'reorder_point': self.reorder_point,
+            'history_days': self.history_days,
+            'demand_days': self.demand_days,
+            'forecast_date': self.forecast_date.isoformat()
+        }
+    
+    def __repr__(self):
+        return f'<DemandForecast {self.medicine_id} ROP {self.reorder_point}>'
+
+class ExpiryRiskScore(BaseModel):
+    """Nightly estimate of the units of an inventory batch that will expire unsold"""
+    __tablename__ = 'expiry_risk_scores'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    inventory_id = db.Column(UUID(as_uuid=True), db.ForeignKey('inventory.id', ondelete='CASCADE'), nullable=False)
+    medicine_id = db.Column(UUID(as_uuid=True), db.ForeignKey('medicines.id', ondelete='CASCADE'), nullable=False)
+    medicine_name = db.Column(db.String(255), nullable=False)
+    batch_number = db.Column(db.String(100), nullable=False)
+    expiry_date = db.Column(db.Date, nullable=False)
+    quantity_available = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False, default=0)
+    expected_units_sold = db.Column(db.Integer, nullable=False, default=0)
+    units_at_risk = db.Column(db.Integer, nullable=False, default=0)
+    value_at_risk = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # units_at_risk at unit_price
+    risk_ratio = db.Column(db.Float, nullable=False, default=0)  # units_at_risk / quantity_available
+    scored_date = db.Column(db.Date, nullable=False)
+    
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('inventory_id', name='unique_expiry_risk_per_batch'),
+        db.Index('idx_expiry_risk_pharmacy_value', 'pharmacy_id', 'value_at_risk'),
+    )
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'inventory_id': str(self.inventory_id),
+            'medicine': {
+                'id': str(self.medicine_id),
+                'name': self.medicine_name
+            },
+            'batch_number': self.batch_number,
+            'expiry_date': self.expiry_date.isoformat(),
+            'days_to_expiry': (self.expiry_date - self.scored_date).days,
+            'quantity_available': self.quantity_available,
+            'daily_demand': round(self.daily_demand, 3),
+            'expected_units_sold': self.expected_units_sold,
+            'units_at_risk': self.units_at_risk,
+            'value_at_risk': float(self.value_at_risk),
+            'risk_ratio': round(self.risk_ratio, 4),
+            'scored_date': self.scored_date.isoformat()
+        }
+    
+    def __repr__(self):
+        return f'<ExpiryRiskScore {self.batch_number} - {self.units_at_risk} units>'
+
+class TransactionNumberCounter(BaseModel):
+    """High-water mark of transaction numbers handed out per pharmacy per day"""
+    __tablename__ = 'transaction_number_counters'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    business_date = db.Column(db.Date, nullable=False)
+    next_value = db.Column(db.Integer, nullable=False, default=1)  # First number not yet reserved
+    
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'business_date', name='unique_counter_per_pharmacy_day'),
+    )
+    
+    def __repr__(self):
+        return f'<TransactionNumberCounter {self.business_date} - {self.next_value}>'
+
+class InventoryValuationSnapshot(BaseModel):
+    """Stored FIFO stock valuation (and optional period margin) as of a date"""
+    __tablename__ = 'inventory_valuation_snapshots'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    as_of_date = db.Column(db.Date, nullable=False)
+    period_start = db.Column(db.Date)  # Start of the margin period, if one was computed
+    totals = db.Column(db.JSON, nullable=False)
+    medicines = db.Column(db.JSON, nullable=False)  # Per-medicine lines; amounts are decimal strings
+    
+    # Constraints
+    __table_args__ = (
+        db.Index('idx_valuation_snapshots_pharmacy_date', 'pharmacy_id', 'as_of_date'),
+    )
+    
+    def to_dict(self, include_medicines=True):
+        """Convert to dictionary for JSON serialization"""
+        result = {
+            'id': str(self.id),
+            'as_of': self.as_of_date.isoformat(),
+            'period_start': self.period_start.isoformat() if self.period_start else None,
+            'totals': self.totals,
+            'created_at': self.created_at.isoformat()
+        }
+        if include_medicines:
+            result['medicines'] = self.medicines
+        return result
+    
+    def __repr__(self):
+        return f'<InventoryValuationSnapshot {self.as_of_date}>'
+
+class ReportJob(BaseModel):
+    """Asynchronous report export and the file it produced"""
+    __tablename__ = 'report_jobs'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    report_type = db.Column(db.String(50), nullable=False)  # sales, inventory, expiry
+    format = db.Column(db.String(10), nullable=False)  # csv, xlsx
+    parameters = db.Column(db.JSON)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    row_count = db.Column(db.Integer)
+    file_path = db.Column(db.String(500))
+    file_size = db.Column(db.BigInteger)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime(timezone=True))
+    completed_at = db.Column(db.DateTime(timezone=True))
+    
+    # Constraints
+    __table_args__ = (
+        db.Index('idx_report_jobs_pharmacy_created', 'pharmacy_id', 'created_at'),
+    )
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'id': str(self.id),
+            'report_type': self.report_type,
+            'format': self.format,
+            'parameters': self.parameters or {},
+            'status': self.status,
+            'row_count': self.row_count,
+            'file_size': self.file_size,
+            'error': self.error,
+            'download_url': f'/api/analytics/reports/{self.id}/download' if self.status == 'completed' else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'created_at': self.created_at.isoformat()
+        }
+    
+    def __repr__(self):
+        return f'<ReportJob {self.report_type}.{self.format} - {self.status}>'
+
 class Notification(BaseModel):
     """Notification model"""
     __tablename__ = 'notifications'
@@ -461,19 +771,27 @@ class Notification(BaseModel):
     title = db.Column(db.String(255), nullable=False)
     message = db.Column(db.Text, nullable=False)
     data = db.Column(db.JSON)  # Additional structured data
-    read_status = db.Column(db.Boolean, default=False)
+    read_status = db.Column(db.Boolean, default=False)  # The one read flag; is_read is an alias
     action_required = db.Column(db.Boolean, default=False)
     expires_at = db.Column(db.DateTime(timezone=True))
     read_at = db.Column(db.DateTime(timezone=True))
     # Add fields for route compatibility
     user_id = db.Column(UUID(as_uuid=True))  # For user-specific notifications
     notification_type = db.Column(db.String(50))  # Alias for type
-    is_read = db.Column(db.Boolean, default=False)  # Alias for read_status
+    is_read = db.synonym('read_status')  # Alias for read_status
+    
+    # Constraints
+    # On PostgreSQL the table is partitioned by month on created_at (see
+    # services.notification_retention), with primary key (id, created_at)
+    __table_args__ = (
+        db.Index('idx_notifications_pharmacy_created', 'pharmacy_id', 'created_at'),
+        db.Index('idx_notifications_created', 'created_at'),
+        db.Index('idx_notifications_expires', 'expires_at'),
+    )
     
     def mark_as_read(self):
         """Mark notification as read"""
         self.read_status = True
-        self.is_read = True
         self.read_at = datetime.utcnow()
     
     def to_dict(self):
@@ -489,7 +807,7 @@ class Notification(BaseModel):
             'message': self.message,
             'data': self.data,
             'read_status': self.read_status,
-            'is_read': self.is_read or self.read_status,
+            'is_read': self.read_status,
             'action_required': self.action_required,
             'expires_at': self.expires_at.isoformat() if self.expires_at else None,
             'read_at': self.read_at.isoformat() if self.read_at else None,
@@ -500,6 +818,37 @@ class Notification(BaseModel):
     def __repr__(self):
         return f'<Notification {self.type} - {self.title}>'
 
+class NotificationCounter(BaseModel):
+    """Unread notifications per pharmacy, type and priority, kept in step with every write"""
+    __tablename__ = 'notification_counters'
+    
+    pharmacy_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    priority = db.Column(db.String(20), nullable=False)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Constraints
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'type', 'priority', name='unique_counter_per_type_priority'),
+    )
+    
+    def __repr__(self):
+        return f'<NotificationCounter {self.type}/{self.priority} - {self.unread}>'
+
+class PostalCodeLocation(BaseModel):
+    """Offline geocoding table mapping postal (PIN) codes to coordinates"""
+    __tablename__ = 'postal_code_locations'
+    
+    postal_code = db.Column(db.String(10), unique=True, nullable=False)
+    place_name = db.Column(db.String(255))
+    district = db.Column(db.String(255))
+    state = db.Column(db.String(255))
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    
+    def __repr__(self):
+        return f'<PostalCodeLocation {self.postal_code} ({self.latitude}, {self.longitude})>'
+
 class TranslationCache(BaseModel):
     """Translation cache model for multi-language support"""
     __tablename__ = 'translation_cache'
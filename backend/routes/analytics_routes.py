@@ -2,50 +2,37 @@
 Analytics Routes - Handle system analytics and reporting
 """
 
-from flask import Blueprint, request, jsonify
+import os
+import uuid
+
+from flask import Blueprint, current_app, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Medicine, Patient, Prescription, InventoryItem
+from models import Prescription, InventoryItem, InventoryValuationSnapshot, ReportJob
 from extensions import db
-from datetime import datetime, timedelta
+from datetime import datetime
+from services.cache import cached_endpoint
+from services.columnar_analytics import QueryError, columnar_analytics
+from services.dashboard import get_dashboard
+from services.patient_analytics import get_patient_demographics
+from services.reports import FORMATS as REPORT_FORMATS, create_report_job, fail_stale_jobs, report_runner
+from services.heavy_hitters import heavy_hitters
+from services.sales_rollups import PERIOD_DAYS, get_sales_summary
+from services.sales_timeseries import get_sales_timeseries, parse_date
+from services.valuation import compute_valuation, create_snapshot
 
 analytics_bp = Blueprint('analytics', __name__)
 
 @analytics_bp.route('/dashboard', methods=['GET'])
 @jwt_required()
 def get_dashboard_analytics():
-    """Get dashboard analytics overview"""
+    """Get dashboard analytics overview for the current pharmacy"""
     try:
-        # Basic counts
-        total_medicines = Medicine.query.count()
-        total_patients = Patient.query.count()
-        total_prescriptions = Prescription.query.count()
-        
-        # Recent activity (last 30 days)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_prescriptions = Prescription.query.filter(
-            Prescription.date_prescribed >= thirty_days_ago
-        ).count()
-        
-        # Low stock items
-        low_stock_items = InventoryItem.query.filter(
-            InventoryItem.quantity <= InventoryItem.min_threshold
-        ).count()
+        # One statement per pharmacy per cache TTL; writes invalidate it
+        dashboard = get_dashboard(get_jwt_identity())
         
         return jsonify({
             'success': True,
-            'data': {
-                'totals': {
-                    'medicines': total_medicines,
-                    'patients': total_patients,
-                    'prescriptions': total_prescriptions
-                },
-                'recent_activity': {
-                    'prescriptions_last_30_days': recent_prescriptions
-                },
-                'alerts': {
-                    'low_stock_items': low_stock_items
-                }
-            }
+            'data': dashboard
         }), 200
     except Exception as e:
         return jsonify({
@@ -55,28 +42,111 @@ def get_dashboard_analytics():
 
 @analytics_bp.route('/sales', methods=['GET'])
 @jwt_required()
+@cached_endpoint()
 def get_sales_analytics():
-    """Get sales analytics"""
+    """
+    Get sales analytics for the current pharmacy
+    
+    Query Parameters:
+    - period: daily, weekly, monthly (default) or yearly
+    """
     try:
         period = request.args.get('period', 'monthly')  # daily, weekly, monthly, yearly
         
-        # Sample sales data - replace with actual sales queries
-        sales_data = {
-            'period': period,
-            'total_revenue': 15750.00,
-            'total_orders': 324,
-            'average_order_value': 48.61,
-            'top_selling_medicines': [
-                {'name': 'Paracetamol', 'sales': 125, 'revenue': 1250.00},
-                {'name': 'Ibuprofen', 'sales': 98, 'revenue': 980.00},
-                {'name': 'Amoxicillin', 'sales': 76, 'revenue': 1520.00}
-            ]
-        }
+        # Answered from the daily rollup tables maintained at checkout
+        sales_data = get_sales_summary(get_jwt_identity(), period)
         
         return jsonify({
             'success': True,
             'data': sales_data
         }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@analytics_bp.route('/sales/timeseries', methods=['GET'])
+@jwt_required()
+@cached_endpoint()
+def get_sales_timeseries_analytics():
+    """
+    Get revenue, transactions and units sold per time bucket
+    
+    Query Parameters:
+    - interval: hour, day (default) or week
+    - start, end: inclusive local dates (YYYY-MM-DD); default to a recent window
+    - tz: IANA time zone; defaults to the pharmacy's time zone
+    """
+    try:
+        series = get_sales_timeseries(
+            get_jwt_identity(),
+            interval=request.args.get('interval', 'day'),
+            start_date=parse_date(request.args.get('start'), 'start'),
+            end_date=parse_date(request.args.get('end'), 'end'),
+            tz_name=request.args.get('tz')
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': series
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@analytics_bp.route('/pivot', methods=['POST'])
+@jwt_required()
+def pivot_analytics():
+    """
+    Slice sales or inventory facts for the current pharmacy
+    
+    Request Body:
+    - fact: sales (default) or inventory
+    - rows, columns: dimensions to group by; sales: medicine, category,
+      supplier, weekday, hour, date, month; inventory: medicine, category,
+      supplier, expiry_month
+    - measures: sales: quantity, revenue, lines; inventory: quantity,
+      stock_value, batches (default: all)
+    - filters: {dimension: [labels]}
+    - start, end: inclusive local dates (YYYY-MM-DD), sales only
+    - limit: maximum groups returned (default 1000)
+    """
+    try:
+        data = request.get_json() or {}
+        result = columnar_analytics.pivot(
+            get_jwt_identity(),
+            fact=data.get('fact', 'sales'),
+            rows=data.get('rows') or [],
+            columns=data.get('columns') or [],
+            measures=data.get('measures'),
+            filters=data.get('filters'),
+            start_date=parse_date(data.get('start'), 'start'),
+            end_date=parse_date(data.get('end'), 'end'),
+            limit=int(data.get('limit', 1000))
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        }), 200
+    except (QueryError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -85,6 +155,7 @@ def get_sales_analytics():
 
 @analytics_bp.route('/inventory', methods=['GET'])
 @jwt_required()
+@cached_endpoint()
 def get_inventory_analytics():
     """Get inventory analytics"""
     try:
@@ -126,6 +197,7 @@ def get_inventory_analytics():
 
 @analytics_bp.route('/prescriptions', methods=['GET'])
 @jwt_required()
+@cached_endpoint()
 def get_prescription_analytics():
     """Get prescription analytics"""
     try:
@@ -140,12 +212,13 @@ def get_prescription_analytics():
             Prescription.status == 'fulfilled'
         ).count()
         
-        # Most prescribed medicines
-        # This would require a more complex query in a real implementation
+        # Most prescribed medicines, from the dispensing heavy-hitters sketch
+        dispensed = heavy_hitters.top(
+            get_jwt_identity(), 'dispensed', days=PERIOD_DAYS.get(period, PERIOD_DAYS['monthly'])
+        )
         most_prescribed = [
-            {'medicine': 'Paracetamol', 'count': 145},
-            {'medicine': 'Ibuprofen', 'count': 112},
-            {'medicine': 'Amoxicillin', 'count': 89}
+            {'medicine': item['name'], 'count': item['count'], 'max_overcount': item['error']}
+            for item in dispensed['items']
         ]
         
         return jsonify({
@@ -157,6 +230,7 @@ def get_prescription_analytics():
                     'fulfilled': fulfilled_prescriptions
                 },
                 'most_prescribed': most_prescribed,
+                'most_prescribed_error_bound': dispensed['error_bound'],
                 'period': period
             }
         }), 200
@@ -168,60 +242,240 @@ def get_prescription_analytics():
 
 @analytics_bp.route('/patients', methods=['GET'])
 @jwt_required()
+@cached_endpoint()
 def get_patient_analytics():
     """Get patient analytics"""
     try:
-        # Patient demographics and activity
-        total_patients = Patient.query.count()
+        current_pharmacy_id = get_jwt_identity()
         
-        # Age distribution (sample data)
-        age_distribution = {
-            '0-18': 45,
-            '19-35': 123,
-            '36-55': 156,
-            '56-75': 89,
-            '75+': 34
-        }
+        # Demographics are computed in one grouped query; the response is cached per pharmacy
+        demographics = get_patient_demographics(current_pharmacy_id)
         
-        # Recent registrations
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        new_patients = Patient.query.filter(
-            Patient.created_at >= thirty_days_ago
-        ).count() if hasattr(Patient, 'created_at') else 0
+        return jsonify({
+            'success': True,
+            'data': demographics
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@analytics_bp.route('/valuation', methods=['GET'])
+@jwt_required()
+def get_valuation():
+    """
+    FIFO stock valuation per medicine, with gross margin when start is given
+    
+    Query Parameters:
+    - as_of: Valuation date (YYYY-MM-DD, default: today)
+    - start: First day of the margin period (YYYY-MM-DD, optional)
+    """
+    try:
+        as_of = parse_date(request.args.get('as_of'), 'as_of') or datetime.utcnow().date()
+        start = parse_date(request.args.get('start'), 'start')
         
         return jsonify({
             'success': True,
-            'data': {
-                'total_patients': total_patients,
-                'new_patients_last_30_days': new_patients,
-                'age_distribution': age_distribution
-            }
+            'data': compute_valuation(get_jwt_identity(), as_of, start)
         }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'message': str(e)
         }), 500
 
+@analytics_bp.route('/valuation/snapshots', methods=['POST'])
+@jwt_required()
+def create_valuation_snapshot():
+    """
+    Compute and store a valuation snapshot (e.g. at period close for tax filing)
+    
+    Request Body:
+    - as_of: Valuation date (YYYY-MM-DD, default: today)
+    - start: First day of the margin period (YYYY-MM-DD, optional)
+    """
+    try:
+        data = request.get_json() or {}
+        as_of = parse_date(data.get('as_of'), 'as_of') or datetime.utcnow().date()
+        start = parse_date(data.get('start'), 'start')
+        
+        snapshot = create_snapshot(get_jwt_identity(), as_of, start)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'data': snapshot.to_dict()
+        }), 201
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@analytics_bp.route('/valuation/snapshots', methods=['GET'])
+@jwt_required()
+def list_valuation_snapshots():
+    """List stored valuation snapshots (totals only), newest as-of date first"""
+    snapshots = InventoryValuationSnapshot.query.filter_by(
+        pharmacy_id=uuid.UUID(get_jwt_identity())
+    ).order_by(InventoryValuationSnapshot.as_of_date.desc(), InventoryValuationSnapshot.created_at.desc()).all()
+    
+    return jsonify({
+        'success': True,
+        'data': [snapshot.to_dict(include_medicines=False) for snapshot in snapshots]
+    }), 200
+
+@analytics_bp.route('/valuation/snapshots/<snapshot_id>', methods=['GET'])
+@jwt_required()
+def get_valuation_snapshot(snapshot_id):
+    """Get a stored valuation snapshot with its per-medicine lines"""
+    try:
+        snapshot_id = uuid.UUID(snapshot_id)
+    except ValueError:
+        snapshot_id = None
+    snapshot = InventoryValuationSnapshot.query.filter_by(
+        id=snapshot_id, pharmacy_id=uuid.UUID(get_jwt_identity())
+    ).first() if snapshot_id else None
+    if not snapshot:
+        return jsonify({
+            'success': False,
+            'message': 'Snapshot not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': snapshot.to_dict()
+    }), 200
+
 @analytics_bp.route('/reports/export', methods=['POST'])
 @jwt_required()
 def export_report():
-    """Export analytics report"""
+    """
+    Queue a report export; poll its status and download it when completed
+    
+    Request Body:
+    - type: sales, inventory or expiry
+    - format: csv (default) or xlsx
+    - start, end: inclusive dates (YYYY-MM-DD, UTC) for sales reports
+    - days: expiry horizon in days for expiry reports (default: 90)
+    """
     try:
-        data = request.get_json()
-        report_type = data.get('type')
-        format_type = data.get('format', 'pdf')  # pdf, excel, csv
+        data = request.get_json() or {}
+        parameters = {}
+        for field in ('start', 'end'):
+            value = parse_date(data.get(field), field)
+            if value:
+                parameters[field] = value.isoformat()
+        if data.get('days') is not None:
+            parameters['days'] = int(data['days'])
         
-        # Generate report based on type and format
-        # This would be implemented with actual report generation logic
+        job = create_report_job(get_jwt_identity(), data.get('type'), data.get('format', 'csv'), parameters)
+        db.session.commit()
+        report_runner.submit(job.id)
         
         return jsonify({
             'success': True,
-            'message': f'{report_type} report exported successfully',
-            'download_url': f'/api/analytics/downloads/{report_type}.{format_type}'
-        }), 200
-    except Exception as e:
+            'message': f'{job.report_type} report queued',
+            'data': job.to_dict(),
+            'status_url': f'/api/analytics/reports/{job.id}'
+        }), 202
+    except ValueError as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'message': str(e)
         }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@analytics_bp.route('/reports', methods=['GET'])
+@jwt_required()
+def list_reports():
+    """
+    List the pharmacy's recent report exports, newest first
+    
+    Query Parameters:
+    - limit: Maximum jobs returned (default: 20, max: 100)
+    """
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    _fail_stale_report_jobs()
+    jobs = ReportJob.query.filter_by(
+        pharmacy_id=uuid.UUID(get_jwt_identity())
+    ).order_by(ReportJob.created_at.desc()).limit(limit).all()
+    
+    return jsonify({
+        'success': True,
+        'data': [job.to_dict() for job in jobs]
+    }), 200
+
+def _fail_stale_report_jobs():
+    """Resolve the pharmacy's jobs lost to a restart, so pollers stop waiting on them"""
+    if fail_stale_jobs(current_app.config['REPORT_JOB_TIMEOUT_MINUTES'], get_jwt_identity()):
+        db.session.commit()
+
+def _get_report_job(job_id):
+    """The current pharmacy's report job, or None"""
+    try:
+        job_id = uuid.UUID(job_id)
+    except ValueError:
+        return None
+    _fail_stale_report_jobs()
+    return ReportJob.query.filter_by(id=job_id, pharmacy_id=uuid.UUID(get_jwt_identity())).first()
+
+@analytics_bp.route('/reports/<job_id>', methods=['GET'])
+@jwt_required()
+def get_report(job_id):
+    """Get a report export's status"""
+    job = _get_report_job(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Report not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': job.to_dict()
+    }), 200
+
+@analytics_bp.route('/reports/<job_id>/download', methods=['GET'])
+@jwt_required()
+def download_report(job_id):
+    """Download a completed report; supports Range requests for resumable downloads"""
+    job = _get_report_job(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Report not found'
+        }), 404
+    if job.status != 'completed' or not job.file_path or not os.path.exists(job.file_path):
+        return jsonify({
+            'success': False,
+            'message': f'Report is not available for download (status: {job.status})'
+        }), 409
+    
+    return send_file(
+        job.file_path,
+        mimetype=REPORT_FORMATS[job.format],
+        as_attachment=True,
+        download_name=f'{job.report_type}-report-{job.created_at:%Y%m%d}.{job.format}',
+        conditional=True,
+        max_age=0
+    )
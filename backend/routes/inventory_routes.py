@@ -3,7 +3,7 @@ Inventory management routes for Pharmacy Management System
 Professional inventory tracking with batch management
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from marshmallow import Schema, fields, ValidationError, validate
 from datetime import datetime, date
@@ -11,6 +11,8 @@ from sqlalchemy import func, and_, or_
 
 from extensions import db
 from models import Inventory, Medicine, Pharmacy, Notification
+from services.demand_forecast import THRESHOLD_SOURCES, get_low_stock_by_forecast
+from services.expiry_risk import get_expiry_risk
 
 inventory_bp = Blueprint('inventory', __name__)
 
@@ -363,8 +365,29 @@ def delete_inventory(inventory_id):
 def get_low_stock_items():
     """
     Get all low stock items for the pharmacy
+    
+    Query Parameters:
+    - threshold: manual (per-batch minimum_threshold) or forecast (per-medicine
+      reorder point from the demand forecast job); defaults to
+      LOW_STOCK_THRESHOLD_SOURCE
     """
     current_pharmacy_id = get_jwt_identity()
+    threshold_source = request.args.get('threshold') or current_app.config['LOW_STOCK_THRESHOLD_SOURCE']
+    if threshold_source not in THRESHOLD_SOURCES:
+        return jsonify({
+            'error': 'Invalid Parameter',
+            'message': f"threshold must be one of {', '.join(THRESHOLD_SOURCES)}",
+            'status_code': 400
+        }), 400
+    
+    if threshold_source == 'forecast':
+        items = get_low_stock_by_forecast(current_pharmacy_id)
+        return jsonify({
+            'low_stock_items': items,
+            'total_items': len(items),
+            'threshold_source': threshold_source,
+            'status_code': 200
+        })
     
     low_stock_items = db.session.query(Inventory).join(Medicine).filter(
         and_(
@@ -400,6 +423,7 @@ def get_low_stock_items():
     return jsonify({
         'low_stock_items': items,
         'total_items': len(items),
+        'threshold_source': threshold_source,
         'status_code': 200
     })
 
@@ -453,6 +477,40 @@ def get_expiring_items():
         'status_code': 200
     })
 
+@inventory_bp.route('/expiry-risk', methods=['GET'])
+@jwt_required()
+def get_expiry_risk_items():
+    """
+    Get batches expected to expire unsold, ranked by value at risk
+    
+    Scores are computed nightly by the score-expiry-risk job.
+    
+    Query Parameters:
+    - page: Page number (default: 1)
+    - per_page: Items per page (default: 20, max: 100)
+    - min_units: Only batches with at least this many units at risk (default: 1)
+    """
+    current_pharmacy_id = get_jwt_identity()
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 20, type=int), 100)
+    min_units = request.args.get('min_units', 1, type=int)
+    
+    scores = get_expiry_risk(current_pharmacy_id, page=page, per_page=per_page, min_units=min_units)
+    
+    return jsonify({
+        'expiry_risk_items': [score.to_dict() for score in scores.items],
+        'scored_date': scores.items[0].scored_date.isoformat() if scores.items else None,
+        'pagination': {
+            'page': scores.page,
+            'pages': scores.pages,
+            'per_page': scores.per_page,
+            'total': scores.total,
+            'has_next': scores.has_next,
+            'has_prev': scores.has_prev
+        },
+        'status_code': 200
+    })
+
 def create_low_stock_notification(pharmacy_id, inventory_item):
     """Create a low stock notification"""
     try:
@@ -2,27 +2,30 @@
 Notification Routes - Handle system notifications and alerts
 """
 
-from flask import Blueprint, request, jsonify
+import uuid
+from flask import Blueprint, Response, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Notification
 from extensions import db
+from services.events import broker, format_sse, stream_events
+from services.notifications import channel_for, mark_all_read, missed_notifications, unread_summary
 
 notification_bp = Blueprint('notification', __name__)
 
 @notification_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_notifications():
-    """Get all notifications for current user"""
+    """Get all notifications for current pharmacy"""
     try:
-        user_id = get_jwt_identity()
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
         read_status = request.args.get('read')
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
-        query = Notification.query.filter(Notification.user_id == user_id)
+        query = Notification.query.filter(Notification.pharmacy_id == current_pharmacy_id)
         
         if read_status is not None:
-            query = query.filter(Notification.is_read == (read_status.lower() == 'true'))
+            query = query.filter(Notification.read_status == (read_status.lower() == 'true'))
         
         notifications = query.order_by(Notification.created_at.desc()).paginate(
             page=page, 
@@ -46,15 +49,81 @@ def get_notifications():
             'message': str(e)
         }), 500
 
-@notification_bp.route('/<int:notification_id>', methods=['GET'])
+@notification_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_notifications():
+    """
+    Stream the current pharmacy's notifications (Server-Sent Events)
+    
+    Sends 'notification' messages (id: the notification id) and
+    'unread_count' messages, starting with the current unread count. A
+    reconnecting client's Last-Event-ID header (or ?last_event_id=) replays
+    what it missed; 'resync' means it should reload the list instead.
+    EventSource clients may pass the token as ?jwt=...
+    """
+    current_pharmacy_id = get_jwt_identity()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    # Subscribe before replaying so nothing falls in between
+    subscription = broker.subscribe(channel_for(current_pharmacy_id))
+    try:
+        messages = []
+        if last_event_id:
+            missed = missed_notifications(current_pharmacy_id, last_event_id)
+            if missed is None:
+                messages.append(format_sse({'event': 'resync'}, 'resync'))
+            else:
+                messages.extend(
+                    format_sse({'event': 'notification', 'notification': payload}, 'notification', payload['id'])
+                    for payload in missed
+                )
+        messages.append(format_sse({'event': 'unread_count', **unread_summary(current_pharmacy_id)}, 'unread_count'))
+    except Exception:
+        subscription.close()
+        raise
+    finally:
+        # Release the database connection; the stream itself never queries
+        db.session.remove()
+    
+    def render(payload):
+        event_id = payload['notification']['id'] if payload['event'] == 'notification' else None
+        return format_sse(payload, payload['event'], event_id)
+    
+    return Response(
+        stream_events(subscription, messages, keepalive=current_app.config['SSE_KEEPALIVE_SECONDS'], render=render),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@notification_bp.route('/unread-count', methods=['GET'])
+@jwt_required()
+def get_unread_count():
+    """
+    Get the current pharmacy's unread notification count
+    
+    Read from the maintained per-type/priority counters, not by counting
+    notifications, so it is cheap enough to poll for the badge.
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': unread_summary(get_jwt_identity())
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@notification_bp.route('/<notification_id>', methods=['GET'])
 @jwt_required()
 def get_notification(notification_id):
     """Get specific notification"""
     try:
-        user_id = get_jwt_identity()
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
         notification = Notification.query.filter(
-            Notification.id == notification_id,
-            Notification.user_id == user_id
+            Notification.id == uuid.UUID(notification_id),
+            Notification.pharmacy_id == current_pharmacy_id
         ).first_or_404()
         
         return jsonify({
@@ -72,15 +141,18 @@ def get_notification(notification_id):
 def create_notification():
     """Create new notification"""
     try:
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
         data = request.get_json()
         
         notification = Notification(
-            user_id=data.get('user_id'),
+            pharmacy_id=current_pharmacy_id,
             title=data.get('title'),
             message=data.get('message'),
-            notification_type=data.get('type', 'info'),
-            priority=data.get('priority', 'normal'),
-            is_read=False
+            type=data.get('type', 'System'),
+            priority=data.get('priority', 'Normal'),
+            data=data.get('data'),
+            action_required=data.get('action_required', False),
+            read_status=False
         )
         
         db.session.add(notification)
@@ -98,19 +170,18 @@ def create_notification():
             'message': str(e)
         }), 400
 
-@notification_bp.route('/<int:notification_id>/read', methods=['PUT'])
+@notification_bp.route('/<notification_id>/read', methods=['PUT'])
 @jwt_required()
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        user_id = get_jwt_identity()
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
         notification = Notification.query.filter(
-            Notification.id == notification_id,
-            Notification.user_id == user_id
+            Notification.id == uuid.UUID(notification_id),
+            Notification.pharmacy_id == current_pharmacy_id
         ).first_or_404()
         
-        notification.is_read = True
-        notification.read_at = db.func.now()
+        notification.mark_as_read()
         
         db.session.commit()
         
@@ -129,23 +200,15 @@ def mark_notification_read(notification_id):
 @notification_bp.route('/read-all', methods=['PUT'])
 @jwt_required()
 def mark_all_notifications_read():
-    """Mark all notifications as read for current user"""
+    """Mark all notifications as read for current pharmacy"""
     try:
-        user_id = get_jwt_identity()
-        
-        Notification.query.filter(
-            Notification.user_id == user_id,
-            Notification.is_read == False
-        ).update({
-            'is_read': True,
-            'read_at': db.func.now()
-        })
-        
+        marked = mark_all_read(get_jwt_identity())
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': 'All notifications marked as read'
+            'message': 'All notifications marked as read',
+            'data': {'marked': marked}
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -154,15 +217,15 @@ def mark_all_notifications_read():
             'message': str(e)
         }), 400
 
-@notification_bp.route('/<int:notification_id>', methods=['DELETE'])
+@notification_bp.route('/<notification_id>', methods=['DELETE'])
 @jwt_required()
 def delete_notification(notification_id):
     """Delete notification"""
     try:
-        user_id = get_jwt_identity()
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
         notification = Notification.query.filter(
-            Notification.id == notification_id,
-            Notification.user_id == user_id
+            Notification.id == uuid.UUID(notification_id),
+            Notification.pharmacy_id == current_pharmacy_id
         ).first_or_404()
         
         db.session.delete(notification)
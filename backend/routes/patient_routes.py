@@ -2,10 +2,13 @@
 Patient Routes - Handle patient registration and management
 """
 
+import uuid
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Patient
 from extensions import db
+from services.patient_dedup import find_duplicate_candidates, merge_patients, DEFAULT_MIN_SCORE
+from services.patient_timeline import get_patient_timeline, DEFAULT_TIMELINE_LIMIT
 
 patient_bp = Blueprint('patient', __name__)
 
@@ -49,6 +52,55 @@ def get_patients():
             'message': str(e)
         }), 500
 
+@patient_bp.route('/duplicates', methods=['GET'])
+@jwt_required()
+def get_duplicate_patients():
+    """Get candidate duplicate patient pairs"""
+    try:
+        min_score = float(request.args.get('min_score', DEFAULT_MIN_SCORE))
+        limit = int(request.args.get('limit', 100))
+        
+        candidates = find_duplicate_candidates(min_score=min_score, limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'data': candidates,
+            'total': len(candidates)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@patient_bp.route('/merge', methods=['POST'])
+@jwt_required()
+def merge_duplicate_patients():
+    """Merge duplicate patients into a primary patient record"""
+    try:
+        data = request.get_json()
+        
+        result = merge_patients(data.get('primary_id'), data.get('duplicate_ids') or [])
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Patients merged successfully',
+            'data': result
+        }), 200
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
 @patient_bp.route('/<int:patient_id>', methods=['GET'])
 @jwt_required()
 def get_patient(patient_id):
@@ -65,6 +117,56 @@ def get_patient(patient_id):
             'message': str(e)
         }), 404
 
+@patient_bp.route('/<patient_id>/timeline', methods=['GET'])
+@jwt_required()
+def get_timeline(patient_id):
+    """
+    Get a patient's prescriptions, dispensed items, purchases and rare
+    medicine requests as one chronological stream
+    
+    Query Parameters:
+    - cursor: next_cursor from the previous page
+    - limit: Events per page (default: 50, max: 200)
+    """
+    try:
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', DEFAULT_TIMELINE_LIMIT, type=int)
+        
+        # The first page carries the patient header so the screen needs a single request
+        patient = None
+        if not cursor:
+            patient = db.session.get(Patient, uuid.UUID(patient_id))
+            if not patient:
+                return jsonify({
+                    'success': False,
+                    'message': 'Patient not found'
+                }), 404
+        
+        events, next_cursor = get_patient_timeline(patient_id, cursor=cursor, limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'patient': patient.to_dict() if patient else None,
+                'events': events
+            },
+            'pagination': {
+                'limit': limit,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 @patient_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_patient():
@@ -6,18 +6,57 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Pharmacy
 from extensions import db
+from services.geo_index import pharmacy_geo_index, parse_point, geocode_address
+from services.sales_timeseries import resolve_timezone
 
 pharmacy_bp = Blueprint('pharmacy', __name__)
 
 @pharmacy_bp.route('/', methods=['GET'])
 def get_pharmacies():
-    """Get all pharmacies"""
+    """
+    Get all pharmacies
+    
+    Query Parameters:
+    - near: 'latitude,longitude'; returns the nearest pharmacies first
+    - k: Number of nearest pharmacies to return with near (default: 10, max: 100)
+    - radius_km: Only return pharmacies within this distance with near
+    """
     try:
-        pharmacies = Pharmacy.query.all()
+        near = request.args.get('near')
+        if not near:
+            pharmacies = Pharmacy.query.all()
+            return jsonify({
+                'success': True,
+                'data': [pharmacy.to_dict() for pharmacy in pharmacies]
+            }), 200
+        
+        lat, lng = parse_point(near)
+        k = min(request.args.get('k', 10, type=int), 100)
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        radius_km = request.args.get('radius_km', type=float)
+        
+        nearest = pharmacy_geo_index.nearest(lat, lng, k=k, max_distance_km=radius_km)
+        pharmacies = {
+            pharmacy.id: pharmacy
+            for pharmacy in Pharmacy.query.filter(Pharmacy.id.in_([pharmacy_id for _, pharmacy_id in nearest]))
+        }
+        
+        data = []
+        for distance_km, pharmacy_id in nearest:
+            pharmacy = pharmacies.get(pharmacy_id)
+            if pharmacy:
+                data.append({**pharmacy.to_dict(), 'distance_km': round(distance_km, 2)})
+        
         return jsonify({
             'success': True,
-            'data': [pharmacy.to_dict() for pharmacy in pharmacies]
+            'data': data
         }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -51,9 +90,17 @@ def create_pharmacy():
             address=data.get('address'),
             phone=data.get('phone'),
             email=data.get('email'),
-            license_number=data.get('license_number')
+            license_number=data.get('license_number'),
+            latitude=data.get('latitude'),
+            longitude=data.get('longitude')
         )
         
+        if data.get('timezone'):
+            pharmacy.timezone = resolve_timezone(data['timezone']).key
+        
+        if pharmacy.latitude is None or pharmacy.longitude is None:
+            pharmacy.latitude, pharmacy.longitude = geocode_address(pharmacy.address) or (None, None)
+        
         db.session.add(pharmacy)
         db.session.commit()
         
@@ -82,6 +129,14 @@ def update_pharmacy(pharmacy_id):
         pharmacy.phone = data.get('phone', pharmacy.phone)
         pharmacy.email = data.get('email', pharmacy.email)
         pharmacy.license_number = data.get('license_number', pharmacy.license_number)
+        if data.get('timezone'):
+            pharmacy.timezone = resolve_timezone(data['timezone']).key
+        
+        if 'latitude' in data and 'longitude' in data:
+            pharmacy.latitude = data['latitude']
+            pharmacy.longitude = data['longitude']
+        elif 'address' in data:
+            pharmacy.latitude, pharmacy.longitude = geocode_address(pharmacy.address) or (None, None)
         
         db.session.commit()
         
@@ -2,10 +2,16 @@
 Prescription Routes - Handle prescription management and processing
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import date
 from models import Prescription
 from extensions import db
+from services.prescription_items import create_prescription_items, sync_prescription_items
+from services.prescription_queue import channel_for, status_counts, publish_status_change
+from services.events import broker, format_sse, stream_events
+from services.allergy_screening import screen_prescription
+from services.heavy_hitters import record_dispensed
 
 prescription_bp = Blueprint('prescription', __name__)
 
@@ -49,6 +55,35 @@ def get_prescriptions():
             'message': str(e)
         }), 500
 
+@prescription_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_prescription_queue():
+    """
+    Stream prescription status changes for the current pharmacy (Server-Sent Events)
+    
+    The first message is a 'snapshot' with the per-status counters; every
+    following 'prescription_status' message carries the change and the
+    updated counters. EventSource clients may pass the token as ?jwt=...
+    """
+    current_pharmacy_id = get_jwt_identity()
+    
+    # Subscribe before taking the snapshot so no change falls in between
+    subscription = broker.subscribe(channel_for(current_pharmacy_id))
+    try:
+        snapshot = format_sse({'event': 'snapshot', 'counts': status_counts(current_pharmacy_id)}, 'snapshot')
+    except Exception:
+        subscription.close()
+        raise
+    finally:
+        # Release the database connection; the stream itself never queries
+        db.session.remove()
+    
+    return Response(
+        stream_events(subscription, [snapshot], keepalive=current_app.config['SSE_KEEPALIVE_SECONDS']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @prescription_bp.route('/<int:prescription_id>', methods=['GET'])
 @jwt_required()
 def get_prescription(prescription_id):
@@ -72,23 +107,39 @@ def create_prescription():
     try:
         data = request.get_json()
         
+        date_prescribed = data.get('date_prescribed')
+        if isinstance(date_prescribed, str):
+            date_prescribed = date.fromisoformat(date_prescribed)
+        
         prescription = Prescription(
             patient_id=data.get('patient_id'),
+            pharmacy_id=get_jwt_identity(),
             doctor_name=data.get('doctor_name'),
             doctor_license=data.get('doctor_license'),
             medicines=data.get('medicines'),
             instructions=data.get('instructions'),
-            date_prescribed=data.get('date_prescribed'),
+            date_prescribed=date_prescribed,
+            prescription_date=date_prescribed or date.today(),
             status='pending'
         )
         
         db.session.add(prescription)
+        db.session.flush()
+        
+        # Resolve the medicines against the catalog and store them as PrescriptionItem rows
+        items_created, unresolved = create_prescription_items(prescription, data.get('medicines'))
+        publish_status_change(prescription.pharmacy_id, prescription.id, None, prescription.status)
+        safety_alerts = screen_prescription(prescription)
+        
         db.session.commit()
         
         return jsonify({
             'success': True,
             'message': 'Prescription created successfully',
-            'data': prescription.to_dict()
+            'data': prescription.to_dict(),
+            'items_created': items_created,
+            'unresolved_medicines': unresolved,
+            'safety_alerts': safety_alerts
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -104,18 +155,30 @@ def update_prescription(prescription_id):
     try:
         prescription = Prescription.query.get_or_404(prescription_id)
         data = request.get_json()
+        previous_status = prescription.status
         
-        prescription.medicines = data.get('medicines', prescription.medicines)
         prescription.instructions = data.get('instructions', prescription.instructions)
         prescription.status = data.get('status', prescription.status)
+        publish_status_change(prescription.pharmacy_id, prescription.id, previous_status, prescription.status)
+        
+        response = {
+            'success': True,
+            'message': 'Prescription updated successfully'
+        }
+        if 'medicines' in data:
+            # Keep the PrescriptionItem rows that screening and the timeline read in step
+            prescription.medicines = data['medicines']
+            items_created, unresolved = sync_prescription_items(prescription, data['medicines'])
+            response.update({
+                'items_created': items_created,
+                'unresolved_medicines': unresolved,
+                'safety_alerts': screen_prescription(prescription)
+            })
         
         db.session.commit()
         
-        return jsonify({
-            'success': True,
-            'message': 'Prescription updated successfully',
-            'data': prescription.to_dict()
-        }), 200
+        response['data'] = prescription.to_dict()
+        return jsonify(response), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -126,18 +189,39 @@ def update_prescription(prescription_id):
 @prescription_bp.route('/<int:prescription_id>/fulfill', methods=['POST'])
 @jwt_required()
 def fulfill_prescription(prescription_id):
-    """Mark prescription as fulfilled"""
+    """
+    Mark prescription as fulfilled
+    
+    Items are screened against the patient's allergies and medical
+    conditions first; flagged prescriptions are rejected with 409 unless
+    the request body sets "override_safety_alerts": true.
+    """
     try:
         prescription = Prescription.query.get_or_404(prescription_id)
+        data = request.get_json(silent=True) or {}
+        
+        safety_alerts = screen_prescription(prescription)
+        if safety_alerts and not data.get('override_safety_alerts'):
+            return jsonify({
+                'success': False,
+                'message': 'Prescription flagged by allergy and contraindication screening',
+                'safety_alerts': safety_alerts
+            }), 409
+        
+        previous_status = prescription.status
         prescription.status = 'fulfilled'
         prescription.date_fulfilled = db.func.now()
+        publish_status_change(prescription.pharmacy_id, prescription.id, previous_status, prescription.status)
+        if previous_status != 'fulfilled':
+            record_dispensed(prescription)
         
         db.session.commit()
         
         return jsonify({
             'success': True,
             'message': 'Prescription fulfilled successfully',
-            'data': prescription.to_dict()
+            'data': prescription.to_dict(),
+            'safety_alerts': safety_alerts
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -153,6 +237,7 @@ def delete_prescription(prescription_id):
     try:
         prescription = Prescription.query.get_or_404(prescription_id)
         db.session.delete(prescription)
+        publish_status_change(prescription.pharmacy_id, prescription.id, prescription.status, None)
         db.session.commit()
         
         return jsonify({
@@ -4,8 +4,19 @@ Rare Medicine Routes - Handle rare medicine requests and sourcing
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import RareMedicineRequest
+import uuid
+from datetime import date
+from flask import current_app
+from models import RareMedicineRequest, RareMedicineResponse
 from extensions import db
+from services.rare_medicine_matching import DEFAULT_CANDIDATE_LIMIT, match_rare_request
+from services.rare_medicine_fanout import (
+    FANOUT_CANDIDATE_LIMIT, fan_out_request, normalize_urgency, record_response, urgency_order
+)
+from services.rare_medicine_queue import (
+    LeaseError, lease_next_request, renew_lease, release_lease, normalize_status,
+    DEFAULT_LEASE_SECONDS, PENDING_STATUS
+)
 
 rare_medicine_bp = Blueprint('rare_medicine', __name__)
 
@@ -23,6 +34,9 @@ def get_rare_medicine_requests():
         if status:
             query = query.filter(RareMedicineRequest.status == status)
         
+        # Most urgent first, then oldest first
+        query = query.order_by(urgency_order(), RareMedicineRequest.requested_date)
+        
         requests = query.paginate(
             page=page, 
             per_page=per_page, 
@@ -61,6 +75,216 @@ def get_rare_medicine_request(request_id):
             'message': str(e)
         }), 404
 
+def _lease_holder(data):
+    """Lease holder: the pharmacy, optionally narrowed to a staff member"""
+    holder = get_jwt_identity()
+    if data.get('staff'):
+        holder = f"{holder}:{data['staff']}"
+    return holder
+
+@rare_medicine_bp.route('/queue/lease', methods=['POST'])
+@jwt_required()
+def lease_next_rare_medicine_request():
+    """
+    Lease the next pending rare medicine request
+    
+    Request Body (optional):
+    {
+        "staff": "counter-2",
+        "lease_seconds": 300
+    }
+    
+    Requests are handed out Critical first, with waiting requests boosted
+    one urgency level per 12 hours. A lease that is not renewed or released
+    before it expires returns the request to the queue.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        rare_request = lease_next_request(
+            _lease_holder(data),
+            data.get('lease_seconds', DEFAULT_LEASE_SECONDS)
+        )
+        db.session.commit()
+        
+        if rare_request is None:
+            return jsonify({
+                'success': True,
+                'message': 'No pending rare medicine requests',
+                'data': None
+            }), 200
+        
+        return jsonify({
+            'success': True,
+            'data': rare_request.to_dict()
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@rare_medicine_bp.route('/<request_id>/lease/renew', methods=['POST'])
+@jwt_required()
+def renew_rare_medicine_lease(request_id):
+    """Extend the caller's lease on a rare medicine request"""
+    try:
+        data = request.get_json(silent=True) or {}
+        rare_request = renew_lease(request_id, _lease_holder(data), data.get('lease_seconds', DEFAULT_LEASE_SECONDS))
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'data': rare_request.to_dict()
+        }), 200
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 404
+    except LeaseError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+@rare_medicine_bp.route('/<request_id>/lease/release', methods=['POST'])
+@jwt_required()
+def release_rare_medicine_lease(request_id):
+    """Return a leased rare medicine request to the queue"""
+    try:
+        data = request.get_json(silent=True) or {}
+        rare_request = release_lease(request_id, _lease_holder(data))
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Lease released',
+            'data': rare_request.to_dict()
+        }), 200
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 404
+    except LeaseError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+@rare_medicine_bp.route('/<request_id>/candidates', methods=['GET'])
+@jwt_required()
+def get_rare_medicine_candidates(request_id):
+    """Get pharmacies holding the requested medicine, best match first"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        rare_request = db.session.get(RareMedicineRequest, uuid.UUID(request_id))
+        if not rare_request:
+            return jsonify({
+                'success': False,
+                'message': 'Rare medicine request not found'
+            }), 404
+        
+        match = match_rare_request(rare_request, limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'data': match
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@rare_medicine_bp.route('/<request_id>/responses', methods=['GET'])
+@jwt_required()
+def get_rare_medicine_responses(request_id):
+    """Get pharmacy responses to a rare medicine request"""
+    try:
+        responses = RareMedicineResponse.query.filter(
+            RareMedicineResponse.request_id == uuid.UUID(request_id)
+        ).order_by(RareMedicineResponse.created_at).all()
+        
+        return jsonify({
+            'success': True,
+            'data': [response.to_dict() for response in responses]
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+@rare_medicine_bp.route('/<request_id>/responses', methods=['POST'])
+@jwt_required()
+def respond_to_rare_medicine_request(request_id):
+    """
+    Record the current pharmacy's response to a rare medicine request
+    
+    Safe to retry: a pharmacy has at most one response per request, and a
+    repeated submission returns the stored response with status 200.
+    """
+    try:
+        data = request.get_json() or {}
+        current_pharmacy_id = uuid.UUID(get_jwt_identity())
+        
+        if data.get('status') not in ('Accepted', 'Declined'):
+            return jsonify({
+                'success': False,
+                'message': 'status must be Accepted or Declined'
+            }), 400
+        
+        rare_request = db.session.get(RareMedicineRequest, uuid.UUID(request_id))
+        if not rare_request:
+            return jsonify({
+                'success': False,
+                'message': 'Rare medicine request not found'
+            }), 404
+        
+        if isinstance(data.get('estimated_availability_date'), str):
+            data['estimated_availability_date'] = date.fromisoformat(data['estimated_availability_date'])
+        
+        response, created = record_response(rare_request.id, current_pharmacy_id, data)
+        if created and not rare_request.response_date:
+            rare_request.response_date = db.func.now()
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Response recorded successfully' if created else 'Response already recorded',
+            'data': response.to_dict()
+        }), 201 if created else 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
 @rare_medicine_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_rare_medicine_request():
@@ -75,20 +299,35 @@ def create_rare_medicine_request():
             manufacturer=data.get('manufacturer'),
             dosage=data.get('dosage'),
             quantity_needed=data.get('quantity_needed'),
-            urgency_level=data.get('urgency_level'),
+            urgency_level=normalize_urgency(data.get('urgency_level')),
             doctor_prescription=data.get('doctor_prescription'),
             patient_contact=data.get('patient_contact'),
             notes=data.get('notes'),
-            status='pending'
+            status=PENDING_STATUS
         )
         
         db.session.add(rare_request)
         db.session.commit()
         
+        # Rank the pharmacies that already hold the medicine, once for both
+        # the response and the fan-out
+        match = match_rare_request(rare_request, limit=FANOUT_CANDIDATE_LIMIT)
+        
+        # Notify candidate pharmacies; the fan-out-rare-requests job retries on failure
+        pharmacies_notified = 0
+        try:
+            pharmacies_notified = fan_out_request(rare_request, match)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f'Rare medicine fan-out failed for {rare_request.id}: {e}')
+        
         return jsonify({
             'success': True,
             'message': 'Rare medicine request created successfully',
-            'data': rare_request.to_dict()
+            'data': rare_request.to_dict(),
+            'candidates': match['candidates'][:DEFAULT_CANDIDATE_LIMIT],
+            'pharmacies_notified': pharmacies_notified
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -105,7 +344,7 @@ def update_rare_medicine_request(request_id):
         rare_request = RareMedicineRequest.query.get_or_404(request_id)
         data = request.get_json()
         
-        rare_request.status = data.get('status', rare_request.status)
+        rare_request.status = normalize_status(data.get('status', rare_request.status))
         rare_request.notes = data.get('notes', rare_request.notes)
         rare_request.estimated_cost = data.get('estimated_cost', rare_request.estimated_cost)
         rare_request.estimated_delivery = data.get('estimated_delivery', rare_request.estimated_delivery)
@@ -0,0 +1,125 @@
+"""
+Sales Routes - Handle point-of-sale checkout and sales transactions
+"""
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+import uuid
+from models import SalesTransaction
+from extensions import db
+from services.checkout import CheckoutError, checkout
+
+sales_bp = Blueprint('sales', __name__)
+
+@sales_bp.route('/checkout', methods=['POST'])
+@jwt_required()
+def create_checkout():
+    """
+    Check out a cart as one sales transaction
+
+    Headers:
+    - Idempotency-Key: client-generated key; retrying with the same key
+      returns the original transaction instead of charging again
+
+    Request Body:
+    - items: list of {inventory_id, quantity}
+    - payment_method: Cash, Card, UPI, Insurance or Credit (default Cash)
+    - discount_amount or discount_percent: optional transaction discount
+    - tax_rate: optional tax percentage (defaults to DEFAULT_SALES_TAX_RATE)
+    - patient_id, cashier_name, notes: optional
+    - prescription_id: optional; the units sold are recorded as dispensed
+      on the prescription's items
+    """
+    try:
+        data = request.get_json() or {}
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+        transaction, created = checkout(get_jwt_identity(), data, idempotency_key)
+        if created:
+            db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': 'Checkout completed successfully' if created else 'Checkout already completed',
+            'data': transaction.to_dict()
+        }), 201 if created else 200
+    except CheckoutError as e:
+        db.session.rollback()
+        response = {
+            'success': False,
+            'message': str(e)
+        }
+        if e.details:
+            response['details'] = e.details
+        return jsonify(response), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@sales_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_sales_transactions():
+    """Get sales transactions for the current pharmacy, newest first"""
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+
+        transactions = SalesTransaction.query.filter_by(
+            pharmacy_id=uuid.UUID(get_jwt_identity())
+        ).order_by(
+            SalesTransaction.transaction_date.desc()
+        ).paginate(
+            page=page,
+            per_page=per_page,
+            error_out=False
+        )
+
+        return jsonify({
+            'success': True,
+            'data': [transaction.to_dict(include_items=False) for transaction in transactions.items],
+            'pagination': {
+                'page': page,
+                'pages': transactions.pages,
+                'per_page': per_page,
+                'total': transactions.total
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@sales_bp.route('/<transaction_id>', methods=['GET'])
+@jwt_required()
+def get_sales_transaction(transaction_id):
+    """Get a sales transaction with its items"""
+    try:
+        transaction = SalesTransaction.query.filter_by(
+            id=uuid.UUID(transaction_id),
+            pharmacy_id=uuid.UUID(get_jwt_identity())
+        ).first()
+
+        if not transaction:
+            return jsonify({
+                'success': False,
+                'message': 'Sales transaction not found'
+            }), 404
+
+        return jsonify({
+            'success': True,
+            'data': transaction.to_dict()
+        }), 200
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid transaction id'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
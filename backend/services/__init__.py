@@ -0,0 +1,4 @@
+"""
+Service layer for Pharmacy Management System
+Business logic shared between routes, CLI commands and background jobs
+"""
@@ -0,0 +1,249 @@
+"""
+Allergy Screening Service - Check prescription items against patient allergies and conditions
+A patient's allergy and condition terms are expanded through a local
+ingredient/class rule table and compiled into one Aho-Corasick automaton,
+cached per patient version, so every item is screened in a single pass
+"""
+
+import re
+import threading
+from collections import OrderedDict, deque
+
+# Allergy term -> ingredients and classes that must not be dispensed
+ALLERGY_RULES = {
+    'penicillin': ['penicillin', 'amoxicillin', 'ampicillin', 'cloxacillin', 'dicloxacillin',
+                   'piperacillin', 'benzylpenicillin', 'phenoxymethylpenicillin'],
+    'cephalosporin': ['cephalosporin', 'cefalexin', 'cephalexin', 'cefixime', 'ceftriaxone',
+                      'cefuroxime', 'cefpodoxime', 'cefadroxil'],
+    'sulfa': ['sulfonamide', 'sulfamethoxazole', 'sulfasalazine', 'sulfadiazine', 'cotrimoxazole'],
+    'sulpha': ['sulfonamide', 'sulfamethoxazole', 'sulfasalazine', 'sulfadiazine', 'cotrimoxazole'],
+    'aspirin': ['aspirin', 'acetylsalicylic acid'],
+    'nsaid': ['nsaid', 'non-steroidal anti-inflammatory', 'ibuprofen', 'diclofenac', 'naproxen',
+              'aceclofenac', 'ketorolac', 'piroxicam', 'mefenamic acid', 'aspirin'],
+    'ibuprofen': ['ibuprofen'],
+    'paracetamol': ['paracetamol', 'acetaminophen'],
+    'codeine': ['codeine'],
+    'opioid': ['opioid', 'codeine', 'morphine', 'tramadol', 'oxycodone', 'fentanyl', 'tapentadol'],
+    'macrolide': ['macrolide', 'azithromycin', 'clarithromycin', 'erythromycin'],
+    'fluoroquinolone': ['fluoroquinolone', 'quinolone', 'ciprofloxacin', 'levofloxacin',
+                        'ofloxacin', 'moxifloxacin', 'norfloxacin'],
+    'tetracycline': ['tetracycline', 'doxycycline', 'minocycline'],
+    'iodine': ['iodine', 'povidone-iodine', 'iodinated contrast'],
+    'latex': ['latex'],
+    'lactose': ['lactose']
+}
+
+# Medical condition -> ingredients and classes that are contraindicated
+CONDITION_RULES = {
+    'asthma': ['propranolol', 'non-selective beta blocker', 'aspirin'],
+    'peptic ulcer': ['nsaid', 'non-steroidal anti-inflammatory', 'ibuprofen', 'diclofenac',
+                     'naproxen', 'aspirin', 'ketorolac'],
+    'kidney disease': ['nsaid', 'non-steroidal anti-inflammatory', 'ibuprofen', 'diclofenac',
+                       'naproxen', 'metformin'],
+    'renal failure': ['nsaid', 'non-steroidal anti-inflammatory', 'ibuprofen', 'diclofenac',
+                      'naproxen', 'metformin'],
+    'liver disease': ['paracetamol', 'acetaminophen', 'methotrexate', 'ketoconazole'],
+    'pregnancy': ['isotretinoin', 'warfarin', 'methotrexate', 'misoprostol', 'valproate',
+                  'doxycycline', 'tetracycline', 'ace inhibitor', 'enalapril', 'ramipril'],
+    'pregnant': ['isotretinoin', 'warfarin', 'methotrexate', 'misoprostol', 'valproate',
+                 'doxycycline', 'tetracycline', 'ace inhibitor', 'enalapril', 'ramipril'],
+    'g6pd': ['primaquine', 'dapsone', 'nitrofurantoin', 'rasburicase'],
+    'myasthenia gravis': ['aminoglycoside', 'gentamicin', 'fluoroquinolone', 'ciprofloxacin'],
+    'glaucoma': ['atropine', 'anticholinergic'],
+    'epilepsy': ['tramadol', 'bupropion'],
+    'heart failure': ['pioglitazone', 'nsaid', 'verapamil']
+}
+
+AUTOMATON_CACHE_SIZE = 4096
+_TERM_SPLIT = re.compile(r'[,;/\n]|\band\b', re.IGNORECASE)
+
+class AhoCorasick:
+    """Multi-pattern matcher over lowercase text with whole-word matches"""
+
+    def __init__(self, patterns):
+        """patterns maps a lowercase pattern string to an arbitrary payload"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for pattern, payload in patterns.items():
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append((pattern, payload))
+
+        # Breadth-first construction of failure links
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def search(self, text):
+        """Yield (pattern, payload) for every whole-word occurrence in text"""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, payload in self._output[state]:
+                start = index - len(pattern) + 1
+                end = index + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    yield pattern, payload
+
+def _split_terms(text):
+    """Split free-text allergies/conditions into normalized terms"""
+    terms = []
+    for term in _TERM_SPLIT.split(text or ''):
+        term = re.sub(r'\s+', ' ', term).strip().lower()
+        term = re.sub(r'\s*(allergy|allergic|intolerance)$', '', term)
+        if term and term not in ('none', 'nil', 'na', 'n/a', 'no known allergies', 'nka', 'nkda'):
+            terms.append(term)
+    return terms
+
+def _expand(terms, rules, kind, include_term):
+    """
+    Expand patient terms through a rule table into automaton patterns
+
+    An allergy term also matches itself; a condition term must not, since
+    medicines name the condition they treat ("anti-asthma bronchodilator").
+    """
+    patterns = {}
+    for term in terms:
+        triggers = {term} if include_term else set()
+        for rule_term, rule_triggers in rules.items():
+            # "penicillins", "sulfa drugs" and similar still hit the rule
+            if re.search(rf'\b{re.escape(rule_term)}', term):
+                triggers.update(rule_triggers)
+        for trigger in triggers:
+            patterns.setdefault(trigger, []).append((kind, term))
+    return patterns
+
+def compile_patient_matcher(allergies, medical_conditions):
+    """
+    Compile a patient's allergies and conditions into one automaton
+
+    >>> matcher = compile_patient_matcher('Penicillin', 'Asthma; Pregnancy')
+    >>> [pattern for pattern, _ in matcher.search('salbutamol | anti-asthma bronchodilator')]
+    []
+    >>> [pattern for pattern, _ in matcher.search('folic acid | pregnancy supplement')]
+    []
+    >>> [pattern for pattern, _ in matcher.search('propranolol')]
+    ['propranolol']
+    >>> [pattern for pattern, _ in matcher.search('penicillin v')]
+    ['penicillin']
+    """
+    patterns = _expand(_split_terms(allergies), ALLERGY_RULES, 'allergy', include_term=True)
+    conditions = _expand(_split_terms(medical_conditions), CONDITION_RULES, 'contraindication', include_term=False)
+    for trigger, sources in conditions.items():
+        patterns.setdefault(trigger, []).extend(sources)
+    return AhoCorasick(patterns)
+
+_matcher_cache = OrderedDict()
+_matcher_lock = threading.Lock()
+
+def get_patient_matcher(patient):
+    """Return the compiled matcher for a patient, cached per patient version"""
+    key = (patient.id, patient.updated_at)
+    with _matcher_lock:
+        matcher = _matcher_cache.get(key)
+        if matcher is not None:
+            _matcher_cache.move_to_end(key)
+            return matcher
+
+    matcher = compile_patient_matcher(patient.allergies, patient.medical_conditions)
+    with _matcher_lock:
+        _matcher_cache[key] = matcher
+        while len(_matcher_cache) > AUTOMATON_CACHE_SIZE:
+            _matcher_cache.popitem(last=False)
+    return matcher
+
+def medicine_search_text(medicine):
+    """Text of a medicine that is screened: names, composition and class"""
+    return ' | '.join(filter(None, (
+        medicine.name,
+        medicine.generic_name,
+        medicine.composition,
+        medicine.therapeutic_class
+    ))).lower()
+
+def _screen(patient, targets):
+    """Screen (medicine_id, name, text) targets; returns the alerts"""
+    matcher = get_patient_matcher(patient)
+    if not matcher:
+        return []
+
+    alerts = []
+    seen = set()
+    for medicine_id, name, text in targets:
+        for matched, sources in matcher.search(text):
+            for kind, patient_term in sources:
+                key = (medicine_id or name, kind, patient_term)
+                if key in seen:
+                    continue
+                seen.add(key)
+                alerts.append({
+                    'type': kind,
+                    'severity': 'High' if kind == 'allergy' else 'Moderate',
+                    'medicine_id': str(medicine_id) if medicine_id else None,
+                    'medicine_name': name,
+                    'matched_term': matched,
+                    'patient_term': patient_term
+                })
+    return alerts
+
+def screen_medicines(patient, medicines):
+    """
+    Screen medicines against a patient's allergies and medical conditions
+
+    Returns a list of alerts; an empty list means nothing was flagged.
+    """
+    return _screen(patient, ((medicine.id, medicine.name, medicine_search_text(medicine)) for medicine in medicines))
+
+def screen_names(patient, names):
+    """Screen free-text medicine names that are not in the catalog"""
+    return _screen(patient, ((None, name, name.lower()) for name in names))
+
+def screen_prescription(prescription):
+    """
+    Screen every item of a prescription against its patient
+
+    Catalog items are screened on their names, composition and class;
+    medicines that are not in the catalog on the name the prescription gives.
+    """
+    from extensions import db
+    from models import Medicine, PrescriptionItem
+    from services.prescription_items import parse_medicine_entries
+
+    patient = prescription.patient
+    if patient is None or not (patient.allergies or patient.medical_conditions):
+        return []
+
+    medicines = db.session.query(Medicine).join(
+        PrescriptionItem, PrescriptionItem.medicine_id == Medicine.id
+    ).filter(PrescriptionItem.prescription_id == prescription.id).all()
+
+    try:
+        entries = parse_medicine_entries(prescription.medicines)
+    except ValueError:
+        entries = []
+    catalog = {medicine.id for medicine in medicines} | {medicine.name.lower() for medicine in medicines}
+    names = [
+        entry['name'] for entry in entries
+        if entry['name'] and entry['medicine_id'] not in catalog and entry['name'].lower() not in catalog
+    ]
+    return screen_medicines(patient, medicines) + screen_names(patient, names)
@@ -0,0 +1,234 @@
+"""
+In-process caching helpers
+Short-lived, per-worker caches for expensive read-only queries
+"""
+
+import threading
+import time
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+class TTLCache:
+    """Thread-safe dictionary whose entries expire after a fixed TTL"""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ttl seconds (defaults to the cache TTL)"""
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._evict()
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """Return the cached value, computing and storing it on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when key is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _evict(self):
+        """Drop expired entries, then the entry closest to expiry if still full"""
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at < now]:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda key: self._entries[key][0])
+            del self._entries[oldest]
+
+class CacheWaitTimeout(TimeoutError):
+    """A coalesced caller gave up waiting for another caller's computation"""
+
+class _Flight:
+    """One in-progress computation that concurrent callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class StaleWhileRevalidateCache:
+    """
+    Cache that serves stale entries while one background refresh runs
+
+    An entry is fresh for `ttl` seconds and may then be served stale for
+    another `stale_ttl` seconds. Concurrent misses for the same key are
+    coalesced: one caller computes (singleflight), the rest wait for its
+    result, for at most wait_timeout seconds.
+    """
+
+    def __init__(self, ttl, stale_ttl, max_entries=1024, wait_timeout=30):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries = {}  # key -> (fresh_until, stale_until, value)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute, refresh=None, cacheable=None, ttl=None, stale_ttl=None):
+        """
+        Return the value for key
+
+        compute() runs in the caller's thread on a miss. When the entry is
+        stale, refresh(run) is called once to start a background refresh;
+        run(fn=compute) computes and stores the new value and must be called
+        exactly once. Without refresh, stale entries are recomputed inline.
+        cacheable(value) can veto storing a result. Raises CacheWaitTimeout
+        when another caller's computation takes longer than wait_timeout.
+        """
+        ttl = ttl or self.ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        now = time.monotonic()
+
+        serve_stale = start_refresh = leader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[0]:
+                return entry[2]
+            if entry is not None and now < entry[1] and refresh is not None:
+                serve_stale = True
+                if key not in self._flights:
+                    self._flights[key] = _Flight()
+                    start_refresh = True
+            else:
+                flight = self._flights.get(key)
+                if flight is None:
+                    leader = True
+                    flight = self._flights[key] = _Flight()
+
+        if serve_stale:
+            if start_refresh:
+                refresh(lambda fn=compute: self._complete(key, fn, cacheable, ttl, stale_ttl))
+            return entry[2]
+        if leader:
+            return self._complete(key, compute, cacheable, ttl, stale_ttl)
+
+        if not flight.done.wait(self.wait_timeout):
+            raise CacheWaitTimeout(f'Timed out after {self.wait_timeout}s waiting for {key!r}')
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _complete(self, key, compute, cacheable, ttl, stale_ttl):
+        """Run a flight's computation, store the result and release waiters"""
+        with self._lock:
+            flight = self._flights[key]
+        try:
+            value = compute()
+            flight.value = value
+            if cacheable is None or cacheable(value):
+                now = time.monotonic()
+                with self._lock:
+                    if len(self._entries) >= self.max_entries and key not in self._entries:
+                        self._evict(now)
+                    self._entries[key] = (now + ttl, now + ttl + stale_ttl, value)
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when key is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _evict(self, now):
+        """Drop entries past their stale window, then the oldest if still full"""
+        for key in [key for key, entry in self._entries.items() if entry[1] < now]:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda key: self._entries[key][0])
+            del self._entries[oldest]
+
+_endpoint_cache = StaleWhileRevalidateCache(ttl=60, stale_ttl=300)
+
+def cached_endpoint(ttl=None, stale_ttl=None):
+    """
+    Cache a JWT-protected GET endpoint per (pharmacy, endpoint, params)
+
+    Apply below @jwt_required(). Only 200 responses are cached. Stale
+    responses are served while a background thread re-runs the view in a
+    copy of the original request, so a burst of dashboard loads costs one
+    computation.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            app = current_app._get_current_object()
+            key = (
+                get_jwt_identity(),
+                request.endpoint,
+                tuple(sorted(request.args.items(multi=True))),
+                tuple(sorted(kwargs.items()))
+            )
+            path, query_string = request.path, request.query_string.decode('latin-1')
+            headers = {'Authorization': request.headers.get('Authorization', '')}
+
+            def render():
+                response = app.make_response(view(*args, **kwargs))
+                return response.get_data(), response.status_code, response.mimetype
+
+            def refresh(run):
+                def render_in_copy():
+                    with app.test_request_context(path, query_string=query_string, headers=headers):
+                        verify_jwt_in_request()
+                        return render()
+
+                def task():
+                    try:
+                        run(render_in_copy)
+                    except Exception as e:
+                        # Keep serving the stale entry until it expires
+                        app.logger.warning(f'Background refresh of {key[1]} failed: {e}')
+                threading.Thread(target=task, name='analytics-refresh', daemon=True).start()
+
+            try:
+                body, status, mimetype = _endpoint_cache.get(
+                    key, render, refresh,
+                    cacheable=lambda result: result[1] == 200,
+                    ttl=ttl or app.config['ANALYTICS_CACHE_TTL'],
+                    stale_ttl=app.config['ANALYTICS_STALE_TTL'] if stale_ttl is None else stale_ttl
+                )
+            except CacheWaitTimeout:
+                return jsonify({
+                    'success': False,
+                    'message': 'Analytics are still being computed, please retry shortly'
+                }), 503, {'Retry-After': '5'}
+            return Response(body, status=status, mimetype=mimetype)
+        return wrapper
+    return decorator
@@ -0,0 +1,228 @@
+"""
+Checkout Service - Record point-of-sale transactions
+A checkout reads its batches once, inserts the transaction and all of its
+items, and decrements stock with one conditional UPDATE, all in one
+database transaction. An idempotency key makes client retries safe.
+"""
+
+import uuid
+from datetime import datetime, date
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+from flask import current_app
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Inventory, Medicine, Prescription, SalesTransaction, SalesTransactionItem
+from services.heavy_hitters import heavy_hitters
+from services.prescription_items import record_dispensed_items
+from services.sales_rollups import record_sale
+from services.transaction_numbers import generate_transaction_number
+
+CENT = Decimal('0.01')
+PAYMENT_METHODS = ('Cash', 'Card', 'UPI', 'Insurance', 'Credit')
+
+class CheckoutError(Exception):
+    """A checkout that cannot be completed; status_code is the HTTP status"""
+
+    def __init__(self, message, status_code=400, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+def _money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def _decimal(value, field):
+    try:
+        result = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise CheckoutError(f'{field} must be a number.')
+    if not result.is_finite():
+        raise CheckoutError(f'{field} must be a finite number.')
+    if result < 0:
+        raise CheckoutError(f'{field} cannot be negative.')
+    return result
+
+def _parse_lines(items):
+    """Validate cart lines and merge repeated batches: {inventory_id: quantity}"""
+    if not items:
+        raise CheckoutError('At least one item is required.')
+
+    quantities = {}
+    for item in items:
+        try:
+            inventory_id = uuid.UUID(str(item.get('inventory_id')))
+            quantity = int(item.get('quantity'))
+        except (TypeError, ValueError, AttributeError):
+            raise CheckoutError('Each item needs a valid inventory_id and integer quantity.')
+        if quantity <= 0:
+            raise CheckoutError('Item quantities must be positive.')
+        quantities[inventory_id] = quantities.get(inventory_id, 0) + quantity
+    return quantities
+
+def _prescription_id(pharmacy_id, value):
+    """The referenced prescription's id, which must belong to the pharmacy"""
+    if not value:
+        return None
+    try:
+        prescription_id = uuid.UUID(str(value))
+    except ValueError:
+        raise CheckoutError('prescription_id must be a valid id.')
+    found = db.session.execute(
+        select(Prescription.id).where(Prescription.id == prescription_id, Prescription.pharmacy_id == pharmacy_id)
+    ).scalar()
+    if found is None:
+        raise CheckoutError('Prescription not found.', 404)
+    return prescription_id
+
+def find_by_idempotency_key(pharmacy_id, idempotency_key):
+    if not idempotency_key:
+        return None
+    return SalesTransaction.query.filter_by(
+        pharmacy_id=pharmacy_id,
+        idempotency_key=idempotency_key
+    ).first()
+
+def checkout(pharmacy_id, data, idempotency_key=None):
+    """
+    Create a sales transaction and decrement the sold batches
+
+    Returns (transaction, created). A repeated idempotency key returns the
+    original transaction with created=False and changes nothing. The caller
+    is responsible for committing, and for rolling back on CheckoutError.
+    """
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+
+    existing = find_by_idempotency_key(pharmacy_id, idempotency_key)
+    if existing:
+        return existing, False
+
+    quantities = _parse_lines(data.get('items'))
+    payment_method = data.get('payment_method') or 'Cash'
+    if payment_method not in PAYMENT_METHODS:
+        raise CheckoutError(f"payment_method must be one of {', '.join(PAYMENT_METHODS)}.")
+    prescription_id = _prescription_id(pharmacy_id, data.get('prescription_id'))
+
+    # One read for every batch in the cart, scoped to the caller's pharmacy
+    batches = {
+        row.id: row for row in db.session.execute(
+            select(
+                Inventory.id,
+                Inventory.medicine_id,
+                Inventory.batch_number,
+                Inventory.expiry_date,
+                Inventory.quantity_available,
+                Inventory.mrp,
+                Medicine.name.label('medicine_name')
+            )
+            .join(Medicine, Medicine.id == Inventory.medicine_id)
+            .where(Inventory.id.in_(quantities), Inventory.pharmacy_id == pharmacy_id)
+        )
+    }
+
+    missing = [str(inventory_id) for inventory_id in quantities if inventory_id not in batches]
+    if missing:
+        raise CheckoutError('Inventory items not found.', 404, {'inventory_ids': missing})
+
+    today = date.today()
+    expired = [str(inventory_id) for inventory_id, batch in batches.items() if batch.expiry_date <= today]
+    if expired:
+        raise CheckoutError('Cannot sell expired batches.', 409, {'inventory_ids': expired})
+
+    # Totals
+    subtotal = sum((_money(batches[inventory_id].mrp) * quantity for inventory_id, quantity in quantities.items()), Decimal('0'))
+    if data.get('discount_amount') is not None:
+        discount = _money(_decimal(data['discount_amount'], 'discount_amount'))
+    else:
+        discount = _money(subtotal * _decimal(data.get('discount_percent', 0), 'discount_percent') / 100)
+    if discount > subtotal:
+        raise CheckoutError('Discount cannot exceed the subtotal.')
+    tax_rate = _decimal(data.get('tax_rate', current_app.config['DEFAULT_SALES_TAX_RATE']), 'tax_rate')
+    tax = _money((subtotal - discount) * tax_rate / 100)
+    total = subtotal - discount + tax
+
+    now = datetime.utcnow()
+    transaction = SalesTransaction(
+        id=uuid.uuid4(),
+        pharmacy_id=pharmacy_id,
+        patient_id=data.get('patient_id'),
+        prescription_id=prescription_id,
+        transaction_number=generate_transaction_number(pharmacy_id),
+        idempotency_key=idempotency_key,
+        transaction_date=now,
+        subtotal=subtotal,
+        tax_amount=tax,
+        discount_amount=discount,
+        total_amount=total,
+        payment_method=payment_method,
+        payment_status='Paid',
+        cashier_name=data.get('cashier_name'),
+        notes=data.get('notes')
+    )
+
+    # The transaction row is written first, so a concurrent retry with the
+    # same key fails on the unique constraint before touching any stock
+    db.session.add(transaction)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        existing = find_by_idempotency_key(pharmacy_id, idempotency_key)
+        if existing:
+            return existing, False
+        raise
+
+    db.session.execute(insert(SalesTransactionItem), [{
+        'id': uuid.uuid4(),
+        'transaction_id': transaction.id,
+        'inventory_id': inventory_id,
+        'medicine_name': batches[inventory_id].medicine_name,
+        'batch_number': batches[inventory_id].batch_number,
+        'quantity_sold': quantity,
+        'unit_price': _money(batches[inventory_id].mrp),
+        'total_price': _money(batches[inventory_id].mrp) * quantity,
+        'created_at': now,
+        'updated_at': now
+    } for inventory_id, quantity in quantities.items()])
+
+    # Decrement every batch in one statement; the guard makes it all-or-nothing
+    sold = case({inventory_id: quantity for inventory_id, quantity in quantities.items()}, value=Inventory.id)
+    result = db.session.execute(
+        update(Inventory)
+        .where(
+            Inventory.id.in_(quantities),
+            Inventory.pharmacy_id == pharmacy_id,
+            Inventory.quantity_available >= sold
+        )
+        .values(quantity_available=Inventory.quantity_available - sold, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        short = [
+            {'inventory_id': str(inventory_id), 'requested': quantity, 'available': batches[inventory_id].quantity_available}
+            for inventory_id, quantity in quantities.items()
+            if batches[inventory_id].quantity_available < quantity
+        ]
+        raise CheckoutError('Insufficient stock for one or more items.', 409, {'items': short})
+
+    record_sale(transaction, [{
+        'medicine_id': batches[inventory_id].medicine_id,
+        'medicine_name': batches[inventory_id].medicine_name,
+        'quantity': quantity,
+        'revenue': _money(batches[inventory_id].mrp) * quantity
+    } for inventory_id, quantity in quantities.items()])
+
+    units_by_medicine = {}
+    units_by_medicine_id = {}
+    for inventory_id, quantity in quantities.items():
+        batch = batches[inventory_id]
+        units_by_medicine[batch.medicine_name] = units_by_medicine.get(batch.medicine_name, 0) + quantity
+        units_by_medicine_id[batch.medicine_id] = units_by_medicine_id.get(batch.medicine_id, 0) + quantity
+    heavy_hitters.record(pharmacy_id, 'sales', units_by_medicine)
+
+    if prescription_id:
+        record_dispensed_items(prescription_id, units_by_medicine_id)
+
+    return transaction, True
@@ -0,0 +1,419 @@
+"""
+Columnar Analytics Service - In-memory pivots over sales and inventory facts
+Each pharmacy's sales line items and inventory batches are held as NumPy
+columns with dictionary-encoded dimensions. Refreshes only read rows
+created or updated since the last load; group-bys and filters run
+vectorized in memory.
+"""
+
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import func, select, tuple_
+
+from extensions import db
+from models import Inventory, Medicine, Pharmacy, SalesTransaction, SalesTransactionItem
+
+REFRESH_SECONDS = 30
+FULL_RELOAD_SECONDS = 600  # also picks up deleted inventory batches
+# Rows younger than this are left for the next refresh, so transactions that
+# commit slightly out of order are not skipped by the watermark
+COMMIT_LAG = timedelta(seconds=5)
+LOAD_CHUNK_SIZE = 50000
+DIRECT_BINCOUNT_LIMIT = 1 << 22  # dense group-by up to ~4M key combinations
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+HOURS = tuple(f'{hour:02d}:00' for hour in range(24))
+
+FACTS = {
+    'sales': {
+        'dimensions': ('medicine', 'category', 'supplier', 'weekday', 'hour', 'date', 'month'),
+        'measures': ('quantity', 'revenue', 'lines')
+    },
+    'inventory': {
+        'dimensions': ('medicine', 'category', 'supplier', 'expiry_month'),
+        'measures': ('quantity', 'stock_value', 'batches')
+    }
+}
+
+class QueryError(ValueError):
+    """An invalid pivot query"""
+
+class Dictionary:
+    """Maps dimension labels to dense integer codes"""
+
+    def __init__(self):
+        self.labels = []
+        self._codes = {}
+
+    def encode(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            label = value if value not in (None, '') else '(none)'
+            code = self._codes.get(label)
+            if code is None:
+                code = self._codes[label] = len(self.labels)
+                self.labels.append(label)
+            codes[i] = code
+        return codes
+
+    def codes_for(self, labels):
+        return np.array([self._codes[label] for label in labels if label in self._codes], dtype=np.int32)
+
+def _epoch_seconds(values):
+    """UTC datetimes (naive or aware) -> int64 seconds since the epoch"""
+    naive = [value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value for value in values]
+    return np.array(naive, dtype='datetime64[s]').astype(np.int64)
+
+def _utc_offset(seconds, tz):
+    return int(datetime.fromtimestamp(int(seconds), timezone.utc).astimezone(tz).utcoffset().total_seconds())
+
+def _local_seconds(utc_seconds, tz):
+    """
+    Shift UTC epoch seconds to local wall-clock seconds
+
+    The offset is looked up once per UTC day, and per timestamp only on days
+    where it changes (DST transitions), so hour buckets stay exact.
+    """
+    if not len(utc_seconds):
+        return utc_seconds
+    days, inverse = np.unique(utc_seconds // 86400, return_inverse=True)
+    starts = np.array([_utc_offset(day * 86400, tz) for day in days], dtype=np.int64)
+    ends = np.array([_utc_offset(day * 86400 + 86399, tz) for day in days], dtype=np.int64)
+    offsets = starts[inverse]
+    changing = (starts != ends)[inverse]
+    if changing.any():
+        offsets[changing] = [_utc_offset(seconds, tz) for seconds in utc_seconds[changing]]
+    return utc_seconds + offsets
+
+class PharmacyFacts:
+    """Columnar sales and inventory facts for one pharmacy"""
+
+    def __init__(self, pharmacy_id, tz):
+        self.pharmacy_id = pharmacy_id
+        self.tz = tz
+        self.lock = threading.Lock()
+        self.dictionaries = {name: Dictionary() for name in ('medicine', 'category', 'supplier')}
+        self.sales = {
+            'local_seconds': np.empty(0, dtype=np.int64),
+            'medicine': np.empty(0, dtype=np.int32),
+            'category': np.empty(0, dtype=np.int32),
+            'supplier': np.empty(0, dtype=np.int32),
+            'quantity': np.empty(0, dtype=np.int64),
+            'revenue': np.empty(0, dtype=np.float64)
+        }
+        self.sales_watermark = None  # (created_at, id) of the last loaded line item
+        self.inventory = None
+        self.inventory_index = {}  # inventory id -> row
+        self.inventory_watermark = None
+        self.refreshed_at = 0
+        self.reloaded_at = 0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.refreshed_at < REFRESH_SECONDS:
+            return
+        if now - self.reloaded_at >= FULL_RELOAD_SECONDS:
+            self.inventory = None
+            self.inventory_index = {}
+            self.inventory_watermark = None
+            self.reloaded_at = now
+        horizon = datetime.utcnow() - COMMIT_LAG
+        self._load_sales(horizon)
+        self._load_inventory(horizon)
+        self.refreshed_at = now
+
+    def _load_sales(self, horizon):
+        statement = (
+            select(
+                SalesTransactionItem.created_at,
+                SalesTransactionItem.id,
+                SalesTransaction.transaction_date,
+                SalesTransactionItem.medicine_name,
+                func.coalesce(Medicine.category, Medicine.therapeutic_class),
+                Inventory.supplier_name,
+                SalesTransactionItem.quantity_sold,
+                SalesTransactionItem.total_price
+            )
+            .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+            .outerjoin(Inventory, Inventory.id == SalesTransactionItem.inventory_id)
+            .outerjoin(Medicine, Medicine.id == Inventory.medicine_id)
+            .where(
+                SalesTransaction.pharmacy_id == self.pharmacy_id,
+                SalesTransactionItem.created_at < horizon
+            )
+            .order_by(SalesTransactionItem.created_at, SalesTransactionItem.id)
+        )
+        if self.sales_watermark is not None:
+            statement = statement.where(
+                tuple_(SalesTransactionItem.created_at, SalesTransactionItem.id) > self.sales_watermark
+            )
+
+        result = db.session.execute(statement.execution_options(yield_per=LOAD_CHUNK_SIZE))
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            new = {
+                'local_seconds': _local_seconds(_epoch_seconds(columns[2]), self.tz),
+                'medicine': self.dictionaries['medicine'].encode(columns[3]),
+                'category': self.dictionaries['category'].encode(columns[4]),
+                'supplier': self.dictionaries['supplier'].encode(columns[5]),
+                'quantity': np.array(columns[6], dtype=np.int64),
+                'revenue': np.array([float(value) for value in columns[7]], dtype=np.float64)
+            }
+            for name, values in new.items():
+                self.sales[name] = np.concatenate((self.sales[name], values))
+            self.sales_watermark = (rows[-1][0], rows[-1][1])
+
+    def _load_inventory(self, horizon):
+        statement = (
+            select(
+                Inventory.id,
+                Inventory.updated_at,
+                Medicine.name,
+                func.coalesce(Medicine.category, Medicine.therapeutic_class),
+                Inventory.supplier_name,
+                Inventory.expiry_date,
+                Inventory.quantity_available,
+                Inventory.unit_price
+            )
+            .join(Medicine, Medicine.id == Inventory.medicine_id)
+            .where(Inventory.pharmacy_id == self.pharmacy_id, Inventory.updated_at < horizon)
+        )
+        if self.inventory_watermark is not None:
+            statement = statement.where(Inventory.updated_at >= self.inventory_watermark)
+        rows = db.session.execute(statement).all()
+
+        if self.inventory is None:
+            self.inventory = {
+                'medicine': np.empty(0, dtype=np.int32),
+                'category': np.empty(0, dtype=np.int32),
+                'supplier': np.empty(0, dtype=np.int32),
+                'expiry_month': np.empty(0, dtype=np.int32),
+                'quantity': np.empty(0, dtype=np.int64),
+                'stock_value': np.empty(0, dtype=np.float64)
+            }
+        if not rows:
+            return
+
+        columns = list(zip(*rows))
+        values = {
+            'medicine': self.dictionaries['medicine'].encode(columns[2]),
+            'category': self.dictionaries['category'].encode(columns[3]),
+            'supplier': self.dictionaries['supplier'].encode(columns[4]),
+            'expiry_month': np.array([expiry.year * 12 + expiry.month - 1 for expiry in columns[5]], dtype=np.int32),
+            'quantity': np.array(columns[6], dtype=np.int64),
+            'stock_value': np.array(columns[6], dtype=np.float64) * np.array([float(price) for price in columns[7]])
+        }
+
+        # Updated batches are overwritten in place, new batches appended
+        positions = np.array([self.inventory_index.get(inventory_id, -1) for inventory_id in columns[0]])
+        existing = positions >= 0
+        appended = ~existing
+        for name, column in values.items():
+            self.inventory[name][positions[existing]] = column[existing]
+            self.inventory[name] = np.concatenate((self.inventory[name], column[appended]))
+        start = len(self.inventory_index)
+        for offset, inventory_id in enumerate(np.array(columns[0], dtype=object)[appended]):
+            self.inventory_index[inventory_id] = start + offset
+        self.inventory_watermark = max(columns[1])
+
+    def dimension(self, fact, name):
+        """(codes, labels) for a dimension of a fact table"""
+        if name in self.dictionaries:
+            table = self.sales if fact == 'sales' else self.inventory
+            return table[name], self.dictionaries[name].labels
+        if name == 'expiry_month':
+            codes = self.inventory['expiry_month']
+            base = int(codes.min()) if len(codes) else 0
+            top = int(codes.max()) + 1 if len(codes) else 0
+            labels = [f'{month // 12}-{month % 12 + 1:02d}' for month in range(base, top)]
+            return codes - base, labels
+
+        local_days = self.sales['local_seconds'] // 86400
+        if name == 'weekday':
+            return ((local_days + 3) % 7).astype(np.int32), WEEKDAYS  # 1970-01-01 was a Thursday
+        if name == 'hour':
+            return ((self.sales['local_seconds'] % 86400) // 3600).astype(np.int32), HOURS
+        if name == 'date':
+            base = int(local_days.min()) if len(local_days) else 0
+            top = int(local_days.max()) + 1 if len(local_days) else 0
+            labels = [(date(1970, 1, 1) + timedelta(days=day)).isoformat() for day in range(base, top)]
+            return (local_days - base).astype(np.int32), labels
+        if name == 'month':
+            months = local_days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+            base = int(months.min()) if len(months) else 0
+            top = int(months.max()) + 1 if len(months) else 0
+            labels = [f'{1970 + month // 12}-{month % 12 + 1:02d}' for month in range(base, top)]
+            return (months - base).astype(np.int32), labels
+        raise QueryError(f'Unknown dimension: {name}')
+
+    def measure(self, fact, name):
+        table = self.sales if fact == 'sales' else self.inventory
+        if name in ('lines', 'batches'):
+            return None  # row count
+        return table[name]
+
+    def row_count(self, fact):
+        table = self.sales if fact == 'sales' else self.inventory
+        return len(table['quantity'])
+
+def group_by(codes, cardinalities, mask, weights):
+    """
+    Vectorized GROUP BY over dictionary codes
+
+    Returns (group codes per dimension, {measure: sums}); weights maps a
+    measure name to its column, or None to count rows.
+    """
+    size = 1
+    for cardinality in cardinalities:
+        size *= max(cardinality, 1)
+
+    key = np.zeros(int(mask.sum()), dtype=np.int64)
+    for column, cardinality in zip(codes, cardinalities):
+        key = key * max(cardinality, 1) + column[mask]
+
+    if size <= DIRECT_BINCOUNT_LIMIT:
+        present = np.bincount(key, minlength=size)
+        groups = np.nonzero(present)[0]
+        sums = {name: (present if column is None else np.bincount(key, weights=column[mask], minlength=size))[groups]
+                for name, column in weights.items()}
+    else:
+        groups, inverse = np.unique(key, return_inverse=True)
+        sums = {name: np.bincount(inverse, weights=None if column is None else column[mask], minlength=len(groups))
+                for name, column in weights.items()}
+
+    group_codes = []
+    for cardinality in reversed(cardinalities):
+        group_codes.append(groups % max(cardinality, 1))
+        groups = groups // max(cardinality, 1)
+    return list(reversed(group_codes)), sums
+
+class ColumnarAnalyticsEngine:
+    """Process-wide registry of per-pharmacy fact tables"""
+
+    def __init__(self):
+        self._facts = {}
+        self._lock = threading.Lock()
+
+    def facts_for(self, pharmacy_id):
+        pharmacy_id = uuid.UUID(str(pharmacy_id))
+        with self._lock:
+            facts = self._facts.get(pharmacy_id)
+            if facts is None:
+                pharmacy = db.session.get(Pharmacy, pharmacy_id)
+                tz = ZoneInfo(pharmacy.timezone if pharmacy and pharmacy.timezone else 'UTC')
+                facts = self._facts[pharmacy_id] = PharmacyFacts(pharmacy_id, tz)
+        return facts
+
+    def pivot(self, pharmacy_id, fact='sales', rows=(), columns=(), measures=None, filters=None,
+              start_date=None, end_date=None, limit=1000):
+        """
+        Group a fact table by rows + columns dimensions
+
+        filters maps a dimension to the labels to keep; start_date and
+        end_date (local, inclusive) restrict sales. Returns the grouped
+        records, sorted by the first measure, and a matrix per measure when
+        column dimensions are given.
+        """
+        if fact not in FACTS:
+            raise QueryError(f"fact must be one of {', '.join(FACTS)}")
+        spec = FACTS[fact]
+        rows, columns = list(rows), list(columns)
+        measures = list(measures or spec['measures'])
+        for name in rows + columns + list(filters or {}):
+            if name not in spec['dimensions']:
+                raise QueryError(f"Unknown {fact} dimension: {name}")
+        for name in measures:
+            if name not in spec['measures']:
+                raise QueryError(f"Unknown {fact} measure: {name}")
+        if not rows + columns:
+            raise QueryError('At least one row or column dimension is required')
+
+        facts = self.facts_for(pharmacy_id)
+        with facts.lock:
+            facts.refresh()
+            started = time.perf_counter()
+
+            mask = np.ones(facts.row_count(fact), dtype=bool)
+            for name, labels in (filters or {}).items():
+                codes, all_labels = facts.dimension(fact, name)
+                if name in facts.dictionaries:
+                    wanted = facts.dictionaries[name].codes_for(labels)
+                else:
+                    lookup = {label: code for code, label in enumerate(all_labels)}
+                    wanted = np.array([lookup[label] for label in labels if label in lookup], dtype=np.int32)
+                mask &= np.isin(codes, wanted)
+            if fact == 'sales' and (start_date or end_date):
+                local_days = facts.sales['local_seconds'] // 86400
+                if start_date:
+                    mask &= local_days >= (start_date - date(1970, 1, 1)).days
+                if end_date:
+                    mask &= local_days <= (end_date - date(1970, 1, 1)).days
+
+            dimensions = [facts.dimension(fact, name) for name in rows + columns]
+            group_codes, sums = group_by(
+                [codes for codes, _ in dimensions],
+                [len(labels) for _, labels in dimensions],
+                mask,
+                {name: facts.measure(fact, name) for name in measures}
+            )
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        order = np.argsort(-sums[measures[0]], kind='stable')[:limit]
+        records = []
+        for index in order:
+            record = {name: labels[codes[index]] for name, (_, labels), codes
+                      in zip(rows + columns, dimensions, group_codes)}
+            for name in measures:
+                value = sums[name][index]
+                record[name] = round(float(value), 2) if name in ('revenue', 'stock_value') else int(value)
+            records.append(record)
+
+        result = {
+            'fact': fact,
+            'rows': rows,
+            'columns': columns,
+            'measures': measures,
+            'records': records,
+            'row_count': int(mask.sum()),
+            'elapsed_ms': round(elapsed_ms, 2)
+        }
+        if columns:
+            positions = {name: {label: i for i, label in enumerate(labels)}
+                         for name, (_, labels) in zip(rows + columns, dimensions)}
+            result['pivot'] = _to_matrix(records, rows, columns, measures, positions)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._facts.clear()
+
+def _to_matrix(records, rows, columns, measures, positions):
+    """Arrange grouped records as row labels x column labels per measure"""
+    row_keys, column_keys = {}, {}
+    for record in records:
+        row_keys.setdefault(tuple(record[name] for name in rows), None)
+        column_keys.setdefault(tuple(record[name] for name in columns), None)
+    # Rows keep the measure ranking; columns follow the dimension's natural order
+    row_keys = list(row_keys)
+    column_keys = sorted(column_keys, key=lambda key: [positions[name][label] for name, label in zip(columns, key)])
+    row_index = {key: i for i, key in enumerate(row_keys)}
+    column_index = {key: i for i, key in enumerate(column_keys)}
+
+    values = {name: [[0] * len(column_keys) for _ in row_keys] for name in measures}
+    for record in records:
+        i = row_index[tuple(record[name] for name in rows)]
+        j = column_index[tuple(record[name] for name in columns)]
+        for name in measures:
+            values[name][i][j] = record[name]
+    return {
+        'row_labels': [list(key) for key in row_keys],
+        'column_labels': [list(key) for key in column_keys],
+        'values': values
+    }
+
+columnar_analytics = ColumnarAnalyticsEngine()
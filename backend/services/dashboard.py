@@ -0,0 +1,101 @@
+"""
+Dashboard Service - Per-pharmacy dashboard counts in a single statement
+Results are cached per pharmacy and invalidated when a write that affects
+them commits
+"""
+
+import uuid
+from datetime import date, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, select, union
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import Inventory, Prescription, SalesTransaction
+from services.cache import TTLCache
+
+RECENT_ACTIVITY_DAYS = 30
+
+_dashboard_cache = TTLCache(ttl=60)
+
+def compute_dashboard(pharmacy_id):
+    """Every dashboard count for a pharmacy as scalar subqueries of one SELECT"""
+    since = date.today() - timedelta(days=RECENT_ACTIVITY_DAYS)
+
+    def count(statement):
+        return statement.scalar_subquery()
+
+    patients = union(
+        select(Prescription.patient_id).where(Prescription.pharmacy_id == pharmacy_id),
+        select(SalesTransaction.patient_id).where(
+            SalesTransaction.pharmacy_id == pharmacy_id,
+            SalesTransaction.patient_id.isnot(None)
+        )
+    ).subquery()
+
+    row = db.session.execute(select(
+        count(select(func.count(func.distinct(Inventory.medicine_id))).where(
+            Inventory.pharmacy_id == pharmacy_id
+        )).label('medicines'),
+        count(select(func.count()).select_from(patients)).label('patients'),
+        count(select(func.count()).where(Prescription.pharmacy_id == pharmacy_id)).label('prescriptions'),
+        count(select(func.count()).where(
+            Prescription.pharmacy_id == pharmacy_id,
+            Prescription.prescription_date >= since
+        )).label('recent_prescriptions'),
+        count(select(func.count()).where(
+            Inventory.pharmacy_id == pharmacy_id,
+            Inventory.quantity_available <= Inventory.minimum_threshold
+        )).label('low_stock')
+    )).one()
+
+    return {
+        'totals': {
+            'medicines': row.medicines,
+            'patients': row.patients,
+            'prescriptions': row.prescriptions
+        },
+        'recent_activity': {
+            f'prescriptions_last_{RECENT_ACTIVITY_DAYS}_days': row.recent_prescriptions
+        },
+        'alerts': {
+            'low_stock_items': row.low_stock
+        }
+    }
+
+def get_dashboard(pharmacy_id):
+    """Cached dashboard counts for a pharmacy"""
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    return _dashboard_cache.get_or_compute(
+        pharmacy_id,
+        lambda: compute_dashboard(pharmacy_id),
+        current_app.config['ANALYTICS_CACHE_TTL']
+    )
+
+def invalidate_dashboard(pharmacy_id=None):
+    _dashboard_cache.invalidate(uuid.UUID(str(pharmacy_id)) if pharmacy_id else None)
+
+# Writes mark their pharmacy's dashboard stale; the cache entry is dropped
+# only once the write commits, so readers never re-cache uncommitted state
+
+@event.listens_for(Inventory, 'after_insert')
+@event.listens_for(Inventory, 'after_update')
+@event.listens_for(Inventory, 'after_delete')
+@event.listens_for(Prescription, 'after_insert')
+@event.listens_for(Prescription, 'after_update')
+@event.listens_for(Prescription, 'after_delete')
+@event.listens_for(SalesTransaction, 'after_insert')
+def _mark_dashboard_stale(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.pharmacy_id is not None:
+        session.info.setdefault('stale_dashboards', set()).add(target.pharmacy_id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_dashboards(session):
+    for pharmacy_id in session.info.pop('stale_dashboards', ()):
+        invalidate_dashboard(pharmacy_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_dashboards(session):
+    session.info.pop('stale_dashboards', None)
@@ -0,0 +1,242 @@
+"""
+Demand Forecast Service - Daily demand forecasts and reorder points per medicine
+Every pharmacy-medicine pair with sales in the history window is one series.
+All series are smoothed together as rows of one NumPy matrix, so a run costs
+one pass over the history days rather than one model fit per medicine.
+
+Series that sell on most days use simple exponential smoothing; intermittent
+series (average inter-demand interval above 1.32 days, the Syntetos-Boylan
+cut-off) use Croston's method with the Syntetos-Boylan bias correction.
+Safety stock covers the one-day-ahead forecast error over the lead time at
+REORDER_SERVICE_LEVEL, and the reorder point adds the lead-time demand.
+A series with fewer than FORECAST_MIN_HISTORY_DAYS days since its first sale
+or FORECAST_MIN_DEMAND_DAYS days with sales gets no forecast, so a medicine
+sold once keeps its manual minimum_threshold instead of a reorder point
+extrapolated from that one sale.
+"""
+
+import math
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, case, delete, func, insert, select
+
+from extensions import db
+from models import DailyMedicineSalesRollup, DemandForecast, Inventory, Medicine
+
+CROSTON_ADI_CUTOFF = 1.32
+LOAD_CHUNK_SIZE = 50000
+INSERT_CHUNK_SIZE = 5000
+THRESHOLD_SOURCES = ('manual', 'forecast')
+
+def forecast_series(demand, alpha):
+    """
+    Forecast every row of a (series, days) matrix of daily units, oldest day first
+
+    Each series starts on its first day with demand. Returns a dict of arrays:
+    forecast (units/day), sigma (RMSE of one-day-ahead forecasts), croston
+    (whether Croston's method was used), active_days and demand_days.
+    """
+    count, days = demand.shape
+    sold = demand > 0
+    first = np.where(sold.any(axis=1), sold.argmax(axis=1), days)
+    active_days = days - first
+    demand_days = sold.sum(axis=1)
+    average_interval = active_days / np.maximum(demand_days, 1)
+    croston = average_interval > CROSTON_ADI_CUTOFF
+    bias = 1 - alpha / 2
+
+    level = np.zeros(count)     # SES level
+    size = np.zeros(count)      # Croston demand size
+    interval = np.maximum(average_interval, 1.0)  # Croston inter-demand interval
+    since = np.zeros(count)     # days since the last demand
+    squared_error = np.zeros(count)
+    scored = np.zeros(count)
+    started = np.zeros(count, dtype=bool)
+
+    for day in range(days):
+        units = demand[:, day].astype(np.float64)
+        active = first <= day
+
+        # Score yesterday's forecast before updating on today's demand
+        predicted = np.where(croston, bias * size / interval, level)
+        score = active & started
+        error = np.where(score, units - predicted, 0.0)
+        squared_error += error * error
+        scored += score
+
+        level = np.where(active & ~started, units, np.where(active, level + alpha * (units - level), level))
+
+        since += active
+        hit = active & sold[:, day]
+        size = np.where(hit & ~started, units, np.where(hit, size + alpha * (units - size), size))
+        interval = np.where(hit & started, interval + alpha * (since - interval), interval)
+        since = np.where(hit, 0.0, since)
+        started |= active
+
+    forecast = np.where(croston, bias * size / interval, level)
+    # A single observation has no forecast error to measure; assume it equals the demand
+    sigma = np.where(scored > 0, np.sqrt(squared_error / np.maximum(scored, 1)), forecast)
+    return {
+        'forecast': forecast,
+        'sigma': sigma,
+        'croston': croston,
+        'active_days': active_days,
+        'demand_days': demand_days
+    }
+
+def reorder_levels(forecast, sigma, lead_time_days, service_level):
+    """(safety_stock, reorder_point) integer arrays for the given lead time"""
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = np.ceil(z * sigma * math.sqrt(lead_time_days))
+    reorder_point = np.ceil(forecast * lead_time_days + safety_stock)
+    return safety_stock.astype(np.int64), reorder_point.astype(np.int64)
+
+def _load_history(start, end):
+    """Series keys and a (series, days) matrix of units sold in [start, end)"""
+    rollup = DailyMedicineSalesRollup
+    rows = db.session.execute(
+        select(rollup.pharmacy_id, rollup.medicine_id, rollup.sales_date, func.sum(rollup.quantity_sold))
+        .where(
+            rollup.sales_date >= start,
+            rollup.sales_date < end,
+            rollup.medicine_id.isnot(None)
+        )
+        .group_by(rollup.pharmacy_id, rollup.medicine_id, rollup.sales_date)
+        .execution_options(yield_per=LOAD_CHUNK_SIZE)
+    )
+
+    keys = {}
+    series, offsets, units = [], [], []
+    for pharmacy_id, medicine_id, sales_date, quantity in rows:
+        series.append(keys.setdefault((pharmacy_id, medicine_id), len(keys)))
+        offsets.append((sales_date - start).days)
+        units.append(quantity or 0)
+
+    demand = np.zeros((len(keys), (end - start).days), dtype=np.float32)
+    if keys:
+        # Rows are already grouped per series and day, so plain assignment suffices
+        demand[np.asarray(series), np.asarray(offsets)] = np.asarray(units, dtype=np.float32)
+    return list(keys), demand
+
+def run_forecasts(lead_time_days=None, today=None):
+    """
+    Recompute every demand forecast from the daily medicine rollups
+
+    Replaces the demand_forecasts table in one transaction. Today's partial
+    sales are excluded, as are series with too little history to trust.
+    Returns a summary of the run.
+    """
+    config = current_app.config
+    lead_time_days = lead_time_days or config['REORDER_LEAD_TIME_DAYS']
+    today = today or date.today()
+    start = today - timedelta(days=config['FORECAST_HISTORY_DAYS'])
+    started_at = time.perf_counter()
+
+    keys, demand = _load_history(start, today)
+    result = forecast_series(demand, config['FORECAST_SMOOTHING_ALPHA'])
+    safety_stock, reorder_point = reorder_levels(
+        result['forecast'], result['sigma'], lead_time_days, config['REORDER_SERVICE_LEVEL']
+    )
+    trusted = np.flatnonzero(
+        (result['active_days'] >= config['FORECAST_MIN_HISTORY_DAYS'])
+        & (result['demand_days'] >= config['FORECAST_MIN_DEMAND_DAYS'])
+    )
+    computed_at = time.perf_counter()
+
+    now = datetime.utcnow()
+    db.session.execute(delete(DemandForecast))
+    for chunk_start in range(0, len(trusted), INSERT_CHUNK_SIZE):
+        db.session.execute(insert(DemandForecast), [{
+            'id': uuid.uuid4(),
+            'pharmacy_id': keys[index][0],
+            'medicine_id': keys[index][1],
+            'method': 'croston' if result['croston'][index] else 'ses',
+            'daily_demand': float(result['forecast'][index]),
+            'demand_std': float(result['sigma'][index]),
+            'lead_time_days': lead_time_days,
+            'safety_stock': int(safety_stock[index]),
+            'reorder_point': int(reorder_point[index]),
+            'history_days': int(result['active_days'][index]),
+            'demand_days': int(result['demand_days'][index]),
+            'forecast_date': today,
+            'created_at': now,
+            'updated_at': now
+        } for index in trusted[chunk_start:chunk_start + INSERT_CHUNK_SIZE].tolist()])
+    db.session.commit()
+
+    return {
+        'series': len(keys),
+        'forecast_series': len(trusted),
+        'croston_series': int(result['croston'][trusted].sum()),
+        'lead_time_days': lead_time_days,
+        'forecast_seconds': round(computed_at - started_at, 3),
+        'total_seconds': round(time.perf_counter() - started_at, 3)
+    }
+
+def get_low_stock_by_forecast(pharmacy_id):
+    """
+    Medicines whose unexpired stock is at or below their reorder point
+
+    Medicines without a forecast fall back to the largest minimum_threshold
+    of their batches (and are low when stock is below it). Most short first.
+    """
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    on_hand = func.sum(case((Inventory.expiry_date >= date.today(), Inventory.quantity_available), else_=0))
+    reorder_point = func.max(DemandForecast.reorder_point)
+    manual_threshold = func.max(Inventory.minimum_threshold)
+    threshold = func.coalesce(reorder_point, manual_threshold)
+    shortage = threshold - on_hand
+
+    rows = db.session.execute(
+        select(
+            Medicine.id,
+            Medicine.name,
+            Medicine.strength,
+            Medicine.dosage_form,
+            on_hand.label('on_hand'),
+            threshold.label('threshold'),
+            func.count(Inventory.id).label('batches'),
+            func.max(DemandForecast.method).label('method'),
+            func.max(DemandForecast.daily_demand).label('daily_demand'),
+            func.max(DemandForecast.safety_stock).label('safety_stock'),
+            func.max(DemandForecast.lead_time_days).label('lead_time_days')
+        )
+        .join(Medicine, Medicine.id == Inventory.medicine_id)
+        .outerjoin(DemandForecast, and_(
+            DemandForecast.pharmacy_id == Inventory.pharmacy_id,
+            DemandForecast.medicine_id == Inventory.medicine_id
+        ))
+        .where(Inventory.pharmacy_id == pharmacy_id)
+        .group_by(Medicine.id, Medicine.name, Medicine.strength, Medicine.dosage_form)
+        .having(case(
+            (reorder_point.isnot(None), on_hand <= reorder_point),
+            else_=on_hand < manual_threshold
+        ))
+        .order_by(shortage.desc(), Medicine.name)
+    ).all()
+
+    return [{
+        'medicine': {
+            'id': str(row.id),
+            'name': row.name,
+            'strength': row.strength,
+            'dosage_form': row.dosage_form
+        },
+        'quantity_available': int(row.on_hand),
+        'minimum_threshold': int(row.threshold),
+        'shortage': max(0, int(row.threshold) - int(row.on_hand)),
+        'batches': row.batches,
+        'threshold_source': 'forecast' if row.method else 'manual',
+        'forecast': {
+            'method': row.method,
+            'daily_demand': round(row.daily_demand, 3),
+            'safety_stock': row.safety_stock,
+            'reorder_point': int(row.threshold),
+            'lead_time_days': row.lead_time_days
+        } if row.method else None
+    } for row in rows]
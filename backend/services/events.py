@@ -0,0 +1,232 @@
+"""
+Event Broker - Publish/subscribe for Server-Sent Events streams
+Events are delivered when the publishing transaction commits, either
+in-process (single worker) or through Postgres LISTEN/NOTIFY (multi-worker)
+"""
+
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+PG_NOTIFY_CHANNEL = 'helio_events'
+# Postgres rejects (and aborts the transaction on) NOTIFY payloads of 8000 bytes or more
+PG_NOTIFY_MAX_BYTES = 7900
+SUBSCRIBER_QUEUE_SIZE = 256
+
+class Subscription:
+    """A single stream's view of a channel"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout):
+        """Return the next event, or None if nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class EventBroker:
+    """Fan events out to the subscriptions of this worker process"""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self.backend = 'memory'
+        self.app = None
+
+    def init_app(self, app):
+        self.backend = app.config.get('EVENT_BACKEND', 'memory')
+        self.app = app
+
+    def subscribe(self, channel):
+        """Open a subscription; use as a context manager to close it"""
+        if self.backend == 'postgres':
+            self._ensure_listener()
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, payload, session=None):
+        """
+        Queue an event for delivery when the session's transaction commits
+
+        With the postgres backend the event is sent with pg_notify inside the
+        transaction, which Postgres itself only delivers on commit.
+        """
+        self.publish_many([(channel, payload)], session=session)
+
+    def publish_many(self, events, session=None):
+        """
+        Queue (channel, payload) events for delivery at commit
+
+        With the postgres backend each channel's events are packed into as
+        few notifications as fit the payload limit, and all of them are sent
+        in a single statement. An event too large to send on its own is
+        replaced by a 'resync' event, which tells clients to reload.
+        """
+        session = session or db.session
+        if self.backend != 'postgres':
+            session.info.setdefault('pending_events', []).extend(
+                {'channel': channel, 'payload': payload} for channel, payload in events
+            )
+            return
+        messages = _pack_messages(events)
+        if messages:
+            session.execute(
+                text('SELECT pg_notify(:channel, message) FROM unnest(CAST(:messages AS text[])) AS message'),
+                {'channel': PG_NOTIFY_CHANNEL, 'messages': messages}
+            )
+
+    def dispatch(self, channel, payload):
+        """Deliver an event to every local subscription of a channel"""
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(payload)
+            except queue.Full:
+                # A stalled client must not block publishers; it will
+                # resynchronise from the snapshot when it reconnects
+                logger.warning('Dropping event for slow subscriber on %s', channel)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscriptions.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self._subscriptions.values())
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='event-broker-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        """Forward Postgres notifications to local subscriptions, reconnecting on failure"""
+        import psycopg2
+        import psycopg2.extensions
+
+        with self.app.app_context():
+            url = db.engine.url.set(drivername='postgresql')
+            dsn = url.render_as_string(hide_password=False)
+
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {PG_NOTIFY_CHANNEL}')
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        message = json.loads(notify.payload)
+                        for payload in message['payloads']:
+                            self.dispatch(message['channel'], payload)
+            except Exception as e:
+                logger.error(f'Event listener connection lost: {e}')
+                if connection is not None:
+                    connection.close()
+                time.sleep(2)
+
+def _pack_messages(events):
+    """JSON NOTIFY payloads, one or more per channel, each under PG_NOTIFY_MAX_BYTES"""
+    by_channel = {}
+    for channel, payload in events:
+        by_channel.setdefault(channel, []).append(json.dumps(payload, default=str))
+
+    messages = []
+    for channel, payloads in by_channel.items():
+        prefix = json.dumps({'channel': channel, 'payloads': []})[:-2]
+        batch, size = [], len(prefix) + 2
+        for payload in payloads:
+            if len(prefix) + len(payload.encode()) + 2 >= PG_NOTIFY_MAX_BYTES:
+                logger.warning('Event on %s is too large to notify; sending resync', channel)
+                payload = json.dumps({'event': 'resync'})
+            if batch and size + len(payload.encode()) + 2 >= PG_NOTIFY_MAX_BYTES:
+                messages.append(prefix + ', '.join(batch) + ']}')
+                batch, size = [], len(prefix) + 2
+            batch.append(payload)
+            size += len(payload.encode()) + 2
+        if batch:
+            messages.append(prefix + ', '.join(batch) + ']}')
+    return messages
+
+broker = EventBroker()
+
+@event.listens_for(Session, 'after_commit')
+def _deliver_pending_events(session):
+    for message in session.info.pop('pending_events', []):
+        broker.dispatch(message['channel'], message['payload'])
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_events(session):
+    session.info.pop('pending_events', None)
+
+def format_sse(data, event_name=None, event_id=None):
+    """Format one Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event_name:
+        lines.append(f'event: {event_name}')
+    for line in json.dumps(data, default=str).splitlines():
+        lines.append(f'data: {line}')
+    return '\n'.join(lines) + '\n\n'
+
+def stream_events(subscription, initial_messages=(), keepalive=15, render=None):
+    """
+    Generator for an SSE response body
+
+    Yields the initial messages, then every event published on the
+    subscription, with a comment line every `keepalive` seconds so proxies
+    keep the connection open. The subscription is closed when the client
+    disconnects.
+    """
+    render = render or (lambda payload: format_sse(payload, payload.get('event')))
+    try:
+        for message in initial_messages:
+            yield message
+        while True:
+            payload = subscription.get(timeout=keepalive)
+            if payload is None:
+                yield ': keepalive\n\n'
+            else:
+                yield render(payload)
+    finally:
+        subscription.close()
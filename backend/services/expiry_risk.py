@@ -0,0 +1,145 @@
+"""
+Expiry Risk Service - Units and value of each batch expected to expire unsold
+Batches of a medicine are assumed to sell first-expiry-first-out at the
+medicine's forecast daily demand (see services.demand_forecast). A batch only
+sells once every earlier-expiring batch is sold out or expired, and stops
+selling at its own expiry date; whatever is left then is at risk.
+
+The simulation runs over all batches at once: batches are ranked by expiry
+within their medicine, and each step advances the rank-k batch of every
+medicine together. Scores are recomputed nightly, after forecast-demand, so
+the ranked endpoint is a single indexed read.
+"""
+
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import and_, delete, func, insert, select
+
+from extensions import db
+from models import DemandForecast, ExpiryRiskScore, Inventory, Medicine
+
+LOAD_CHUNK_SIZE = 50000
+INSERT_CHUNK_SIZE = 5000
+
+def simulate_sell_through(groups, days_to_expiry, quantity, daily_demand):
+    """
+    Expected units sold before expiry for each batch
+
+    groups identifies each batch's medicine (pharmacy-medicine pair) and
+    daily_demand is that medicine's demand, repeated per batch. Expired
+    batches (days_to_expiry <= 0) sell nothing.
+    """
+    count = len(groups)
+    sold = np.zeros(count)
+    if not count:
+        return sold
+
+    days = np.maximum(days_to_expiry, 0).astype(np.float64)
+    quantity = quantity.astype(np.float64)
+    order = np.lexsort((days, groups))
+    sorted_groups = groups[order]
+    first = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    rank = np.arange(count) - np.maximum.accumulate(np.where(first, np.arange(count), 0))
+
+    by_rank = order[np.argsort(rank, kind='stable')]
+    bounds = np.searchsorted(np.sort(rank), np.arange(rank.max() + 2))
+    clock = np.zeros(groups.max() + 1)  # day each medicine's earlier batches stop selling
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(len(bounds) - 1):
+            batch = by_rank[bounds[k]:bounds[k + 1]]
+            group = groups[batch]
+            demand = daily_demand[batch]
+            start = clock[group]
+            sellout = np.where(demand > 0, start + quantity[batch] / demand, np.inf)
+            end = np.maximum(start, np.minimum(days[batch], sellout))
+            sold[batch] = np.where(demand > 0, np.minimum(demand * (end - start), quantity[batch]), 0.0)
+            clock[group] = end
+
+    return sold
+
+def _load_batches():
+    rows = db.session.execute(
+        select(
+            Inventory.id,
+            Inventory.pharmacy_id,
+            Inventory.medicine_id,
+            Medicine.name,
+            Inventory.batch_number,
+            Inventory.expiry_date,
+            Inventory.quantity_available,
+            Inventory.unit_price,
+            func.coalesce(DemandForecast.daily_demand, 0.0)
+        )
+        .join(Medicine, Medicine.id == Inventory.medicine_id)
+        .outerjoin(DemandForecast, and_(
+            DemandForecast.pharmacy_id == Inventory.pharmacy_id,
+            DemandForecast.medicine_id == Inventory.medicine_id
+        ))
+        .where(Inventory.quantity_available > 0)
+        .execution_options(yield_per=LOAD_CHUNK_SIZE)
+    )
+    return list(rows)
+
+def score_expiry_risk(today=None):
+    """
+    Recompute expiry risk for every batch in stock
+
+    Replaces expiry_risk_scores in one transaction and returns a summary.
+    """
+    today = today or date.today()
+    batches = _load_batches()
+
+    keys = {}
+    groups = np.fromiter((keys.setdefault((row[1], row[2]), len(keys)) for row in batches),
+                         dtype=np.int64, count=len(batches))
+    days_to_expiry = np.fromiter(((row[5] - today).days for row in batches), dtype=np.float64, count=len(batches))
+    quantity = np.fromiter((row[6] for row in batches), dtype=np.float64, count=len(batches))
+    unit_price = np.fromiter((row[7] for row in batches), dtype=np.float64, count=len(batches))
+    daily_demand = np.fromiter((row[8] for row in batches), dtype=np.float64, count=len(batches))
+
+    expected_sold = np.floor(simulate_sell_through(groups, days_to_expiry, quantity, daily_demand) + 1e-9)
+    at_risk = quantity - expected_sold
+    value_at_risk = np.round(at_risk * unit_price, 2)
+
+    now = datetime.utcnow()
+    db.session.execute(delete(ExpiryRiskScore))
+    for chunk_start in range(0, len(batches), INSERT_CHUNK_SIZE):
+        db.session.execute(insert(ExpiryRiskScore), [{
+            'id': uuid.uuid4(),
+            'pharmacy_id': row[1],
+            'inventory_id': row[0],
+            'medicine_id': row[2],
+            'medicine_name': row[3],
+            'batch_number': row[4],
+            'expiry_date': row[5],
+            'quantity_available': row[6],
+            'daily_demand': float(daily_demand[index]),
+            'expected_units_sold': int(expected_sold[index]),
+            'units_at_risk': int(at_risk[index]),
+            'value_at_risk': float(value_at_risk[index]),
+            'risk_ratio': float(at_risk[index] / quantity[index]),
+            'scored_date': today,
+            'created_at': now,
+            'updated_at': now
+        } for index, row in enumerate(batches[chunk_start:chunk_start + INSERT_CHUNK_SIZE], start=chunk_start)])
+    db.session.commit()
+
+    return {
+        'batches': len(batches),
+        'batches_at_risk': int((at_risk > 0).sum()),
+        'units_at_risk': int(at_risk.sum()),
+        'value_at_risk': round(float(value_at_risk.sum()), 2)
+    }
+
+def get_expiry_risk(pharmacy_id, page=1, per_page=20, min_units=1):
+    """Scored batches of a pharmacy, highest value at risk first"""
+    return ExpiryRiskScore.query.filter(
+        ExpiryRiskScore.pharmacy_id == uuid.UUID(str(pharmacy_id)),
+        ExpiryRiskScore.units_at_risk >= min_units
+    ).order_by(
+        ExpiryRiskScore.value_at_risk.desc(),
+        ExpiryRiskScore.expiry_date
+    ).paginate(page=page, per_page=per_page, error_out=False)
@@ -0,0 +1,186 @@
+"""
+Pharmacy Geo Index - In-memory grid index for nearest-pharmacy queries
+Pharmacy coordinates are bucketed into fixed-size lat/lng cells; k-nearest
+searches expand ring by ring around the query cell
+"""
+
+import math
+import re
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from extensions import db
+from models import Pharmacy, PostalCodeLocation
+
+EARTH_RADIUS_KM = 6371.0088
+CELL_SIZE_DEGREES = 0.1  # ~11 km of latitude
+MAX_RING = 1800  # covers the whole globe at 0.1 degrees
+
+_PIN_CODE = re.compile(r'\b(\d{3})\s?(\d{3})\b')
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def parse_point(value):
+    """Parse 'lat,lng' into a (lat, lng) tuple of floats"""
+    try:
+        lat, lng = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError("near must be formatted as 'latitude,longitude'")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('near is out of range')
+    return lat, lng
+
+class GridIndex:
+    """Immutable grid of (id, lat, lng) points"""
+
+    def __init__(self, points, cell_size=CELL_SIZE_DEGREES):
+        self.cell_size = cell_size
+        self.size = 0
+        self._cells = {}
+        for point_id, lat, lng in points:
+            self._cells.setdefault(self._cell(lat, lng), []).append((point_id, lat, lng))
+            self.size += 1
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lng / self.cell_size))
+
+    def _ring(self, center, radius):
+        """Cells exactly `radius` cells away from center (Chebyshev distance)"""
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for d in range(-radius, radius + 1):
+            yield row - radius, col + d
+            yield row + radius, col + d
+        for d in range(-radius + 1, radius):
+            yield row + d, col - radius
+            yield row + d, col + radius
+
+    def nearest(self, lat, lng, k=10, max_distance_km=None):
+        """Return up to k (distance_km, id) pairs, nearest first"""
+        if not self.size or k <= 0:
+            return []
+
+        center = self._cell(lat, lng)
+        found = []
+        cell_km = self.cell_size * math.pi / 180 * EARTH_RADIUS_KM
+
+        for radius in range(MAX_RING + 1):
+            for cell in self._ring(center, radius):
+                for point_id, point_lat, point_lng in self._cells.get(cell, ()):
+                    found.append((haversine_km(lat, lng, point_lat, point_lng), point_id))
+
+            # Every point outside the rings searched so far is at least
+            # `radius` cells away; longitude cells narrow towards the poles,
+            # so scale by the cosine of the highest latitude those cells reach
+            max_lat = min(abs(lat) + (radius + 1) * self.cell_size, 90)
+            lng_scale = max(math.cos(math.radians(max_lat)), 0.0)
+            reachable_km = radius * cell_km * lng_scale
+            if max_distance_km is not None and reachable_km > max_distance_km:
+                break
+            if len(found) >= k:
+                found.sort(key=lambda item: item[0])
+                if found[k - 1][0] <= reachable_km:
+                    break
+            if len(found) >= self.size:
+                break
+
+        found.sort(key=lambda item: item[0])
+        if max_distance_km is not None:
+            found = [item for item in found if item[0] <= max_distance_km]
+        return found[:k]
+
+class PharmacyGeoIndex:
+    """Process-wide grid of pharmacy locations, rebuilt lazily when stale"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._index = None
+        self._loaded_at = 0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def _load(self):
+        rows = db.session.execute(
+            select(Pharmacy.id, Pharmacy.latitude, Pharmacy.longitude).where(
+                Pharmacy.latitude.isnot(None),
+                Pharmacy.longitude.isnot(None)
+            )
+        ).all()
+        return GridIndex((row.id, float(row.latitude), float(row.longitude)) for row in rows)
+
+    def get(self):
+        """Return the current index, reloading it after a change or the TTL"""
+        if self._stale or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._stale or time.monotonic() - self._loaded_at > self.ttl:
+                    # Clear the flag first so a change during the load marks it stale again
+                    self._stale = False
+                    self._index = self._load()
+                    self._loaded_at = time.monotonic()
+        return self._index
+
+    def nearest(self, lat, lng, k=10, max_distance_km=None):
+        return self.get().nearest(lat, lng, k=k, max_distance_km=max_distance_km)
+
+pharmacy_geo_index = PharmacyGeoIndex()
+
+@event.listens_for(Pharmacy, 'after_insert')
+@event.listens_for(Pharmacy, 'after_update')
+@event.listens_for(Pharmacy, 'after_delete')
+def _pharmacy_changed(mapper, connection, target):
+    pharmacy_geo_index.invalidate()
+
+def extract_postal_code(address):
+    """Return the 6-digit PIN code in an address, if any"""
+    match = _PIN_CODE.search(address or '')
+    return match.group(1) + match.group(2) if match else None
+
+def geocode_address(address):
+    """Look up an address's coordinates in the offline postal code table"""
+    postal_code = extract_postal_code(address)
+    if not postal_code:
+        return None
+    location = PostalCodeLocation.query.filter_by(postal_code=postal_code).first()
+    if not location:
+        return None
+    return location.latitude, location.longitude
+
+def geocode_pharmacies(overwrite=False):
+    """
+    Fill pharmacy coordinates from the offline postal code table
+
+    Pharmacies and postal codes are each read once; returns the number of
+    pharmacies updated. The caller is responsible for committing.
+    """
+    query = Pharmacy.query
+    if not overwrite:
+        query = query.filter(Pharmacy.latitude.is_(None))
+    pharmacies = query.all()
+
+    postal_codes = {pharmacy.id: extract_postal_code(pharmacy.address) for pharmacy in pharmacies}
+    locations = {
+        location.postal_code: location
+        for location in PostalCodeLocation.query.filter(
+            PostalCodeLocation.postal_code.in_({code for code in postal_codes.values() if code})
+        )
+    }
+
+    updated = 0
+    for pharmacy in pharmacies:
+        location = locations.get(postal_codes[pharmacy.id])
+        if location:
+            pharmacy.latitude = location.latitude
+            pharmacy.longitude = location.longitude
+            updated += 1
+    return updated
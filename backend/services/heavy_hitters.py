@@ -0,0 +1,234 @@
+"""
+Heavy Hitters Service - Streaming top-N medicines per pharmacy
+Each worker keeps one Space-Saving sketch per pharmacy, event kind and day,
+updated when a sale or dispense commits and persisted every
+HEAVY_HITTERS_PERSIST_SECONDS. A window's top-N merges the day sketches of
+this worker with those persisted by other workers.
+
+Error bound: with capacity k, a sketch over N units reports every item's
+count within N/k above its true count (the per-item `error` is the exact
+slack), and any item with more than N/k units is guaranteed to be listed.
+Merged sketches keep the same bound over their combined N.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import HeavyHitterSketch, Medicine, PrescriptionItem
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('sales', 'dispensed')
+MAX_WINDOW_DAYS = 365
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+class SpaceSaving:
+    """Space-Saving summary of a weighted stream (Metwally et al.)"""
+
+    def __init__(self, capacity, counters=None, total=0):
+        self.capacity = capacity
+        self.counters = {item: list(entry) for item, entry in (counters or {}).items()}  # item -> [count, error]
+        self.total = total
+
+    def add(self, item, weight=1):
+        self.total += weight
+        entry = self.counters.get(item)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+        else:
+            # Replace the smallest counter; the newcomer inherits its count as error
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + weight, floor]
+
+    def floor(self):
+        """Upper bound on the count of any item not in the summary"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other):
+        """Combined summary of both streams (Agarwal et al. mergeable summaries)"""
+        floor_self, floor_other = self.floor(), other.floor()
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count_a, error_a = self.counters.get(item, (floor_self, floor_self))
+            count_b, error_b = other.counters.get(item, (floor_other, floor_other))
+            merged[item] = [count_a + count_b, error_a + error_b]
+        kept = sorted(merged.items(), key=lambda pair: -pair[1][0])[:self.capacity]
+        return SpaceSaving(self.capacity, dict(kept), self.total + other.total)
+
+    def top(self, n):
+        """[(item, count, error)] for the n largest counters"""
+        ranked = sorted(self.counters.items(), key=lambda pair: (-pair[1][0], pair[0]))[:n]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+class HeavyHitterTracker:
+    """Process-wide sketches keyed by (pharmacy_id, kind, day)"""
+
+    def __init__(self):
+        self._sketches = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._last_persist = time.monotonic()
+        self._peer_cache = TTLCache(ttl=60)
+
+    def record(self, pharmacy_id, kind, weights, session=None):
+        """Queue {item: weight} for the sketch; applied when the session commits"""
+        if kind not in KINDS:
+            raise ValueError(f'Unknown heavy hitter kind: {kind}')
+        if weights:
+            session = session or db.session
+            session.info.setdefault('pending_heavy_hitters', []).append(
+                (uuid.UUID(str(pharmacy_id)), kind, datetime.utcnow().date(), weights)
+            )
+
+    def apply(self, pharmacy_id, kind, day, weights):
+        capacity = current_app.config['HEAVY_HITTERS_CAPACITY']
+        key = (pharmacy_id, kind, day)
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = SpaceSaving(capacity)
+            for item, weight in weights.items():
+                sketch.add(item, weight)
+            self._dirty.add(key)
+
+    def maybe_persist(self):
+        if time.monotonic() - self._last_persist >= current_app.config['HEAVY_HITTERS_PERSIST_SECONDS']:
+            self.persist()
+
+    def persist(self):
+        """Write dirty sketches and drop days that fell out of every window"""
+        cutoff = date.today() - timedelta(days=MAX_WINDOW_DAYS)
+        with self._lock:
+            self._last_persist = time.monotonic()
+            for key in [key for key in self._sketches if key[2] < cutoff]:
+                del self._sketches[key]
+            dirty = [(key, dict(self._sketches[key].counters), self._sketches[key].total)
+                     for key in self._dirty if key in self._sketches]
+            self._dirty.clear()
+
+        try:
+            self._write(dirty, cutoff)
+        except Exception:
+            # Keep the keys dirty so the next persist writes them again
+            with self._lock:
+                self._dirty.update(key for key, _, _ in dirty)
+            raise
+        return len(dirty)
+
+    def _write(self, dirty, cutoff):
+        now = datetime.utcnow()
+        # Separate connection: this may run from a session's after_commit hook
+        with db.engine.begin() as connection:
+            for (pharmacy_id, kind, day), counters, total in dirty:
+                connection.execute(delete(HeavyHitterSketch).where(
+                    HeavyHitterSketch.pharmacy_id == pharmacy_id,
+                    HeavyHitterSketch.kind == kind,
+                    HeavyHitterSketch.window_date == day,
+                    HeavyHitterSketch.node_id == NODE_ID
+                ))
+                connection.execute(insert(HeavyHitterSketch).values(
+                    id=uuid.uuid4(),
+                    pharmacy_id=pharmacy_id,
+                    kind=kind,
+                    window_date=day,
+                    node_id=NODE_ID,
+                    total=total,
+                    counters=counters,
+                    created_at=now,
+                    updated_at=now
+                ))
+            connection.execute(delete(HeavyHitterSketch).where(HeavyHitterSketch.window_date < cutoff))
+
+    def _peer_sketches(self, pharmacy_id, kind, start):
+        """Sketches persisted by other (or earlier) workers, cached between persists"""
+        def load():
+            rows = db.session.execute(
+                select(HeavyHitterSketch.total, HeavyHitterSketch.counters).where(
+                    HeavyHitterSketch.pharmacy_id == pharmacy_id,
+                    HeavyHitterSketch.kind == kind,
+                    HeavyHitterSketch.window_date >= start,
+                    HeavyHitterSketch.node_id != NODE_ID
+                )
+            ).all()
+            return [(row.total, row.counters) for row in rows]
+        return self._peer_cache.get_or_compute(
+            (pharmacy_id, kind, start), load, current_app.config['HEAVY_HITTERS_PERSIST_SECONDS']
+        )
+
+    def top(self, pharmacy_id, kind, days=30, n=10):
+        """
+        Top-n items over the last `days` days
+
+        Returns {'items': [{name, count, error}], 'total', 'error_bound'};
+        each count is at most error_bound above the true value.
+        """
+        pharmacy_id = uuid.UUID(str(pharmacy_id))
+        capacity = current_app.config['HEAVY_HITTERS_CAPACITY']
+        start = date.today() - timedelta(days=min(days, MAX_WINDOW_DAYS) - 1)
+
+        with self._lock:
+            local = [sketch for (sketch_pharmacy, sketch_kind, day), sketch in self._sketches.items()
+                     if sketch_pharmacy == pharmacy_id and sketch_kind == kind and day >= start]
+            merged = SpaceSaving(capacity)
+            for sketch in local:
+                merged = merged.merge(sketch)
+        for total, counters in self._peer_sketches(pharmacy_id, kind, start):
+            merged = merged.merge(SpaceSaving(capacity, counters, total))
+
+        return {
+            'items': [{'name': item, 'count': count, 'error': error} for item, count, error in merged.top(n)],
+            'total': merged.total,
+            'error_bound': merged.total / capacity
+        }
+
+    def reset(self):
+        with self._lock:
+            self._sketches.clear()
+            self._dirty.clear()
+        self._peer_cache.invalidate()
+
+heavy_hitters = HeavyHitterTracker()
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending_heavy_hitters(session):
+    pending = session.info.pop('pending_heavy_hitters', [])
+    for pharmacy_id, kind, day, weights in pending:
+        heavy_hitters.apply(pharmacy_id, kind, day, weights)
+    if pending:
+        try:
+            heavy_hitters.maybe_persist()
+        except Exception as e:
+            # The sale itself is committed; the sketch is retried at the next persist
+            logger.error(f'Failed to persist heavy hitter sketches: {e}')
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_heavy_hitters(session):
+    session.info.pop('pending_heavy_hitters', None)
+
+def record_dispensed(prescription):
+    """Count a fulfilled prescription's medicines toward 'most prescribed'"""
+    names = db.session.execute(
+        select(Medicine.name)
+        .join(PrescriptionItem, PrescriptionItem.medicine_id == Medicine.id)
+        .where(PrescriptionItem.prescription_id == prescription.id)
+    ).scalars().all()
+    weights = {}
+    for name in names:
+        weights[name] = weights.get(name, 0) + 1
+    heavy_hitters.record(prescription.pharmacy_id, 'dispensed', weights)
@@ -0,0 +1,253 @@
+"""
+Notification Retention Service - Monthly partitions and expiry purge for notifications
+On PostgreSQL, notifications is range-partitioned by created_at into one
+partition per month (notifications_pYYYYMM) plus a default partition that
+catches anything outside them. The retention job creates the coming months'
+partitions, removes whole partitions older than NOTIFICATION_RETENTION_DAYS,
+and deletes the remaining rows past expires_at or the retention window in
+small batches, each in its own short transaction, so cleanup never holds long
+locks and vacuum can reuse the freed space as it goes.
+
+Unread notifications removed either way are taken off the unread counters in
+the same transaction. On other databases (SQLite in development) only the
+batched delete runs.
+"""
+
+import logging
+import re
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, select, text, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from extensions import db
+from models import Notification
+from services.notifications import release_unread_counters
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'notifications'
+DEFAULT_PARTITION = 'notifications_default'
+# pg_get_expr of a range partition bound, rendered with TimeZone = UTC
+BOUND_PATTERN = re.compile(
+    r"FROM \((?:MINVALUE|'(\d{4}-\d{2}-\d{2})[^']*')\) TO \((?:MAXVALUE|'(\d{4}-\d{2}-\d{2})[^']*')\)"
+)
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+def supports_partitioning():
+    return db.engine.dialect.name == 'postgresql'
+
+def _begin_maintenance():
+    """Give up on locks quickly and render partition bounds in UTC, for this transaction"""
+    db.session.execute(
+        text("SELECT set_config('lock_timeout', :timeout, true), set_config('TimeZone', 'UTC', true)"),
+        {'timeout': current_app.config['NOTIFICATION_LOCK_TIMEOUT']}
+    )
+
+def is_partitioned():
+    return db.session.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {'table': TABLE}
+    ).scalar() == 'p'
+
+def _partitions():
+    """[(name, lower, upper)] of the range partitions, oldest first; None is unbounded"""
+    rows = db.session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)"
+    ), {'table': TABLE}).all()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_PATTERN.search(bound)
+        if match:  # the default partition has no range
+            lower, upper = (datetime.strptime(value, '%Y-%m-%d').date() if value else None
+                            for value in match.groups())
+            partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda partition: partition[1] or datetime.min.date())
+
+def partition_notifications_table(today=None):
+    """
+    Convert an unpartitioned notifications table (one-off, PostgreSQL only)
+
+    No rows are copied: the existing table becomes the partition holding
+    everything before next month, and is dropped by retention once all of it
+    is past the cutoff. It stays locked while the primary key is rebuilt to
+    include created_at, so run this in a quiet period. Returns False if the
+    table is already partitioned.
+    """
+    if is_partitioned():
+        return False
+    today = today or datetime.utcnow().date()
+    boundary = _next_month(_month_start(today))
+    legacy = f'{TABLE}_before_p{boundary:%Y%m}'
+
+    db.session.execute(text("SELECT set_config('TimeZone', 'UTC', true)"))
+    db.session.execute(text(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE'))
+    indexes = db.session.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {'table': TABLE}).all()
+
+    db.session.execute(text(f'ALTER TABLE {TABLE} RENAME TO {legacy}'))
+    for name, _ in indexes:
+        db.session.execute(text(f'ALTER INDEX {name} RENAME TO {name}_old'))
+    db.session.execute(text(f'ALTER TABLE {legacy} ALTER COLUMN created_at SET NOT NULL'))
+
+    db.session.execute(text(
+        f'CREATE TABLE {TABLE} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (created_at)'
+    ))
+    # A partitioned table's primary key must include the partition key
+    db.session.execute(text(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, created_at)'))
+    db.session.execute(text(
+        f'ALTER TABLE {TABLE} ADD FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id) ON DELETE CASCADE'
+    ))
+    for _, definition in indexes:
+        if 'UNIQUE' not in definition:
+            # The definitions name the table, which is now the partitioned one
+            db.session.execute(text(definition))
+
+    db.session.execute(text(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{boundary}')"
+    ))
+    db.session.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT'))
+    db.session.commit()
+    return True
+
+def _create_partition(month):
+    name = partition_name(month)
+    lower, upper = month, _next_month(month)
+
+    # Built detached, so only the final ATTACH locks the parent; the CHECK
+    # constraint spares ATTACH a scan of the new table
+    db.session.execute(text(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    if db.session.execute(text('SELECT to_regclass(:table)'), {'table': DEFAULT_PARTITION}).scalar():
+        # Rows of this month that fell into the default partition move with it.
+        # Writes to the default partition wait (up to the lock timeout) until
+        # the ATTACH, or one landing in between would make it fail its check
+        db.session.execute(text(f'LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE'))
+        db.session.execute(text(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            'WHERE created_at >= :lower AND created_at < :upper RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved'
+        ), {'lower': lower, 'upper': upper})
+    db.session.execute(text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds "
+        f"CHECK (created_at >= '{lower}' AND created_at < '{upper}')"
+    ))
+    db.session.execute(text(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    ))
+    db.session.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT {name}_bounds'))
+    return name
+
+def ensure_partitions(months_ahead, today=None):
+    """Create the partitions for this month and the next months_ahead; returns the new names"""
+    today = today or datetime.utcnow().date()
+    _begin_maintenance()
+    existing = _partitions()
+
+    created = []
+    month = _month_start(today)
+    for _ in range(months_ahead + 1):
+        covered = any((lower is None or lower <= month) and (upper is None or month < upper)
+                      for _, lower, upper in existing)
+        if not covered:
+            created.append(_create_partition(month))
+        month = _next_month(month)
+    db.session.commit()
+    return created
+
+def remove_expired_partitions(cutoff):
+    """
+    Drop partitions holding only rows created before cutoff (a date), or
+    just detach them when NOTIFICATION_ARCHIVE_PARTITIONS is set
+
+    Each partition goes in its own transaction; one whose locks cannot be
+    had within NOTIFICATION_LOCK_TIMEOUT is left for the next run.
+    """
+    archive = current_app.config['NOTIFICATION_ARCHIVE_PARTITIONS']
+    _begin_maintenance()
+    expired = [name for name, _, upper in _partitions() if upper is not None and upper <= cutoff]
+    db.session.commit()
+
+    removed = []
+    for name in expired:
+        try:
+            _begin_maintenance()
+            # Hold off writes to this partition only while its unread rows are counted
+            db.session.execute(text(f'LOCK TABLE {name} IN SHARE MODE'))
+            release_unread_counters(db.session.execute(text(
+                f'SELECT pharmacy_id, type, priority, count(*) FROM {name} '
+                'WHERE read_status IS NOT TRUE GROUP BY pharmacy_id, type, priority'
+            )).all())
+            db.session.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION {name}'))
+            if not archive:
+                db.session.execute(text(f'DROP TABLE {name}'))
+            db.session.commit()
+            removed.append(name)
+        except (IntegrityError, OperationalError) as e:
+            db.session.rollback()
+            logger.warning(f'Could not remove notification partition {name} ({e}); retrying next run')
+    return removed
+
+def _delete_in_batches(condition, batch_size):
+    deleted = 0
+    while True:
+        # SKIP LOCKED leaves rows being read or updated right now to a later run
+        batch = (
+            select(Notification.id, Notification.created_at)
+            .where(condition)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.session.execute(
+            delete(Notification)
+            .where(tuple_(Notification.id, Notification.created_at).in_(batch))
+            .returning(Notification.pharmacy_id, Notification.type, Notification.priority, Notification.read_status)
+            .execution_options(synchronize_session=False)
+        ).all()
+        unread = Counter(
+            (pharmacy_id, notification_type, priority)
+            for pharmacy_id, notification_type, priority, read_status in rows if not read_status
+        )
+        release_unread_counters(key + (removed,) for key, removed in unread.items())
+        db.session.commit()
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            return deleted
+
+def purge_expired_rows(cutoff, batch_size, now=None):
+    """Delete notifications past expires_at or created before cutoff (a datetime)"""
+    now = now or datetime.utcnow()
+    return (
+        _delete_in_batches(Notification.expires_at < now, batch_size)
+        + _delete_in_batches(Notification.created_at < cutoff, batch_size)
+    )
+
+def run_retention(retention_days=None, today=None):
+    """Enforce notification retention; returns a summary of what was removed"""
+    config = current_app.config
+    if retention_days is None:
+        retention_days = config['NOTIFICATION_RETENTION_DAYS']
+    today = today or datetime.utcnow().date()
+    cutoff = today - timedelta(days=retention_days)
+
+    summary = {'partitions_created': [], 'partitions_removed': [], 'rows_deleted': 0}
+    if supports_partitioning() and is_partitioned():
+        try:
+            summary['partitions_created'] = ensure_partitions(config['NOTIFICATION_PARTITION_MONTHS_AHEAD'], today)
+        except (IntegrityError, OperationalError) as e:
+            db.session.rollback()
+            logger.warning(f'Could not create notification partitions ({e}); retrying next run')
+        summary['partitions_removed'] = remove_expired_partitions(cutoff)
+    summary['rows_deleted'] = purge_expired_rows(datetime.combine(cutoff, time()), config['NOTIFICATION_PURGE_BATCH_SIZE'])
+    return summary
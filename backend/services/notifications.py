@@ -0,0 +1,252 @@
+"""
+Notification Service - Unread counters and live notification stream per pharmacy
+Unread notifications are counted per pharmacy, type and priority in
+notification_counters, adjusted by an upsert on the same connection (and so
+in the same transaction) as every insert, read and delete. The badge reads a
+handful of counter rows instead of counting notifications.
+
+New notifications and unread-count changes are published to the event
+broker just before the writing transaction commits, so they are delivered
+only if it does. Streams replay what a reconnecting client missed since its
+Last-Event-ID; delivery is at-least-once and clients de-duplicate by id.
+"""
+
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+
+from extensions import db
+from models import Notification, NotificationCounter
+from services.events import broker
+
+REPLAY_LIMIT = 200
+# Rows are stamped before they commit, so a notification may commit slightly
+# after a later-stamped one; replay reaches back this far to catch it
+REPLAY_SLACK = timedelta(seconds=5)
+
+def channel_for(pharmacy_id):
+    """Event channel carrying a pharmacy's notifications"""
+    return f'notifications:{pharmacy_id}'
+
+def unread_filter():
+    return func.coalesce(Notification.read_status, False).is_(False)
+
+def _counter_key(pharmacy_id, notification_type, priority):
+    return (uuid.UUID(str(pharmacy_id)), notification_type, priority or 'Normal')
+
+def _apply_counter_deltas(connection, deltas):
+    """Add {(pharmacy_id, type, priority): delta} to the counters in one upsert"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    dialect_insert = postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert
+    now = datetime.utcnow()
+    statement = dialect_insert(NotificationCounter).values([{
+        'id': uuid.uuid4(),
+        'pharmacy_id': pharmacy_id,
+        'type': notification_type,
+        'priority': priority,
+        'unread': delta,
+        'created_at': now,
+        'updated_at': now
+    } for (pharmacy_id, notification_type, priority), delta in sorted(deltas.items(), key=str)])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['pharmacy_id', 'type', 'priority'],
+        set_={
+            'unread': NotificationCounter.unread + statement.excluded.unread,
+            'updated_at': statement.excluded.updated_at
+        }
+    ))
+
+def adjust_unread_counters(rows, session=None):
+    """Count notifications inserted without the ORM (rows as passed to insert())"""
+    session = session or db.session
+    deltas = Counter(
+        _counter_key(row['pharmacy_id'], row['type'], row.get('priority'))
+        for row in rows if not row.get('read_status')
+    )
+    _apply_counter_deltas(session.connection(), deltas)
+
+def release_unread_counters(counts, session=None):
+    """
+    Take notifications removed without the ORM (bulk DELETE, dropped
+    partitions) off the counters; counts are (pharmacy_id, type, priority,
+    unread rows removed) tuples
+    """
+    session = session or db.session
+    deltas = Counter()
+    for pharmacy_id, notification_type, priority, removed in counts:
+        deltas[_counter_key(pharmacy_id, notification_type, priority)] -= removed
+    _apply_counter_deltas(session.connection(), deltas)
+    for pharmacy_id in {key[0] for key, delta in deltas.items() if delta}:
+        mark_unread_changed(pharmacy_id, session)
+
+def mark_all_read(pharmacy_id):
+    """Mark every unread notification of a pharmacy read; the caller commits"""
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    now = datetime.utcnow()
+    marked = db.session.execute(
+        update(Notification)
+        .where(Notification.pharmacy_id == pharmacy_id, unread_filter())
+        .values(read_status=True, read_at=now, updated_at=now)
+        .returning(Notification.type, Notification.priority)
+    ).all()
+    deltas = Counter()
+    for notification_type, priority in marked:
+        deltas[_counter_key(pharmacy_id, notification_type, priority)] -= 1
+    _apply_counter_deltas(db.session.connection(), deltas)
+    mark_unread_changed(pharmacy_id)
+    return len(marked)
+
+def unread_summaries(pharmacy_ids, session=None):
+    """{pharmacy_id: {'unread', 'by_type', 'by_priority'}} from the counters"""
+    session = session or db.session
+    pharmacy_ids = [uuid.UUID(str(pharmacy_id)) for pharmacy_id in pharmacy_ids]
+    summaries = {pharmacy_id: {'unread': 0, 'by_type': {}, 'by_priority': {}} for pharmacy_id in pharmacy_ids}
+    if not pharmacy_ids:
+        return summaries
+    rows = session.execute(
+        select(NotificationCounter.pharmacy_id, NotificationCounter.type,
+               NotificationCounter.priority, NotificationCounter.unread)
+        .where(NotificationCounter.pharmacy_id.in_(pharmacy_ids), NotificationCounter.unread != 0)
+    ).all()
+    for pharmacy_id, notification_type, priority, unread in rows:
+        summary = summaries[pharmacy_id]
+        summary['unread'] += unread
+        summary['by_type'][notification_type] = summary['by_type'].get(notification_type, 0) + unread
+        summary['by_priority'][priority] = summary['by_priority'].get(priority, 0) + unread
+    return summaries
+
+def unread_summary(pharmacy_id):
+    return unread_summaries([pharmacy_id])[uuid.UUID(str(pharmacy_id))]
+
+def rebuild_unread_counters():
+    """Recompute every counter from the notifications table"""
+    db.session.execute(delete(NotificationCounter))
+    rows = db.session.execute(
+        select(Notification.pharmacy_id, Notification.type,
+               func.coalesce(Notification.priority, 'Normal'), func.count())
+        .where(unread_filter())
+        .group_by(Notification.pharmacy_id, Notification.type, func.coalesce(Notification.priority, 'Normal'))
+    ).all()
+    now = datetime.utcnow()
+    if rows:
+        db.session.execute(insert(NotificationCounter), [{
+            'id': uuid.uuid4(),
+            'pharmacy_id': pharmacy_id,
+            'type': notification_type,
+            'priority': priority,
+            'unread': unread,
+            'created_at': now,
+            'updated_at': now
+        } for pharmacy_id, notification_type, priority, unread in rows])
+    db.session.commit()
+    return len(rows)
+
+def queue_new_notifications(payloads, session=None):
+    """
+    Publish notifications inserted without the ORM (e.g. bulk INSERTs)
+
+    payloads are Notification.to_dict() results; ORM inserts are picked up
+    automatically.
+    """
+    session = session or db.session
+    session.info.setdefault('new_notifications', []).extend(payloads)
+
+def mark_unread_changed(pharmacy_id, session=None):
+    """Publish a pharmacy's unread count at commit (for bulk UPDATE/DELETE)"""
+    session = session or db.session
+    session.info.setdefault('unread_changed', set()).add(uuid.UUID(str(pharmacy_id)))
+
+def missed_notifications(pharmacy_id, last_event_id):
+    """
+    Notifications created after the one a client last received
+
+    Returns None when the client must resynchronise instead: the id is
+    unknown (e.g. the notification was deleted) or too much was missed.
+    """
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    try:
+        last = db.session.get(Notification, uuid.UUID(last_event_id))
+    except ValueError:
+        return None
+    if last is None or last.pharmacy_id != pharmacy_id:
+        return None
+
+    missed = Notification.query.filter(
+        Notification.pharmacy_id == pharmacy_id,
+        Notification.created_at >= last.created_at - REPLAY_SLACK,
+        Notification.id != last.id
+    ).order_by(Notification.created_at, Notification.id).limit(REPLAY_LIMIT + 1).all()
+    if len(missed) > REPLAY_LIMIT:
+        return None
+    return [notification.to_dict() for notification in missed]
+
+COUNTED_ATTRIBUTES = ('pharmacy_id', 'type', 'priority', 'read_status')
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    return value
+
+# active_history loads the old value before a set, so after_update can
+# decrement the counter the row was in even when the attribute had expired
+for attribute in COUNTED_ATTRIBUTES:
+    event.listen(getattr(Notification, attribute), 'set', _keep_previous_value, retval=True, active_history=True)
+
+def _previous(state, attribute):
+    history = state.attrs[attribute].history
+    return history.deleted[0] if history.deleted else state.attrs[attribute].value
+
+@event.listens_for(Notification, 'after_insert')
+def _count_inserted_notification(mapper, connection, target):
+    if not target.read_status:
+        _apply_counter_deltas(connection, {_counter_key(target.pharmacy_id, target.type, target.priority): 1})
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('new_notifications', []).append(target.to_dict())
+
+@event.listens_for(Notification, 'after_update')
+def _count_updated_notification(mapper, connection, target):
+    state = inspect(target)
+    deltas = Counter()
+    if not _previous(state, 'read_status'):
+        deltas[_counter_key(_previous(state, 'pharmacy_id'), _previous(state, 'type'), _previous(state, 'priority'))] -= 1
+    if not target.read_status:
+        deltas[_counter_key(target.pharmacy_id, target.type, target.priority)] += 1
+    if any(deltas.values()):
+        _apply_counter_deltas(connection, deltas)
+        for pharmacy_id, _, _ in deltas:
+            mark_unread_changed(pharmacy_id, object_session(target))
+
+@event.listens_for(Notification, 'after_delete')
+def _count_deleted_notification(mapper, connection, target):
+    if not target.read_status:
+        _apply_counter_deltas(connection, {_counter_key(target.pharmacy_id, target.type, target.priority): -1})
+        mark_unread_changed(target.pharmacy_id, object_session(target))
+
+@event.listens_for(Session, 'before_commit')
+def _publish_notification_events(session):
+    # Flush first: inserts and updates are only queued as they are flushed
+    session.flush()
+    if not session.info.get('new_notifications') and not session.info.get('unread_changed'):
+        return
+    created = session.info.pop('new_notifications', [])
+    changed = session.info.pop('unread_changed', set())
+    changed |= {uuid.UUID(payload['pharmacy_id']) for payload in created}
+
+    # One publish for the whole commit, so a large fan-out costs one notify
+    # statement rather than two per pharmacy
+    summaries = unread_summaries(changed, session=session)
+    events = [(channel_for(payload['pharmacy_id']), {'event': 'notification', 'notification': payload})
+              for payload in created]
+    events.extend((channel_for(pharmacy_id), {'event': 'unread_count', **summary})
+                  for pharmacy_id, summary in summaries.items())
+    broker.publish_many(events, session=session)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_notification_events(session):
+    session.info.pop('new_notifications', None)
+    session.info.pop('unread_changed', None)
@@ -0,0 +1,97 @@
+"""
+Patient Analytics Service - Demographics computed in SQL
+Age buckets, gender, language and registrations come from one grouped query
+"""
+
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import case, func, or_, select, exists
+
+from extensions import db
+from models import Patient, Prescription, SalesTransaction
+
+# (label, minimum age) in descending order of age
+AGE_BUCKETS = (
+    ('75+', 76),
+    ('56-75', 56),
+    ('36-55', 36),
+    ('19-35', 19),
+    ('0-18', 0)
+)
+REGISTRATION_WINDOW_DAYS = 30
+
+def _years_ago(today, years):
+    """Return the date exactly `years` years before today"""
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # 29 February in a non-leap target year
+        return today.replace(year=today.year - years, day=28)
+
+def _age_bucket_expression(today):
+    """SQL CASE mapping date_of_birth to an age bucket label"""
+    whens = [(Patient.date_of_birth.is_(None), 'unknown')]
+    for label, min_age in AGE_BUCKETS[:-1]:
+        whens.append((Patient.date_of_birth <= _years_ago(today, min_age), label))
+    return case(*whens, else_=AGE_BUCKETS[-1][0])
+
+def _served_by_pharmacy(pharmacy_id):
+    """Patients with a prescription or purchase at the pharmacy"""
+    return or_(
+        exists().where(
+            Prescription.patient_id == Patient.id,
+            Prescription.pharmacy_id == pharmacy_id
+        ),
+        exists().where(
+            SalesTransaction.patient_id == Patient.id,
+            SalesTransaction.pharmacy_id == pharmacy_id
+        )
+    )
+
+def compute_patient_demographics(pharmacy_id):
+    """Compute patient demographics for a pharmacy in a single grouped query"""
+    today = date.today()
+    since = today - timedelta(days=REGISTRATION_WINDOW_DAYS)
+
+    age_bucket = _age_bucket_expression(today).label('age_bucket')
+    registration_day = case(
+        (Patient.created_at >= since, func.date(Patient.created_at)),
+        else_=None
+    ).label('registration_day')
+    gender = func.coalesce(Patient.gender, 'Unknown').label('gender')
+    language = func.coalesce(Patient.preferred_language, 'Unknown').label('language')
+
+    rows = db.session.execute(
+        select(age_bucket, gender, language, registration_day, func.count().label('patients'))
+        .where(_served_by_pharmacy(pharmacy_id))
+        .group_by(age_bucket, gender, language, registration_day)
+    ).all()
+
+    age_distribution = Counter({label: 0 for label, _ in reversed(AGE_BUCKETS)})
+    gender_distribution = Counter()
+    language_distribution = Counter()
+    registrations_per_day = Counter()
+    total_patients = 0
+
+    for row in rows:
+        total_patients += row.patients
+        age_distribution[row.age_bucket] += row.patients
+        gender_distribution[row.gender] += row.patients
+        language_distribution[row.language] += row.patients
+        if row.registration_day is not None:
+            registrations_per_day[str(row.registration_day)] += row.patients
+
+    return {
+        'total_patients': total_patients,
+        'new_patients_last_30_days': sum(registrations_per_day.values()),
+        'age_distribution': dict(age_distribution),
+        'gender_distribution': dict(gender_distribution),
+        'language_distribution': dict(language_distribution),
+        'registrations_per_day': dict(sorted(registrations_per_day.items()))
+    }
+
+def get_patient_demographics(pharmacy_id):
+    """Demographics for a pharmacy; the /api/analytics/patients endpoint caches the response"""
+    return compute_patient_demographics(uuid.UUID(str(pharmacy_id)))
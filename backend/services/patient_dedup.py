@@ -0,0 +1,211 @@
+"""
+Patient Deduplication Service - Find and merge duplicate patient records
+Uses blocking keys so candidate comparison stays near-linear in table size
+"""
+
+import re
+import uuid
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from extensions import db
+from models import Patient, Prescription, RareMedicineRequest, SalesTransaction
+
+# Blocks larger than this are placeholder values (shared reception phone,
+# "na@na.com" emails) and would reintroduce quadratic comparisons
+MAX_BLOCK_SIZE = 50
+DEFAULT_MIN_SCORE = 0.6
+
+# Fields copied from a duplicate onto the surviving record when it is blank
+MERGEABLE_FIELDS = (
+    'phone', 'email', 'date_of_birth', 'gender', 'address',
+    'emergency_contact', 'allergies', 'medical_conditions'
+)
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6'
+}
+
+def soundex(name):
+    """Return the 4 character American Soundex code for a name"""
+    letters = re.sub(r'[^a-z]', '', (name or '').lower())
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code
+        if letter not in 'hw':
+            previous = digit
+
+    return code.ljust(4, '0')
+
+def normalize_phone(phone):
+    """Reduce a phone number to its last 10 digits (drops +91 / leading 0)"""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) < 7:
+        return None
+    return digits[-10:]
+
+def normalize_email(email):
+    """Lowercase and trim an email address"""
+    email = (email or '').strip().lower()
+    return email or None
+
+def blocking_keys(first_name, last_name, date_of_birth, phone, email):
+    """Return the blocking keys a patient record falls into"""
+    keys = []
+    if date_of_birth and (first_name or last_name):
+        keys.append(('name_dob', soundex(first_name), soundex(last_name), date_of_birth.isoformat()))
+
+    normalized_phone = normalize_phone(phone)
+    if normalized_phone:
+        keys.append(('phone', normalized_phone))
+
+    normalized_email = normalize_email(email)
+    if normalized_email:
+        keys.append(('email', normalized_email))
+
+    return keys
+
+def score_pair(a, b):
+    """Score how likely two patient rows describe the same person (0..1)"""
+    score = 0.0
+    if a['phone'] and a['phone'] == b['phone']:
+        score += 0.5
+    if a['email'] and a['email'] == b['email']:
+        score += 0.4
+    if a['date_of_birth'] and a['date_of_birth'] == b['date_of_birth']:
+        score += 0.3
+    elif a['date_of_birth'] and b['date_of_birth']:
+        score -= 0.3
+
+    name_similarity = SequenceMatcher(None, a['name'], b['name']).ratio()
+    score += 0.4 * name_similarity
+
+    return max(0.0, min(1.0, score))
+
+def find_duplicate_candidates(min_score=DEFAULT_MIN_SCORE, limit=None, chunk_size=1000):
+    """
+    Find candidate duplicate patient pairs
+
+    Patients are streamed once to build the blocks, and only patients that
+    share a block are compared with each other.
+    """
+    patients = {}
+    blocks = defaultdict(list)
+
+    rows = db.session.query(
+        Patient.id,
+        Patient.first_name,
+        Patient.last_name,
+        Patient.phone,
+        Patient.email,
+        Patient.date_of_birth
+    ).execution_options(yield_per=chunk_size)
+
+    for row in rows:
+        patients[row.id] = {
+            'name': f'{row.first_name or ""} {row.last_name or ""}'.strip().lower(),
+            'phone': normalize_phone(row.phone),
+            'email': normalize_email(row.email),
+            'date_of_birth': row.date_of_birth
+        }
+        for key in blocking_keys(row.first_name, row.last_name, row.date_of_birth, row.phone, row.email):
+            blocks[key].append(row.id)
+
+    pair_reasons = defaultdict(set)
+    for key, members in blocks.items():
+        if len(members) < 2 or len(members) > MAX_BLOCK_SIZE:
+            continue
+        for i, left in enumerate(members):
+            for right in members[i + 1:]:
+                pair = (left, right) if str(left) < str(right) else (right, left)
+                pair_reasons[pair].add(key[0])
+
+    candidates = []
+    for (left, right), reasons in pair_reasons.items():
+        score = score_pair(patients[left], patients[right])
+        if score >= min_score:
+            candidates.append({
+                'patient_ids': [str(left), str(right)],
+                'score': round(score, 3),
+                'matched_on': sorted(reasons)
+            })
+
+    candidates.sort(key=lambda candidate: candidate['score'], reverse=True)
+    if limit:
+        candidates = candidates[:limit]
+
+    return candidates
+
+def merge_patients(primary_id, duplicate_ids):
+    """
+    Merge duplicate patients into the primary record
+
+    History rows are repointed with one bulk UPDATE per table, blank fields
+    on the primary are filled from the duplicates and the duplicates are
+    deleted. The caller is responsible for committing.
+    """
+    primary_id = uuid.UUID(str(primary_id))
+    duplicate_ids = list({uuid.UUID(str(dup_id)) for dup_id in duplicate_ids} - {primary_id})
+    if not duplicate_ids:
+        raise ValueError('At least one duplicate patient different from the primary is required.')
+
+    primary = db.session.get(Patient, primary_id)
+    if not primary:
+        raise LookupError('Primary patient not found.')
+
+    duplicates = Patient.query.filter(Patient.id.in_(duplicate_ids)).order_by(Patient.created_at).all()
+    if len(duplicates) != len(duplicate_ids):
+        raise LookupError('One or more duplicate patients not found.')
+
+    moved = {}
+    for model in (Prescription, RareMedicineRequest, SalesTransaction):
+        result = db.session.execute(
+            db.update(model)
+            .where(model.patient_id.in_(duplicate_ids))
+            .values(patient_id=primary.id)
+            .execution_options(synchronize_session=False)
+        )
+        moved[model.__tablename__] = result.rowcount
+
+    fills = {}
+    for duplicate in duplicates:
+        for field in MERGEABLE_FIELDS:
+            if getattr(primary, field) in (None, '') and field not in fills:
+                value = getattr(duplicate, field)
+                if value not in (None, ''):
+                    fills[field] = value
+
+    # Delete first so a phone number moving to the primary does not trip
+    # the unique constraint
+    db.session.execute(
+        db.delete(Patient)
+        .where(Patient.id.in_(duplicate_ids))
+        .execution_options(synchronize_session=False)
+    )
+    for duplicate in duplicates:
+        db.session.expunge(duplicate)
+
+    for field, value in fills.items():
+        setattr(primary, field, value)
+    db.session.flush()
+
+    return {
+        'primary_id': str(primary.id),
+        'merged_ids': [str(dup_id) for dup_id in duplicate_ids],
+        'moved': moved,
+        'filled_fields': sorted(fills)
+    }
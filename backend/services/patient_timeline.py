@@ -0,0 +1,130 @@
+"""
+Patient Timeline Service - Merge a patient's history into a single stream
+Prescriptions, dispensed items, sales and rare medicine requests are read
+with one UNION ALL query and paginated by keyset
+"""
+
+import base64
+import uuid
+from datetime import datetime
+
+from sqlalchemy import Integer, and_, or_, union_all, literal, func, select
+
+from extensions import db
+from models import (
+    Prescription, PrescriptionItem, Medicine, SalesTransaction, RareMedicineRequest
+)
+
+DEFAULT_TIMELINE_LIMIT = 50
+MAX_TIMELINE_LIMIT = 200
+
+def encode_cursor(occurred_at, event_id):
+    """Encode the keyset position of a timeline event"""
+    raw = f'{occurred_at.isoformat()}|{event_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        occurred_at, event_id = raw.split('|', 1)
+        return datetime.fromisoformat(occurred_at), uuid.UUID(event_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid timeline cursor.')
+
+def _timeline_union(patient_id):
+    """Build the UNION ALL of every event source for a patient"""
+    prescriptions = select(
+        literal('prescription').label('event_type'),
+        Prescription.id.label('event_id'),
+        Prescription.created_at.label('occurred_at'),
+        Prescription.doctor_name.label('title'),
+        Prescription.status.label('status'),
+        Prescription.total_amount.label('amount'),
+        literal(None, Integer).label('quantity'),
+        Prescription.id.label('prescription_id')
+    ).where(Prescription.patient_id == patient_id)
+
+    dispensed_items = select(
+        literal('dispensed_item').label('event_type'),
+        PrescriptionItem.id.label('event_id'),
+        func.coalesce(Prescription.date_fulfilled, PrescriptionItem.updated_at).label('occurred_at'),
+        Medicine.name.label('title'),
+        PrescriptionItem.status.label('status'),
+        PrescriptionItem.total_price.label('amount'),
+        PrescriptionItem.quantity_dispensed.label('quantity'),
+        Prescription.id.label('prescription_id')
+    ).select_from(PrescriptionItem).join(
+        Prescription, PrescriptionItem.prescription_id == Prescription.id
+    ).outerjoin(
+        Medicine, PrescriptionItem.medicine_id == Medicine.id
+    ).where(
+        Prescription.patient_id == patient_id,
+        PrescriptionItem.quantity_dispensed > 0
+    )
+
+    transactions = select(
+        literal('sale').label('event_type'),
+        SalesTransaction.id.label('event_id'),
+        func.coalesce(SalesTransaction.transaction_date, SalesTransaction.created_at).label('occurred_at'),
+        SalesTransaction.transaction_number.label('title'),
+        SalesTransaction.payment_status.label('status'),
+        SalesTransaction.total_amount.label('amount'),
+        literal(None, Integer).label('quantity'),
+        SalesTransaction.prescription_id.label('prescription_id')
+    ).where(SalesTransaction.patient_id == patient_id)
+
+    rare_requests = select(
+        literal('rare_request').label('event_type'),
+        RareMedicineRequest.id.label('event_id'),
+        func.coalesce(RareMedicineRequest.requested_date, RareMedicineRequest.created_at).label('occurred_at'),
+        RareMedicineRequest.medicine_name.label('title'),
+        RareMedicineRequest.status.label('status'),
+        RareMedicineRequest.estimated_cost.label('amount'),
+        RareMedicineRequest.quantity_needed.label('quantity'),
+        literal(None, Prescription.id.type).label('prescription_id')
+    ).where(RareMedicineRequest.patient_id == patient_id)
+
+    return union_all(prescriptions, dispensed_items, transactions, rare_requests).subquery('timeline')
+
+def get_patient_timeline(patient_id, cursor=None, limit=DEFAULT_TIMELINE_LIMIT):
+    """
+    Return one page of a patient's timeline, newest first
+
+    Returns a tuple of (events, next_cursor); next_cursor is None on the
+    last page.
+    """
+    patient_id = uuid.UUID(str(patient_id))
+    limit = max(1, min(limit, MAX_TIMELINE_LIMIT))
+    timeline = _timeline_union(patient_id)
+
+    query = select(timeline)
+    if cursor:
+        occurred_at, event_id = decode_cursor(cursor)
+        query = query.where(or_(
+            timeline.c.occurred_at < occurred_at,
+            and_(timeline.c.occurred_at == occurred_at, timeline.c.event_id < event_id)
+        ))
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(
+        query.order_by(timeline.c.occurred_at.desc(), timeline.c.event_id.desc()).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].occurred_at, rows[-1].event_id)
+
+    events = [{
+        'type': row.event_type,
+        'id': str(row.event_id),
+        'occurred_at': row.occurred_at.isoformat() if row.occurred_at else None,
+        'title': row.title,
+        'status': row.status,
+        'amount': float(row.amount) if row.amount is not None else None,
+        'quantity': row.quantity,
+        'prescription_id': str(row.prescription_id) if row.prescription_id else None
+    } for row in rows]
+
+    return events, next_cursor
@@ -0,0 +1,264 @@
+"""
+Prescription Items Service - Normalize prescription medicines into PrescriptionItem rows
+Medicines are resolved against the catalog in one batched lookup and the
+items are written with a single bulk INSERT
+"""
+
+import re
+import uuid
+from decimal import Decimal
+
+from sqlalchemy import delete, func, or_, exists, select
+
+from extensions import db
+from models import Medicine, Prescription, PrescriptionItem
+
+DEFAULT_DOSAGE_INSTRUCTIONS = 'As directed'
+ENTRY_SEPARATORS = re.compile(r'[\n;,]')
+
+def _to_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+def _to_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return quantity if quantity > 0 else 1
+
+def parse_medicine_entries(medicines):
+    """
+    Normalize the free-form medicines JSON into a list of dicts
+
+    Accepts a list of strings ("Paracetamol") or objects with any of
+    medicine_id/id, name/medicine_name, strength/dosage, quantity,
+    dosage_instructions/instructions, frequency, duration and
+    substitute_allowed. A single object is one entry and a plain string is
+    split on newlines, commas and semicolons. Raises ValueError for any
+    other type.
+    """
+    if medicines is None:
+        medicines = []
+    elif isinstance(medicines, str):
+        medicines = [name for name in ENTRY_SEPARATORS.split(medicines) if name.strip()]
+    elif isinstance(medicines, dict):
+        medicines = [medicines]
+    elif not isinstance(medicines, (list, tuple)):
+        raise ValueError('medicines must be a list, an object or a string')
+
+    entries = []
+    for raw in medicines:
+        if isinstance(raw, str):
+            raw = {'name': raw}
+        if not isinstance(raw, dict):
+            continue
+
+        name = (raw.get('name') or raw.get('medicine_name') or '').strip()
+        medicine_id = _to_uuid(raw.get('medicine_id') or raw.get('id'))
+        if not name and not medicine_id:
+            continue
+
+        entries.append({
+            'medicine_id': medicine_id,
+            'name': name,
+            'strength': (raw.get('strength') or raw.get('dosage') or '').strip() or None,
+            'quantity': _to_quantity(raw.get('quantity') or raw.get('quantity_prescribed')),
+            'dosage_instructions': raw.get('dosage_instructions') or raw.get('instructions') or DEFAULT_DOSAGE_INSTRUCTIONS,
+            'frequency': raw.get('frequency'),
+            'duration': raw.get('duration'),
+            'substitute_allowed': raw.get('substitute_allowed', True)
+        })
+    return entries
+
+def resolve_medicines(entries):
+    """
+    Resolve parsed entries to catalog medicines with one query
+
+    Returns a list aligned with entries holding (medicine_id, price) or None
+    when the medicine is not in the catalog.
+    """
+    ids = {entry['medicine_id'] for entry in entries if entry['medicine_id']}
+    names = {entry['name'].lower() for entry in entries if entry['name'] and not entry['medicine_id']}
+    if not ids and not names:
+        return [None] * len(entries)
+
+    conditions = []
+    if ids:
+        conditions.append(Medicine.id.in_(ids))
+    if names:
+        conditions.append(func.lower(Medicine.name).in_(names))
+
+    rows = db.session.execute(
+        select(Medicine.id, Medicine.name, Medicine.strength, Medicine.price).where(or_(*conditions))
+    ).all()
+
+    by_id = {row.id: row for row in rows}
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row.name.lower(), []).append(row)
+
+    resolved = []
+    for entry in entries:
+        match = None
+        if entry['medicine_id']:
+            match = by_id.get(entry['medicine_id'])
+        elif entry['name']:
+            candidates = by_name.get(entry['name'].lower(), [])
+            if entry['strength']:
+                strength = entry['strength'].lower()
+                match = next((row for row in candidates if (row.strength or '').lower() == strength), None)
+            if match is None and len(candidates) == 1:
+                match = candidates[0]
+        resolved.append((match.id, match.price) if match else None)
+    return resolved
+
+def build_item_rows(prescription_id, entries, resolved):
+    """Build PrescriptionItem insert rows for one prescription"""
+    rows = []
+    for entry, match in zip(entries, resolved):
+        medicine_id, price = match if match else (None, None)
+        unit_price = Decimal(price) if price is not None else None
+        rows.append({
+            'id': uuid.uuid4(),
+            'prescription_id': prescription_id,
+            'medicine_id': medicine_id,
+            'quantity_prescribed': entry['quantity'],
+            'quantity_dispensed': 0,
+            'dosage_instructions': entry['dosage_instructions'],
+            'frequency': entry['frequency'],
+            'duration': entry['duration'],
+            'unit_price': unit_price,
+            'total_price': unit_price * entry['quantity'] if unit_price is not None else None,
+            'substitute_allowed': bool(entry['substitute_allowed']),
+            'status': 'Pending'
+        })
+    return rows
+
+def bulk_insert_items(rows):
+    """Insert PrescriptionItem rows with one executemany INSERT"""
+    if rows:
+        db.session.execute(db.insert(PrescriptionItem), rows)
+    return len(rows)
+
+def create_prescription_items(prescription, medicines):
+    """
+    Create PrescriptionItem rows for a new prescription
+
+    Returns the number of items inserted and the entries that could not be
+    matched to the catalog. The caller is responsible for committing.
+    """
+    entries = parse_medicine_entries(medicines)
+    resolved = resolve_medicines(entries)
+    inserted = bulk_insert_items(build_item_rows(prescription.id, entries, resolved))
+
+    unresolved = [entry['name'] or str(entry['medicine_id']) for entry, match in zip(entries, resolved) if not match]
+    return inserted, unresolved
+
+def sync_prescription_items(prescription, medicines):
+    """
+    Replace a prescription's items after its medicines were edited
+
+    Units already dispensed carry over to the new items of the same
+    medicine. Returns the same (inserted, unresolved) as
+    create_prescription_items; the caller is responsible for committing.
+    """
+    dispensed = {}
+    for medicine_id, quantity in db.session.execute(
+        select(PrescriptionItem.medicine_id, PrescriptionItem.quantity_dispensed)
+        .where(PrescriptionItem.prescription_id == prescription.id, PrescriptionItem.quantity_dispensed > 0)
+    ):
+        if medicine_id:
+            dispensed[medicine_id] = dispensed.get(medicine_id, 0) + quantity
+
+    db.session.execute(
+        delete(PrescriptionItem)
+        .where(PrescriptionItem.prescription_id == prescription.id)
+        .execution_options(synchronize_session='fetch')
+    )
+    result = create_prescription_items(prescription, medicines)
+    record_dispensed_items(prescription.id, dispensed)
+    return result
+
+def record_dispensed_items(prescription_id, units_by_medicine):
+    """
+    Add units sold against a prescription to its items' quantity_dispensed
+
+    units_by_medicine maps medicine_id to units sold. Units fill the items of
+    each medicine in order, up to what was prescribed; items filled
+    completely are marked Dispensed. The caller is responsible for
+    committing.
+    """
+    if not units_by_medicine:
+        return 0
+    items = db.session.execute(
+        select(PrescriptionItem)
+        .where(
+            PrescriptionItem.prescription_id == prescription_id,
+            PrescriptionItem.medicine_id.in_(units_by_medicine)
+        )
+        .order_by(PrescriptionItem.created_at, PrescriptionItem.id)
+        .with_for_update()
+    ).scalars().all()
+
+    remaining = dict(units_by_medicine)
+    updated = 0
+    for item in items:
+        dispensed = item.quantity_dispensed or 0
+        units = min(remaining[item.medicine_id], item.quantity_prescribed - dispensed)
+        if units <= 0:
+            continue
+        remaining[item.medicine_id] -= units
+        item.quantity_dispensed = dispensed + units
+        if item.quantity_dispensed >= item.quantity_prescribed:
+            item.status = 'Dispensed'
+        updated += 1
+    return updated
+
+def backfill_prescription_items(chunk_size=500):
+    """
+    Convert historical Prescription.medicines JSON into PrescriptionItem rows
+
+    Prescriptions are processed in primary key order, one chunk per
+    transaction, with one catalog lookup and one bulk INSERT per chunk.
+    Prescriptions that already have items are skipped, so the job can be
+    re-run safely after an interruption.
+    """
+    last_id = None
+    total_prescriptions = 0
+    total_items = 0
+
+    while True:
+        query = select(Prescription.id, Prescription.medicines).where(
+            Prescription.medicines.isnot(None),
+            ~exists().where(PrescriptionItem.prescription_id == Prescription.id)
+        )
+        if last_id is not None:
+            query = query.where(Prescription.id > last_id)
+        chunk = db.session.execute(query.order_by(Prescription.id).limit(chunk_size)).all()
+        if not chunk:
+            break
+
+        parsed = []
+        for row in chunk:
+            try:
+                parsed.append((row.id, parse_medicine_entries(row.medicines)))
+            except ValueError:
+                parsed.append((row.id, []))
+        all_entries = [entry for _, entries in parsed for entry in entries]
+        all_resolved = iter(resolve_medicines(all_entries))
+
+        rows = []
+        for prescription_id, entries in parsed:
+            resolved = [next(all_resolved) for _ in entries]
+            rows.extend(build_item_rows(prescription_id, entries, resolved))
+
+        total_items += bulk_insert_items(rows)
+        total_prescriptions += len(chunk)
+        db.session.commit()
+
+        last_id = chunk[-1].id
+
+    return total_prescriptions, total_items
@@ -0,0 +1,48 @@
+"""
+Prescription Queue Service - Live prescription status changes per pharmacy
+Status changes are published to the event broker together with the
+pharmacy's per-status counters, so terminals never need to poll
+"""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from extensions import db
+from models import Prescription
+from services.events import broker
+
+def channel_for(pharmacy_id):
+    """Event channel carrying a pharmacy's prescription work queue"""
+    return f'prescriptions:{pharmacy_id}'
+
+def status_counts(pharmacy_id):
+    """Count a pharmacy's prescriptions per status"""
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    rows = db.session.execute(
+        select(Prescription.status, func.count())
+        .where(Prescription.pharmacy_id == pharmacy_id)
+        .group_by(Prescription.status)
+    ).all()
+    return {status or 'Unknown': count for status, count in rows}
+
+def publish_status_change(pharmacy_id, prescription_id, previous_status, new_status):
+    """
+    Publish a prescription status change to the pharmacy's queue stream
+
+    Must be called after the change has been flushed and before commit; the
+    counters are computed once here rather than by every terminal.
+    """
+    if not pharmacy_id or previous_status == new_status:
+        return
+
+    db.session.flush()
+    broker.publish(channel_for(pharmacy_id), {
+        'event': 'prescription_status',
+        'prescription_id': str(prescription_id),
+        'from_status': previous_status,
+        'to_status': new_status,
+        'counts': status_counts(pharmacy_id),
+        'at': datetime.utcnow().isoformat()
+    })
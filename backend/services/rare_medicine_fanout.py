@@ -0,0 +1,142 @@
+"""
+Rare Medicine Fan-out Service - Notify candidate pharmacies about rare medicine requests
+Each request becomes one multi-row Notification INSERT and one commit,
+however many pharmacies it reaches
+"""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy import case, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Notification, Pharmacy, RareMedicineRequest, RareMedicineResponse
+from services.notifications import adjust_unread_counters, queue_new_notifications
+from services.rare_medicine_matching import match_rare_request
+
+URGENCY_RANK = {'Critical': 0, 'High': 1, 'Normal': 2, 'Low': 3}
+BROADCAST_URGENCIES = ('Critical',)
+FANOUT_CANDIDATE_LIMIT = 200
+
+def normalize_urgency(urgency_level):
+    """Map free-form urgency input onto Low/Normal/High/Critical"""
+    urgency_level = (urgency_level or 'Normal').strip().title()
+    return urgency_level if urgency_level in URGENCY_RANK else 'Normal'
+
+def urgency_order():
+    """ORDER BY expression placing Critical requests first"""
+    return case(URGENCY_RANK, value=RareMedicineRequest.urgency_level, else_=len(URGENCY_RANK))
+
+def _target_pharmacies(rare_request, candidates):
+    """
+    Pharmacies to notify: those holding stock, or every pharmacy for
+    Critical requests and for High requests nobody holds stock for
+    """
+    urgency = normalize_urgency(rare_request.urgency_level)
+    if urgency in BROADCAST_URGENCIES or (urgency == 'High' and not candidates):
+        return db.session.execute(select(Pharmacy.id)).scalars().all()
+    return [uuid.UUID(candidate['pharmacy_id']) for candidate in candidates]
+
+def fan_out_request(rare_request, match=None):
+    """
+    Insert a notification for every target pharmacy of a request
+
+    match is a match_rare_request result with limit=FANOUT_CANDIDATE_LIMIT,
+    when the caller already has one. Uses a single executemany INSERT, which
+    SQLAlchemy renders as multi-row VALUES batches. The caller is
+    responsible for committing.
+    """
+    if rare_request.fanned_out_at is not None:
+        return 0
+
+    if match is None:
+        match = match_rare_request(rare_request, limit=FANOUT_CANDIDATE_LIMIT)
+    stock_by_pharmacy = {candidate['pharmacy_id']: candidate for candidate in match['candidates']}
+    pharmacy_ids = _target_pharmacies(rare_request, match['candidates'])
+
+    urgency = normalize_urgency(rare_request.urgency_level)
+    strength = rare_request.strength or rare_request.dosage
+    medicine = f'{rare_request.medicine_name} {strength}' if strength else rare_request.medicine_name
+    now = datetime.utcnow()
+
+    rows = []
+    for pharmacy_id in pharmacy_ids:
+        stock = stock_by_pharmacy.get(str(pharmacy_id))
+        rows.append({
+            'id': uuid.uuid4(),
+            'pharmacy_id': pharmacy_id,
+            'user_id': pharmacy_id,
+            'type': 'Rare Medicine',
+            'notification_type': 'Rare Medicine',
+            'priority': urgency,
+            'title': f'{urgency} rare medicine request: {medicine}',
+            'message': f'A patient needs {rare_request.quantity_needed} x {medicine}. '
+                       f'Please respond if you can supply it.',
+            'data': {
+                'request_id': str(rare_request.id),
+                'medicine_ids': match['medicine_ids'],
+                'quantity_needed': rare_request.quantity_needed,
+                'urgency_level': urgency,
+                'quantity_in_stock': stock['quantity_available'] if stock else 0
+            },
+            'action_required': True,
+            'read_status': False,
+            'created_at': now,
+            'updated_at': now
+        })
+
+    if rows:
+        db.session.execute(insert(Notification), rows)
+        adjust_unread_counters(rows)
+        queue_new_notifications([Notification(**row).to_dict() for row in rows])
+    rare_request.fanned_out_at = now
+    return len(rows)
+
+def fan_out_pending_requests(limit=100):
+    """
+    Fan out requests that have not been sent to pharmacies yet
+
+    Requests are processed most urgent first, then oldest first, one
+    commit per request.
+    """
+    requests = RareMedicineRequest.query.filter(
+        RareMedicineRequest.fanned_out_at.is_(None),
+        RareMedicineRequest.status == 'Pending'
+    ).order_by(urgency_order(), RareMedicineRequest.requested_date).limit(limit).all()
+
+    notified = 0
+    for rare_request in requests:
+        notified += fan_out_request(rare_request)
+        db.session.commit()
+    return len(requests), notified
+
+def record_response(request_id, pharmacy_id, data):
+    """
+    Record a pharmacy's response to a rare medicine request
+
+    The unique_response_per_pharmacy constraint makes retries idempotent:
+    a repeated response returns the stored row and created=False.
+    """
+    response = RareMedicineResponse(
+        request_id=request_id,
+        pharmacy_id=pharmacy_id,
+        status=data.get('status'),
+        estimated_availability_date=data.get('estimated_availability_date'),
+        estimated_price=data.get('estimated_price'),
+        pharmacy_notes=data.get('pharmacy_notes'),
+        contact_person=data.get('contact_person'),
+        contact_phone=data.get('contact_phone')
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(response)
+        return response, True
+    except IntegrityError:
+        existing = RareMedicineResponse.query.filter_by(
+            request_id=request_id,
+            pharmacy_id=pharmacy_id
+        ).first()
+        if existing is None:
+            raise
+        return existing, False
@@ -0,0 +1,103 @@
+"""
+Rare Medicine Matching Service - Find pharmacies holding a requested rare medicine
+Requests are resolved to catalog medicines, then every pharmacy's stock is
+aggregated in one indexed inventory query and ranked
+"""
+
+import re
+from datetime import date
+
+from sqlalchemy import func, or_, select
+
+from extensions import db
+from models import Inventory, Medicine, Pharmacy
+
+DEFAULT_CANDIDATE_LIMIT = 20
+
+def normalize_strength(strength):
+    """'500 MG' -> '500mg' so free-text strengths compare equal"""
+    return re.sub(r'\s+', '', (strength or '').lower()) or None
+
+def resolve_catalog_ids(medicine_name, generic_name=None, strength=None):
+    """Resolve a requested medicine to catalog medicine ids with one query"""
+    names = {name.strip().lower() for name in (medicine_name, generic_name) if name and name.strip()}
+    if not names:
+        return []
+
+    rows = db.session.execute(
+        select(Medicine.id, Medicine.strength).where(or_(
+            func.lower(Medicine.name).in_(names),
+            func.lower(Medicine.generic_name).in_(names),
+            func.lower(Medicine.brand_name).in_(names)
+        ))
+    ).all()
+
+    wanted_strength = normalize_strength(strength)
+    if wanted_strength:
+        matching = [row.id for row in rows if normalize_strength(row.strength) == wanted_strength]
+        # Fall back to every strength rather than report no stock at all
+        if matching:
+            return matching
+    return [row.id for row in rows]
+
+def find_candidate_pharmacies(medicine_ids, quantity_needed=1, limit=DEFAULT_CANDIDATE_LIMIT):
+    """
+    Rank pharmacies by usable stock of the given medicines
+
+    Pharmacies that can cover the whole quantity come first, then by
+    available quantity, then by the longest remaining shelf life.
+    """
+    if not medicine_ids:
+        return []
+
+    today = date.today()
+    usable = Inventory.quantity_available - Inventory.quantity_reserved
+    rows = db.session.execute(
+        select(
+            Inventory.pharmacy_id,
+            Pharmacy.name,
+            Pharmacy.phone,
+            Pharmacy.address,
+            func.sum(usable).label('available'),
+            func.count().label('batches'),
+            func.min(Inventory.expiry_date).label('earliest_expiry'),
+            func.max(Inventory.expiry_date).label('latest_expiry'),
+            func.min(Inventory.mrp).label('lowest_mrp')
+        )
+        .join(Pharmacy, Pharmacy.id == Inventory.pharmacy_id)
+        .where(
+            Inventory.medicine_id.in_(medicine_ids),
+            Inventory.expiry_date > today,
+            usable > 0
+        )
+        .group_by(Inventory.pharmacy_id, Pharmacy.name, Pharmacy.phone, Pharmacy.address)
+    ).all()
+
+    rows.sort(key=lambda row: (row.available < quantity_needed, -row.available, today - row.latest_expiry))
+
+    return [{
+        'pharmacy_id': str(row.pharmacy_id),
+        'pharmacy_name': row.name,
+        'phone': row.phone,
+        'address': row.address,
+        'quantity_available': int(row.available),
+        'covers_request': row.available >= quantity_needed,
+        'batches': row.batches,
+        'earliest_expiry': row.earliest_expiry.isoformat(),
+        'latest_expiry': row.latest_expiry.isoformat(),
+        'lowest_mrp': float(row.lowest_mrp) if row.lowest_mrp is not None else None,
+        'rank': rank
+    } for rank, row in enumerate(rows[:limit], start=1)]
+
+def match_rare_request(rare_request, limit=DEFAULT_CANDIDATE_LIMIT):
+    """Return ranked candidate pharmacies for a rare medicine request"""
+    medicine_ids = resolve_catalog_ids(
+        rare_request.medicine_name,
+        rare_request.generic_name,
+        rare_request.strength or rare_request.dosage
+    )
+    candidates = find_candidate_pharmacies(medicine_ids, rare_request.quantity_needed or 1, limit)
+    return {
+        'medicine_ids': [str(medicine_id) for medicine_id in medicine_ids],
+        'candidates': candidates
+    }
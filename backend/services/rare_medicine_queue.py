@@ -0,0 +1,129 @@
+"""
+Rare Medicine Queue Service - Lease pending rare medicine requests to staff
+The next request is chosen by urgency (boosted by age) and claimed with
+FOR UPDATE SKIP LOCKED, so concurrent staff never block on or receive the
+same request. The aged priority depends on the current time and cannot be
+indexed; the partial index on pending requests keeps the rows it sorts to
+the pending few.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, func, or_, update
+
+from extensions import db
+from models import RareMedicineRequest
+from services.rare_medicine_fanout import URGENCY_RANK
+
+PENDING_STATUS = 'Pending'
+DEFAULT_LEASE_SECONDS = 300
+MAX_LEASE_SECONDS = 3600
+# Waiting this long raises a request by one urgency level (Low -> Normal -> ...)
+AGING_STEP = timedelta(hours=12)
+
+class LeaseError(Exception):
+    """Raised when a lease is missing, expired or held by someone else"""
+
+def normalize_status(status):
+    """Store every spelling of pending as PENDING_STATUS, which the queue index covers"""
+    if isinstance(status, str) and status.strip().lower() == PENDING_STATUS.lower():
+        return PENDING_STATUS
+    return status
+
+def normalize_pending_statuses():
+    """Rewrite older lowercase 'pending' rows (one-off); the caller commits"""
+    return db.session.execute(
+        update(RareMedicineRequest)
+        .where(func.lower(RareMedicineRequest.status) == PENDING_STATUS.lower(),
+               RareMedicineRequest.status != PENDING_STATUS)
+        .values(status=PENDING_STATUS)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+def effective_priority(now):
+    """
+    SQL expression for the queue order: urgency rank minus one level per
+    AGING_STEP waited, so old Normal requests eventually overtake new High
+    ones. Aging stops at High; only Critical requests rank 0.
+    """
+    rank = case(URGENCY_RANK, value=RareMedicineRequest.urgency_level, else_=URGENCY_RANK['Normal'])
+    boosts = [
+        case((RareMedicineRequest.requested_date <= now - AGING_STEP * level, 1), else_=0)
+        for level in range(1, len(URGENCY_RANK))
+    ]
+    aged = rank - sum(boosts[1:], boosts[0])
+    return case(
+        (rank == URGENCY_RANK['Critical'], URGENCY_RANK['Critical']),
+        (aged < URGENCY_RANK['High'], URGENCY_RANK['High']),
+        else_=aged
+    )
+
+def _lease_available(now):
+    return or_(
+        RareMedicineRequest.lease_expires_at.is_(None),
+        RareMedicineRequest.lease_expires_at < now
+    )
+
+def _utcnow():
+    """Aware UTC now; the queue's columns are timestamptz, loaded aware on PostgreSQL"""
+    return datetime.now(timezone.utc)
+
+def _lease_expired(rare_request, now):
+    expires_at = rare_request.lease_expires_at
+    if expires_at is None:
+        return True
+    if expires_at.tzinfo is None:  # SQLite keeps no offset; the stored value is UTC
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at < now
+
+def _lease_seconds(seconds):
+    return max(1, min(int(seconds or DEFAULT_LEASE_SECONDS), MAX_LEASE_SECONDS))
+
+def lease_next_request(holder, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Claim the highest-priority pending request that is not leased
+
+    Returns the request, or None when the queue is empty. The caller is
+    responsible for committing, which is what publishes the lease.
+    """
+    now = _utcnow()
+    rare_request = RareMedicineRequest.query.filter(
+        RareMedicineRequest.status == PENDING_STATUS,
+        _lease_available(now)
+    ).order_by(
+        effective_priority(now),
+        RareMedicineRequest.requested_date,
+        RareMedicineRequest.id
+    ).with_for_update(skip_locked=True).first()
+
+    if rare_request is None:
+        return None
+
+    rare_request.leased_by = holder
+    rare_request.lease_expires_at = now + timedelta(seconds=_lease_seconds(lease_seconds))
+    return rare_request
+
+def _held_lease(request_id, holder):
+    """Lock a request and check the caller still holds its lease"""
+    rare_request = RareMedicineRequest.query.filter(
+        RareMedicineRequest.id == uuid.UUID(str(request_id))
+    ).with_for_update().first()
+    if rare_request is None:
+        raise LookupError('Rare medicine request not found.')
+    if rare_request.leased_by != holder or _lease_expired(rare_request, _utcnow()):
+        raise LeaseError('Lease is not held by the caller or has expired.')
+    return rare_request
+
+def renew_lease(request_id, holder, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extend a held lease; the caller is responsible for committing"""
+    rare_request = _held_lease(request_id, holder)
+    rare_request.lease_expires_at = _utcnow() + timedelta(seconds=_lease_seconds(lease_seconds))
+    return rare_request
+
+def release_lease(request_id, holder):
+    """Return a leased request to the queue; the caller is responsible for committing"""
+    rare_request = _held_lease(request_id, holder)
+    rare_request.leased_by = None
+    rare_request.lease_expires_at = None
+    return rare_request
@@ -0,0 +1,364 @@
+"""
+Report Service - Asynchronous sales, inventory and expiry exports
+Exporting creates a ReportJob and returns at once; the file is written by a
+background worker: an in-process thread pool, or Celery when REPORT_EXECUTOR
+is 'celery'. Rows are streamed from a server-side cursor straight into the
+CSV writer or a write-only XLSX workbook, so memory stays bounded however
+large the report is.
+"""
+
+import csv
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select, update
+
+from extensions import db
+from models import ExpiryRiskScore, Inventory, Medicine, ReportJob, SalesTransaction, SalesTransactionItem
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+FETCH_SIZE = 5000
+XLSX_MAX_ROWS = 1048576  # Excel's per-sheet limit, header included
+DEFAULT_EXPIRY_DAYS = 90
+
+class ReportError(ValueError):
+    """Invalid report request"""
+
+def _date_range(params):
+    """Naive UTC bounds for the optional start/end (inclusive) dates"""
+    start = params.get('start')
+    end = params.get('end')
+    return (
+        datetime.combine(date.fromisoformat(start), time()) if start else None,
+        datetime.combine(date.fromisoformat(end) + timedelta(days=1), time()) if end else None
+    )
+
+def _sales_report(pharmacy_id, params):
+    start, end = _date_range(params)
+    filters = [SalesTransaction.pharmacy_id == pharmacy_id]
+    if start:
+        filters.append(SalesTransaction.transaction_date >= start)
+    if end:
+        filters.append(SalesTransaction.transaction_date < end)
+
+    statement = (
+        select(
+            SalesTransaction.transaction_number,
+            SalesTransaction.transaction_date,
+            SalesTransactionItem.medicine_name,
+            SalesTransactionItem.batch_number,
+            SalesTransactionItem.quantity_sold,
+            SalesTransactionItem.unit_price,
+            SalesTransactionItem.total_price,
+            SalesTransaction.payment_method,
+            SalesTransaction.payment_status
+        )
+        .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+        .where(*filters)
+        .order_by(SalesTransaction.transaction_date, SalesTransaction.transaction_number)
+    )
+    headers = ['Transaction Number', 'Date', 'Medicine', 'Batch', 'Quantity',
+               'Unit Price', 'Total', 'Payment Method', 'Payment Status']
+    return headers, statement, tuple
+
+def _inventory_report(pharmacy_id, params):
+    statement = (
+        select(
+            Medicine.name,
+            Medicine.generic_name,
+            Inventory.batch_number,
+            Inventory.manufacture_date,
+            Inventory.expiry_date,
+            Inventory.quantity_available,
+            Inventory.quantity_reserved,
+            Inventory.minimum_threshold,
+            Inventory.unit_price,
+            Inventory.mrp,
+            Inventory.quantity_available * Inventory.unit_price,
+            Inventory.supplier_name
+        )
+        .join(Medicine, Medicine.id == Inventory.medicine_id)
+        .where(Inventory.pharmacy_id == pharmacy_id)
+        .order_by(Medicine.name, Inventory.expiry_date)
+    )
+    headers = ['Medicine', 'Generic Name', 'Batch', 'Manufactured', 'Expiry', 'Available',
+               'Reserved', 'Minimum Threshold', 'Unit Price', 'MRP', 'Stock Value', 'Supplier']
+    return headers, statement, tuple
+
+def _expiry_report(pharmacy_id, params):
+    today = date.today()
+    days = int(params.get('days', DEFAULT_EXPIRY_DAYS))
+    statement = (
+        select(
+            Medicine.name,
+            Inventory.batch_number,
+            Inventory.expiry_date,
+            Inventory.quantity_available,
+            Inventory.unit_price,
+            ExpiryRiskScore.units_at_risk,
+            ExpiryRiskScore.value_at_risk
+        )
+        .join(Medicine, Medicine.id == Inventory.medicine_id)
+        .outerjoin(ExpiryRiskScore, ExpiryRiskScore.inventory_id == Inventory.id)
+        .where(and_(
+            Inventory.pharmacy_id == pharmacy_id,
+            Inventory.quantity_available > 0,
+            Inventory.expiry_date <= today + timedelta(days=days)
+        ))
+        .order_by(Inventory.expiry_date, Medicine.name)
+    )
+    headers = ['Medicine', 'Batch', 'Expiry', 'Days to Expiry', 'Available',
+               'Unit Price', 'Units at Risk', 'Value at Risk']
+
+    def format_row(row):
+        name, batch, expiry, quantity, unit_price, units_at_risk, value_at_risk = row
+        return (name, batch, expiry, (expiry - today).days, quantity, unit_price, units_at_risk, value_at_risk)
+    return headers, statement, format_row
+
+REPORT_TYPES = {
+    'sales': _sales_report,
+    'inventory': _inventory_report,
+    'expiry': _expiry_report
+}
+
+def _cell(value):
+    """Excel has no time zones, so aware datetimes are written as naive UTC"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _write_csv(path, title, headers, rows):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def _write_xlsx(path, title, headers, rows):
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows to disk instead of holding the sheet
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, sheets, count = None, XLSX_MAX_ROWS, 0, 0
+    for row in rows:
+        if sheet_rows >= XLSX_MAX_ROWS:
+            sheets += 1
+            sheet = workbook.create_sheet(title if sheets == 1 else f'{title} {sheets}')
+            sheet.append(headers)
+            sheet_rows = 1
+        sheet.append([_cell(value) for value in row])
+        sheet_rows += 1
+        count += 1
+    if sheet is None:
+        workbook.create_sheet(title).append(headers)
+    workbook.save(path)
+    return count
+
+WRITERS = {
+    'csv': _write_csv,
+    'xlsx': _write_xlsx
+}
+
+def create_report_job(pharmacy_id, report_type, format_type, parameters=None):
+    """Validate and queue a report; the caller commits and then calls report_runner.submit"""
+    if report_type not in REPORT_TYPES:
+        raise ReportError(f"type must be one of {', '.join(REPORT_TYPES)}")
+    if format_type not in FORMATS:
+        raise ReportError(f"format must be one of {', '.join(FORMATS)}")
+    job = ReportJob(
+        pharmacy_id=uuid.UUID(str(pharmacy_id)),
+        report_type=report_type,
+        format=format_type,
+        parameters=parameters or {},
+        status='queued'
+    )
+    db.session.add(job)
+    return job
+
+def generate_report(job_id):
+    """Write a queued report's file; runs on a report worker inside an app context"""
+    job_id = uuid.UUID(str(job_id))
+    # Claim the job so a retried or duplicated task never runs it twice
+    claimed = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return
+
+    job = db.session.get(ReportJob, job_id)
+    folder = current_app.config['REPORT_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{job.id}.{job.format}')
+    partial = f'{path}.part'
+
+    try:
+        headers, statement, format_row = REPORT_TYPES[job.report_type](job.pharmacy_id, job.parameters or {})
+        result = db.session.execute(statement.execution_options(stream_results=True, yield_per=FETCH_SIZE))
+        rows = _with_heartbeat(job_id, (format_row(row) for row in result))
+        count = WRITERS[job.format](partial, job.report_type.title(), headers, rows)
+        result.close()
+        os.replace(partial, path)
+
+        # Conditional, so a job failed as stale in the meantime stays failed
+        completed = _finish_job(
+            job_id, status='completed', row_count=count, file_path=path, file_size=os.path.getsize(path)
+        )
+        if not completed and os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        logger.exception(f'Report {job_id} failed')
+        db.session.rollback()
+        if os.path.exists(partial):
+            os.remove(partial)
+        _finish_job(job_id, status='failed', error=str(e))
+
+def _finish_job(job_id, **values):
+    """Record a running job's outcome; returns False if it is no longer running"""
+    finished = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == 'running')
+        .values(completed_at=datetime.utcnow(), updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return bool(finished)
+
+def _with_heartbeat(job_id, rows):
+    """
+    Pass rows through, bumping the job's updated_at every FETCH_SIZE rows
+
+    fail_stale_jobs judges running jobs by this heartbeat, so a long export
+    that is still streaming is never taken for an interrupted one. Written
+    on its own connection: the session is busy streaming the report. SQLite
+    (development) cannot commit that write while the read is open, so there
+    is no heartbeat there.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        yield from rows
+        return
+    for count, row in enumerate(rows, 1):
+        if count % FETCH_SIZE == 0:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    update(ReportJob)
+                    .where(ReportJob.id == job_id, ReportJob.status == 'running')
+                    .values(updated_at=datetime.utcnow())
+                )
+        yield row
+
+def fail_stale_jobs(timeout_minutes, pharmacy_id=None):
+    """
+    Fail jobs queued, or running without a heartbeat, for longer than timeout_minutes
+
+    The in-process pool loses its jobs when the process restarts, so those
+    would otherwise never finish. A running job's worker bumps updated_at as
+    it streams, so only one that has stopped goes stale. Returns how many
+    were failed; the caller commits.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=timeout_minutes)
+    filters = [or_(
+        and_(ReportJob.status == 'running', ReportJob.updated_at < cutoff),
+        and_(ReportJob.status == 'queued', ReportJob.created_at < cutoff)
+    )]
+    if pharmacy_id is not None:
+        filters.append(ReportJob.pharmacy_id == uuid.UUID(str(pharmacy_id)))
+    # Polled often, so look before taking any row locks
+    stale = db.session.execute(select(ReportJob.id).where(*filters)).scalars().all()
+    if not stale:
+        return 0
+    return db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id.in_(stale), *filters)
+        .values(status='failed', error='Interrupted before completing',
+                completed_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+def purge_reports(retention_days):
+    """Delete report jobs (and their files) older than retention_days"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    jobs = db.session.execute(
+        select(ReportJob.id, ReportJob.file_path).where(ReportJob.created_at < cutoff)
+    ).all()
+    for _, file_path in jobs:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+    db.session.execute(delete(ReportJob).where(ReportJob.id.in_([job_id for job_id, _ in jobs])))
+    db.session.commit()
+    return len(jobs)
+
+class ReportRunner:
+    """Dispatch queued report jobs to Celery or the in-process pool"""
+
+    def __init__(self):
+        self.backend = 'thread'
+        self.app = None
+        self._executor = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.get('REPORT_EXECUTOR', 'thread')
+        if self.backend == 'celery':
+            try:
+                self._task = self._create_celery_task(app)
+            except ImportError:
+                logger.warning('Celery is not installed; generating reports in-process')
+                self.backend = 'thread'
+
+    def _create_celery_task(self, app):
+        from celery import Celery
+
+        celery = Celery(app.import_name,
+                        broker=app.config['CELERY_BROKER_URL'],
+                        backend=app.config['CELERY_RESULT_BACKEND'])
+
+        @celery.task(name='reports.generate', ignore_result=True)
+        def generate_report_task(job_id):
+            with app.app_context():
+                generate_report(job_id)
+
+        app.extensions['celery'] = celery
+        return generate_report_task
+
+    def submit(self, job_id):
+        """Start generating a committed job"""
+        if self.backend == 'celery':
+            try:
+                self._task.delay(str(job_id))
+                return
+            except Exception as e:
+                logger.warning(f'Could not queue report {job_id} on Celery ({e}); generating in-process')
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config['REPORT_WORKERS'], thread_name_prefix='report'
+                )
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                generate_report(job_id)
+            except Exception:
+                logger.exception(f'Report worker crashed on {job_id}')
+
+report_runner = ReportRunner()
@@ -0,0 +1,254 @@
+"""
+Sales Rollup Service - Daily sales aggregates maintained at checkout
+Every checkout appends one delta row per pharmacy and per medicine sold, so
+checkouts never contend on a shared counter row. Nightly compaction merges
+each past day's deltas into a single row per key, keeping period queries to
+a handful of rows per day.
+"""
+
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select
+
+from extensions import db
+from models import (
+    DailyMedicineSalesRollup, DailySalesRollup, Inventory, SalesTransaction, SalesTransactionItem
+)
+from services.heavy_hitters import heavy_hitters
+
+PERIOD_DAYS = {'daily': 1, 'weekly': 7, 'monthly': 30, 'yearly': 365}
+TOP_MEDICINES_LIMIT = 10
+
+# Grouping keys and summed columns of each rollup table
+_ROLLUPS = (
+    (DailySalesRollup,
+     ('pharmacy_id', 'sales_date'),
+     ('transaction_count', 'subtotal', 'discount_amount', 'tax_amount', 'total_revenue')),
+    (DailyMedicineSalesRollup,
+     ('pharmacy_id', 'sales_date', 'medicine_id', 'medicine_name'),
+     ('quantity_sold', 'revenue')),
+)
+
+def record_sale(transaction, lines):
+    """
+    Append rollup deltas for a completed checkout
+
+    lines are dicts with medicine_id, medicine_name, quantity and revenue.
+    Runs inside the checkout's transaction; the caller commits.
+    """
+    now = datetime.utcnow()
+    sales_date = transaction.transaction_date.date()
+
+    db.session.execute(insert(DailySalesRollup).values(
+        id=uuid.uuid4(),
+        pharmacy_id=transaction.pharmacy_id,
+        sales_date=sales_date,
+        transaction_count=1,
+        subtotal=transaction.subtotal,
+        discount_amount=transaction.discount_amount,
+        tax_amount=transaction.tax_amount,
+        total_revenue=transaction.total_amount,
+        created_at=now,
+        updated_at=now
+    ))
+    db.session.execute(insert(DailyMedicineSalesRollup), [{
+        'id': uuid.uuid4(),
+        'pharmacy_id': transaction.pharmacy_id,
+        'sales_date': sales_date,
+        'medicine_id': line['medicine_id'],
+        'medicine_name': line['medicine_name'],
+        'quantity_sold': line['quantity'],
+        'revenue': line['revenue'],
+        'created_at': now,
+        'updated_at': now
+    } for line in lines])
+
+def _merge_rows(model, keys, measures, rows):
+    """Insert pre-aggregated (keys..., measures...) tuples into a rollup table"""
+    now = datetime.utcnow()
+    payload = [{
+        'id': uuid.uuid4(),
+        **dict(zip(keys + measures, row)),
+        'created_at': now,
+        'updated_at': now
+    } for row in rows]
+    if payload:
+        db.session.execute(insert(model), payload)
+    return len(payload)
+
+def _sum_rows(keys, measures, rows):
+    """Group (keys..., measures...) rows by their keys and sum the measures, skipping NULLs like SQL"""
+    totals = {}
+    for row in rows:
+        key, values = tuple(row[:len(keys)]), row[len(keys):]
+        current = totals.setdefault(key, [None] * len(measures))
+        for index, value in enumerate(values):
+            if value is not None:
+                current[index] = value if current[index] is None else current[index] + value
+    return [key + tuple(values) for key, values in totals.items()]
+
+def compact_rollups(before=None):
+    """
+    Merge delta rows for days before `before` (default: today, UTC like sales_date)
+
+    Each day is compacted and committed on its own. The deltas are deleted
+    with RETURNING and the merged rows built from exactly what was deleted,
+    so a delta committed mid-compaction is either merged or left alone.
+    Returns the number of delta rows removed.
+    """
+    before = before or datetime.utcnow().date()
+    removed = 0
+
+    for model, keys, measures in _ROLLUPS:
+        key_columns = [getattr(model, key) for key in keys]
+        days = db.session.execute(
+            select(model.sales_date)
+            .where(model.sales_date < before)
+            .group_by(*key_columns)
+            .having(func.count() > 1)
+        ).scalars().all()
+
+        for sales_date in sorted(set(days)):
+            deleted = db.session.execute(
+                delete(model)
+                .where(model.sales_date == sales_date)
+                .returning(*key_columns, *[getattr(model, measure) for measure in measures])
+                .execution_options(synchronize_session=False)
+            ).all()
+            removed += len(deleted) - _merge_rows(model, keys, measures, _sum_rows(keys, measures, deleted))
+            db.session.commit()
+
+    return removed
+
+def rebuild_rollups():
+    """Recompute every rollup row from sales_transactions and their items"""
+    for model, _, _ in _ROLLUPS:
+        db.session.execute(delete(model))
+
+    sales_date = func.date(SalesTransaction.transaction_date)
+    transaction_rows = db.session.execute(
+        select(
+            SalesTransaction.pharmacy_id,
+            sales_date,
+            func.count(),
+            func.sum(SalesTransaction.subtotal),
+            func.coalesce(func.sum(SalesTransaction.discount_amount), 0),
+            func.coalesce(func.sum(SalesTransaction.tax_amount), 0),
+            func.sum(SalesTransaction.total_amount)
+        ).group_by(SalesTransaction.pharmacy_id, sales_date)
+    ).all()
+
+    item_rows = db.session.execute(
+        select(
+            SalesTransaction.pharmacy_id,
+            sales_date,
+            Inventory.medicine_id,
+            SalesTransactionItem.medicine_name,
+            func.sum(SalesTransactionItem.quantity_sold),
+            func.sum(SalesTransactionItem.total_price)
+        )
+        .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+        .outerjoin(Inventory, Inventory.id == SalesTransactionItem.inventory_id)
+        .group_by(SalesTransaction.pharmacy_id, sales_date, Inventory.medicine_id, SalesTransactionItem.medicine_name)
+    ).all()
+
+    def as_date(value):
+        # SQLite's date() returns text
+        return date.fromisoformat(value) if isinstance(value, str) else value
+
+    (sales_model, sales_keys, sales_measures), (medicine_model, medicine_keys, medicine_measures) = _ROLLUPS
+    days = _merge_rows(sales_model, sales_keys, sales_measures,
+                       [(row[0], as_date(row[1]), *row[2:]) for row in transaction_rows])
+    _merge_rows(medicine_model, medicine_keys, medicine_measures,
+                [(row[0], as_date(row[1]), *row[2:]) for row in item_rows])
+    db.session.commit()
+    return days
+
+def period_start(period, today=None):
+    """First day included in a daily/weekly/monthly/yearly window ending today"""
+    if period not in PERIOD_DAYS:
+        raise ValueError(f"period must be one of {', '.join(PERIOD_DAYS)}")
+    return (today or date.today()) - timedelta(days=PERIOD_DAYS[period] - 1)
+
+def get_sales_summary(pharmacy_id, period='monthly'):
+    """Sales totals for a period from the rollups, with top sellers from the sketch once it covers the period"""
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    start = period_start(period)
+
+    totals = db.session.execute(
+        select(
+            func.coalesce(func.sum(DailySalesRollup.transaction_count), 0),
+            func.coalesce(func.sum(DailySalesRollup.total_revenue), 0),
+            func.coalesce(func.sum(DailySalesRollup.discount_amount), 0),
+            func.coalesce(func.sum(DailySalesRollup.tax_amount), 0)
+        ).where(
+            DailySalesRollup.pharmacy_id == pharmacy_id,
+            DailySalesRollup.sales_date >= start
+        )
+    ).one()
+    orders, revenue, discounts, tax = int(totals[0]), Decimal(totals[1]), Decimal(totals[2]), Decimal(totals[3])
+
+    # The sketch only covers the period once it has seen every unit the
+    # rollups have (not so right after a deploy, or while a peer worker's
+    # sketch is unpersisted); until then the exact rollup ranking is used
+    units_sold = db.session.execute(
+        select(func.coalesce(func.sum(DailyMedicineSalesRollup.quantity_sold), 0)).where(
+            DailyMedicineSalesRollup.pharmacy_id == pharmacy_id,
+            DailyMedicineSalesRollup.sales_date >= start
+        )
+    ).scalar()
+    sketch = heavy_hitters.top(pharmacy_id, 'sales', days=PERIOD_DAYS[period], n=TOP_MEDICINES_LIMIT)
+    if units_sold and sketch['total'] >= units_sold:
+        top_selling = [{
+            'medicine_id': None,
+            'name': item['name'],
+            'sales': item['count'],
+            'revenue': None,
+            'max_overcount': item['error']
+        } for item in sketch['items']]
+        error_bound = sketch['error_bound']
+    else:
+        top_selling = _top_medicines_from_rollups(pharmacy_id, start)
+        error_bound = 0
+
+    return {
+        'period': period,
+        'start_date': start.isoformat(),
+        'end_date': date.today().isoformat(),
+        'total_revenue': float(revenue),
+        'total_orders': orders,
+        'average_order_value': round(float(revenue) / orders, 2) if orders else 0.0,
+        'total_discounts': float(discounts),
+        'total_tax': float(tax),
+        'top_selling_medicines': top_selling,
+        'top_selling_error_bound': error_bound
+    }
+
+def _top_medicines_from_rollups(pharmacy_id, start):
+    """Exact top sellers since start, grouped over the medicine rollups"""
+    quantity = func.sum(DailyMedicineSalesRollup.quantity_sold).label('quantity')
+    top_medicines = db.session.execute(
+        select(
+            DailyMedicineSalesRollup.medicine_id,
+            DailyMedicineSalesRollup.medicine_name,
+            quantity,
+            func.sum(DailyMedicineSalesRollup.revenue).label('revenue')
+        )
+        .where(
+            DailyMedicineSalesRollup.pharmacy_id == pharmacy_id,
+            DailyMedicineSalesRollup.sales_date >= start
+        )
+        .group_by(DailyMedicineSalesRollup.medicine_id, DailyMedicineSalesRollup.medicine_name)
+        .order_by(quantity.desc(), DailyMedicineSalesRollup.medicine_name)
+        .limit(TOP_MEDICINES_LIMIT)
+    ).all()
+
+    return [{
+        'medicine_id': str(row.medicine_id) if row.medicine_id else None,
+        'name': row.medicine_name,
+        'sales': int(row.quantity),
+        'revenue': float(row.revenue),
+        'max_overcount': 0
+    } for row in top_medicines]
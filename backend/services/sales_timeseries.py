@@ -0,0 +1,183 @@
+"""
+Sales Time Series Service - Revenue, transactions and units per time bucket
+Buckets are computed in the pharmacy's local time zone and missing buckets
+are zero-filled. The range is scanned through idx_sales_pharmacy_date in a
+single query.
+"""
+
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import Integer, cast, func, select
+
+from extensions import db
+from models import Pharmacy, SalesTransaction, SalesTransactionItem
+
+INTERVALS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1)
+}
+DEFAULT_SPANS = {
+    'hour': timedelta(days=1),
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12)
+}
+MAX_BUCKETS = 20000  # two years of hourly buckets fit comfortably
+
+def resolve_timezone(name):
+    """ZoneInfo for an IANA time zone name"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Unknown time zone: {name}')
+
+def truncate(local_dt, interval):
+    """Start of the bucket containing a local wall-clock datetime (weeks start on Monday)"""
+    if interval == 'hour':
+        return local_dt.replace(minute=0, second=0, microsecond=0)
+    day = datetime.combine(local_dt.date(), time())
+    if interval == 'week':
+        day -= timedelta(days=day.weekday())
+    return day
+
+def _to_utc(local_dt, tz):
+    """Naive UTC datetime for a naive local wall-clock datetime"""
+    return local_dt.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+def _sales_filters(pharmacy_id, utc_start, utc_end):
+    return (
+        SalesTransaction.pharmacy_id == pharmacy_id,
+        SalesTransaction.transaction_date >= utc_start,
+        SalesTransaction.transaction_date < utc_end
+    )
+
+def _units_per_transaction(filters):
+    """Units sold per transaction in the range, for joining onto the transactions"""
+    return (
+        select(
+            SalesTransactionItem.transaction_id,
+            func.sum(SalesTransactionItem.quantity_sold).label('units')
+        )
+        .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+        .where(*filters)
+        .group_by(SalesTransactionItem.transaction_id)
+        .subquery()
+    )
+
+def _aggregate_postgres(filters, interval, tz):
+    """Bucket in SQL: date_trunc over the local time of each transaction"""
+    units = _units_per_transaction(filters)
+    bucket = func.date_trunc(interval, func.timezone(tz.key, SalesTransaction.transaction_date)).label('bucket')
+    rows = db.session.execute(
+        select(
+            bucket,
+            func.count(SalesTransaction.id),
+            func.sum(SalesTransaction.total_amount),
+            func.sum(func.coalesce(units.c.units, 0))
+        )
+        .outerjoin(units, units.c.transaction_id == SalesTransaction.id)
+        .where(*filters)
+        .group_by(bucket)
+    ).all()
+    return {row[0]: (row[1], row[2] or 0, row[3] or 0) for row in rows}
+
+def _aggregate_sqlite(filters, interval, tz):
+    """
+    SQLite has no time zone support, so group by 15-minute UTC slots (every
+    real UTC offset is a multiple of 15 minutes) and fold them into local
+    buckets here
+    """
+    units = _units_per_transaction(filters)
+    minute = cast(func.strftime('%M', SalesTransaction.transaction_date), Integer)
+    slot = func.strftime('%Y-%m-%d %H:', SalesTransaction.transaction_date).concat(
+        func.printf('%02d', minute / 15 * 15)
+    ).label('slot')
+    rows = db.session.execute(
+        select(
+            slot,
+            func.count(SalesTransaction.id),
+            func.sum(SalesTransaction.total_amount),
+            func.sum(func.coalesce(units.c.units, 0))
+        )
+        .outerjoin(units, units.c.transaction_id == SalesTransaction.id)
+        .where(*filters)
+        .group_by(slot)
+    ).all()
+
+    buckets = {}
+    for slot_start, transactions, revenue, sold in rows:
+        utc_dt = datetime.strptime(slot_start, '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc)
+        key = truncate(utc_dt.astimezone(tz).replace(tzinfo=None), interval)
+        previous = buckets.get(key, (0, 0, 0))
+        buckets[key] = (previous[0] + transactions, previous[1] + (revenue or 0), previous[2] + (sold or 0))
+    return buckets
+
+def get_sales_timeseries(pharmacy_id, interval='day', start_date=None, end_date=None, tz_name=None):
+    """
+    Zero-filled sales series for a pharmacy
+
+    start_date and end_date are inclusive local dates; tz_name defaults to
+    the pharmacy's time zone. Raises ValueError for invalid parameters.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    if tz_name is None:
+        pharmacy = db.session.get(Pharmacy, pharmacy_id)
+        tz_name = pharmacy.timezone if pharmacy and pharmacy.timezone else 'UTC'
+    tz = resolve_timezone(tz_name)
+
+    today = datetime.now(tz).date()
+    end_date = end_date or today
+    start_date = start_date or (end_date - DEFAULT_SPANS[interval] + timedelta(days=1))
+    if start_date > end_date:
+        raise ValueError('start must not be after end')
+
+    local_start = truncate(datetime.combine(start_date, time()), interval)
+    local_end = datetime.combine(end_date + timedelta(days=1), time())
+    bucket_count = -(-(local_end - local_start) // INTERVALS[interval])
+    if bucket_count > MAX_BUCKETS:
+        raise ValueError(f'Range too large: {bucket_count} buckets (maximum {MAX_BUCKETS})')
+
+    filters = _sales_filters(pharmacy_id, _to_utc(local_start, tz), _to_utc(local_end, tz))
+    if db.session.get_bind().dialect.name == 'postgresql':
+        buckets = _aggregate_postgres(filters, interval, tz)
+    else:
+        buckets = _aggregate_sqlite(filters, interval, tz)
+
+    series = []
+    totals = {'revenue': 0.0, 'transactions': 0, 'units': 0}
+    bucket = local_start
+    while bucket < local_end:
+        transactions, revenue, units = buckets.get(bucket, (0, 0, 0))
+        series.append({
+            'bucket_start': bucket.replace(tzinfo=tz).isoformat(),
+            'revenue': float(revenue),
+            'transactions': int(transactions),
+            'units': int(units)
+        })
+        totals['revenue'] += float(revenue)
+        totals['transactions'] += int(transactions)
+        totals['units'] += int(units)
+        bucket += INTERVALS[interval]
+    totals['revenue'] = round(totals['revenue'], 2)
+
+    return {
+        'interval': interval,
+        'timezone': tz.key,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'series': series,
+        'totals': totals
+    }
+
+def parse_date(value, field):
+    """Parse an optional YYYY-MM-DD query parameter"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{field} must be formatted as YYYY-MM-DD')
@@ -0,0 +1,109 @@
+"""
+Transaction Number Service - Hand out per-pharmacy, per-business-day transaction numbers
+Numbers are reserved from transaction_number_counters in blocks (hi-lo), so
+a worker touches the database once per block instead of once per checkout.
+Numbers are unique and increasing per worker; blocks a worker never uses
+before restarting are skipped, so numbering can have gaps.
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Pharmacy, TransactionNumberCounter
+
+def format_transaction_number(pharmacy_id, business_date, value):
+    """'TXN-1A2B3C4D-20240115-000042'; the pharmacy code keeps numbers globally unique"""
+    return f'TXN-{pharmacy_id.hex[:8].upper()}-{business_date:%Y%m%d}-{value:06d}'
+
+def reserve_block(pharmacy_id, business_date, block_size):
+    """
+    Reserve block_size numbers and return the range as (low, high)
+
+    Runs in its own short transaction on a separate connection so the
+    counter row is locked only for the increment, not for the checkout.
+    """
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        for _ in range(2):
+            high = connection.execute(
+                update(TransactionNumberCounter)
+                .where(
+                    TransactionNumberCounter.pharmacy_id == pharmacy_id,
+                    TransactionNumberCounter.business_date == business_date
+                )
+                .values(next_value=TransactionNumberCounter.next_value + block_size, updated_at=now)
+                .returning(TransactionNumberCounter.next_value)
+            ).scalar()
+            if high is not None:
+                return high - block_size, high
+
+            # First block of the day for this pharmacy
+            try:
+                with connection.begin_nested():
+                    connection.execute(insert(TransactionNumberCounter).values(
+                        id=uuid.uuid4(),
+                        pharmacy_id=pharmacy_id,
+                        business_date=business_date,
+                        next_value=1 + block_size,
+                        created_at=now,
+                        updated_at=now
+                    ))
+                return 1, 1 + block_size
+            except IntegrityError:
+                # Another worker created the row first; increment it instead
+                continue
+    raise RuntimeError('Could not reserve a transaction number block')
+
+def pharmacy_business_date(pharmacy_id, at=None):
+    """The pharmacy's local date at `at` (aware, default now), so numbering restarts at local midnight"""
+    pharmacy = db.session.get(Pharmacy, pharmacy_id)
+    tz = ZoneInfo(pharmacy.timezone if pharmacy and pharmacy.timezone else 'UTC')
+    return (at or datetime.now(timezone.utc)).astimezone(tz).date()
+
+class TransactionNumberGenerator:
+    """Per-process allocator handing out numbers from reserved blocks"""
+
+    def __init__(self):
+        self._blocks = {}  # (pharmacy_id, business_date) -> [next, high]
+        self._lock = threading.Lock()
+
+    def next_number(self, pharmacy_id, business_date=None):
+        pharmacy_id = uuid.UUID(str(pharmacy_id))
+        business_date = business_date or pharmacy_business_date(pharmacy_id)
+        key = (pharmacy_id, business_date)
+
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                if block is None:
+                    # Drop blocks left over from previous days; pharmacies in
+                    # other time zones may still be a day behind
+                    for stale in [k for k in self._blocks if k[1] < business_date - timedelta(days=1)]:
+                        del self._blocks[stale]
+                block = list(reserve_block(
+                    pharmacy_id,
+                    business_date,
+                    current_app.config['TRANSACTION_NUMBER_BLOCK_SIZE']
+                ))
+                self._blocks[key] = block
+            value = block[0]
+            block[0] += 1
+
+        return format_transaction_number(pharmacy_id, business_date, value)
+
+    def reset(self):
+        with self._lock:
+            self._blocks.clear()
+
+transaction_numbers = TransactionNumberGenerator()
+
+def generate_transaction_number(pharmacy_id):
+    """Next transaction number for a pharmacy today"""
+    return transaction_numbers.next_number(pharmacy_id)
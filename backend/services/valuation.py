@@ -0,0 +1,227 @@
+"""
+Valuation Service - FIFO stock valuation and gross margin per medicine
+Everything is computed in SQL over all of a pharmacy's batches at once, with
+Decimal results rounded only at the end.
+
+Stock held on the as-of date is each batch's current quantity plus the units
+sold from it since. Under FIFO the oldest purchases are sold first, so a
+medicine's closing stock is valued at its newest purchase layers (batches by
+purchase_date, each layer being the units received: current quantity plus
+everything sold from the batch). Cost of goods sold over a period is then
+opening value + purchases - closing value, and gross margin is net revenue
+(line totals after transaction discounts, before tax) minus that cost.
+
+Quantity edits made outside checkout are not recorded as movements, so
+snapshots for past dates assume the current quantity was already held then.
+"""
+
+import uuid
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import case, func, select
+
+from extensions import db
+from models import Inventory, InventoryValuationSnapshot, Medicine, SalesTransaction, SalesTransactionItem
+
+CENT = Decimal('0.01')
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def _day_end(day):
+    """Naive UTC start of the day after `day`"""
+    return datetime.combine(day + timedelta(days=1), time())
+
+def _units_sold(pharmacy_id, since=None):
+    """Units sold per batch (optionally only from `since` on), as a subquery"""
+    filters = [SalesTransaction.pharmacy_id == pharmacy_id, SalesTransactionItem.inventory_id.isnot(None)]
+    if since is not None:
+        filters.append(SalesTransaction.transaction_date >= since)
+    return (
+        select(SalesTransactionItem.inventory_id, func.sum(SalesTransactionItem.quantity_sold).label('units'))
+        .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+        .where(*filters)
+        .group_by(SalesTransactionItem.inventory_id)
+        .subquery()
+    )
+
+def _batches(pharmacy_id, as_of):
+    """Per batch acquired by as_of: units held on as_of and units received"""
+    sold_total = _units_sold(pharmacy_id)
+    sold_after = _units_sold(pharmacy_id, since=_day_end(as_of))
+    acquired = func.coalesce(Inventory.purchase_date, func.date(Inventory.created_at))
+
+    return (
+        select(
+            Inventory.id,
+            Inventory.medicine_id,
+            Inventory.unit_price,
+            Inventory.mrp,
+            acquired.label('acquired'),
+            (Inventory.quantity_available + func.coalesce(sold_after.c.units, 0)).label('held'),
+            (Inventory.quantity_available + func.coalesce(sold_total.c.units, 0)).label('received')
+        )
+        .outerjoin(sold_total, sold_total.c.inventory_id == Inventory.id)
+        .outerjoin(sold_after, sold_after.c.inventory_id == Inventory.id)
+        .where(Inventory.pharmacy_id == pharmacy_id, acquired <= as_of)
+        .subquery()
+    )
+
+def _batch_layers(pharmacy_id, as_of):
+    """_batches plus the units of each batch's FIFO layer still held on as_of"""
+    batches = _batches(pharmacy_id, as_of)
+
+    # FIFO: the medicine's holding fills its newest layers first
+    medicine_held = func.sum(batches.c.held).over(partition_by=batches.c.medicine_id)
+    newer_received = func.sum(batches.c.received).over(
+        partition_by=batches.c.medicine_id,
+        order_by=(batches.c.acquired.desc(), batches.c.id.desc()),
+        rows=(None, 0)
+    ) - batches.c.received
+    layered = select(batches, (medicine_held - newer_received).label('remaining')).subquery()
+
+    fifo_units = case(
+        (layered.c.remaining <= 0, 0),
+        (layered.c.remaining >= layered.c.received, layered.c.received),
+        else_=layered.c.remaining
+    )
+    return layered, fifo_units
+
+def _stock_by_medicine(pharmacy_id, as_of):
+    """{medicine_id: (units held, FIFO cost value, MRP value)} on as_of"""
+    layered, fifo_units = _batch_layers(pharmacy_id, as_of)
+    rows = db.session.execute(
+        select(
+            layered.c.medicine_id,
+            func.sum(layered.c.held),
+            func.sum(fifo_units * layered.c.unit_price),
+            func.sum(layered.c.held * layered.c.mrp)
+        ).group_by(layered.c.medicine_id)
+    ).all()
+    return {row[0]: (int(row[1] or 0), Decimal(str(row[2] or 0)), Decimal(str(row[3] or 0))) for row in rows}
+
+def _purchases_by_medicine(pharmacy_id, start, end):
+    """{medicine_id: cost of units received} for batches acquired in [start, end]"""
+    batches = _batches(pharmacy_id, end)
+    rows = db.session.execute(
+        select(batches.c.medicine_id, func.sum(batches.c.received * batches.c.unit_price))
+        .where(batches.c.acquired >= start)
+        .group_by(batches.c.medicine_id)
+    ).all()
+    return {row[0]: Decimal(str(row[1] or 0)) for row in rows}
+
+def _sales_by_medicine(pharmacy_id, start, end):
+    """{medicine_id: (units sold, net revenue)} for sales in [start, end]"""
+    net_share = (SalesTransaction.subtotal - func.coalesce(SalesTransaction.discount_amount, 0)) / SalesTransaction.subtotal
+    rows = db.session.execute(
+        select(
+            Inventory.medicine_id,
+            func.sum(SalesTransactionItem.quantity_sold),
+            func.sum(SalesTransactionItem.total_price * net_share)
+        )
+        .join(SalesTransaction, SalesTransaction.id == SalesTransactionItem.transaction_id)
+        .join(Inventory, Inventory.id == SalesTransactionItem.inventory_id)
+        .where(
+            SalesTransaction.pharmacy_id == pharmacy_id,
+            SalesTransaction.transaction_date >= datetime.combine(start, time()),
+            SalesTransaction.transaction_date < _day_end(end)
+        )
+        .group_by(Inventory.medicine_id)
+    ).all()
+    return {row[0]: (int(row[1] or 0), Decimal(str(row[2] or 0))) for row in rows}
+
+def compute_valuation(pharmacy_id, as_of, period_start=None):
+    """
+    Stock valuation on as_of and, with period_start, gross margin over
+    [period_start, as_of]; both dates inclusive (UTC days)
+    """
+    pharmacy_id = uuid.UUID(str(pharmacy_id))
+    if period_start and period_start > as_of:
+        raise ValueError('start must not be after as_of')
+
+    closing = _stock_by_medicine(pharmacy_id, as_of)
+    if period_start:
+        opening = _stock_by_medicine(pharmacy_id, period_start - timedelta(days=1))
+        purchases = _purchases_by_medicine(pharmacy_id, period_start, as_of)
+        sales = _sales_by_medicine(pharmacy_id, period_start, as_of)
+        medicine_ids = closing.keys() | opening.keys() | purchases.keys() | sales.keys()
+    else:
+        opening = purchases = sales = {}
+        medicine_ids = set(closing)
+
+    names = dict(db.session.execute(
+        select(Medicine.id, Medicine.name).where(Medicine.id.in_(medicine_ids))
+    ).all()) if medicine_ids else {}
+
+    zero = Decimal('0')
+    totals = {key: zero for key in ('fifo_cost_value', 'mrp_value', 'net_revenue', 'cost_of_goods_sold', 'gross_margin')}
+    medicines = []
+    for medicine_id in sorted(medicine_ids, key=lambda key: (names.get(key) or '', str(key))):
+        units, cost_value, mrp_value = closing.get(medicine_id, (0, zero, zero))
+        line = {
+            'medicine_id': str(medicine_id),
+            'name': names.get(medicine_id),
+            'units_on_hand': units,
+            'fifo_cost_value': _money(cost_value),
+            'mrp_value': _money(mrp_value),
+            'unrealized_margin': _money(mrp_value - cost_value)
+        }
+        totals['fifo_cost_value'] += line['fifo_cost_value']
+        totals['mrp_value'] += line['mrp_value']
+
+        if period_start:
+            units_sold, revenue = sales.get(medicine_id, (0, zero))
+            opening_value = opening.get(medicine_id, (0, zero, zero))[1]
+            purchased = purchases.get(medicine_id, zero)
+            revenue, cogs = _money(revenue), _money(opening_value + purchased - cost_value)
+            margin = revenue - cogs
+            line.update({
+                'opening_fifo_cost_value': _money(opening_value),
+                'purchases': _money(purchased),
+                'units_sold': units_sold,
+                'net_revenue': revenue,
+                'cost_of_goods_sold': cogs,
+                'gross_margin': margin,
+                'gross_margin_percent': float((margin / revenue * 100).quantize(CENT)) if revenue else None
+            })
+            totals['net_revenue'] += line['net_revenue']
+            totals['cost_of_goods_sold'] += line['cost_of_goods_sold']
+            totals['gross_margin'] += line['gross_margin']
+        medicines.append(line)
+
+    summary = {
+        'fifo_cost_value': totals['fifo_cost_value'],
+        'mrp_value': totals['mrp_value'],
+        'unrealized_margin': totals['mrp_value'] - totals['fifo_cost_value']
+    }
+    if period_start:
+        summary.update({
+            'net_revenue': totals['net_revenue'],
+            'cost_of_goods_sold': totals['cost_of_goods_sold'],
+            'gross_margin': totals['gross_margin']
+        })
+
+    return {
+        'as_of': as_of.isoformat(),
+        'period_start': period_start.isoformat() if period_start else None,
+        'totals': _serialize(summary),
+        'medicines': [_serialize(line) for line in medicines]
+    }
+
+def _serialize(values):
+    """Decimals as strings, so amounts survive JSON exactly"""
+    return {key: str(value) if isinstance(value, Decimal) else value for key, value in values.items()}
+
+def create_snapshot(pharmacy_id, as_of, period_start=None):
+    """Compute and store a valuation; the caller commits"""
+    valuation = compute_valuation(pharmacy_id, as_of, period_start)
+    snapshot = InventoryValuationSnapshot(
+        pharmacy_id=uuid.UUID(str(pharmacy_id)),
+        as_of_date=as_of,
+        period_start=period_start,
+        totals=valuation['totals'],
+        medicines=valuation['medicines']
+    )
+    db.session.add(snapshot)
+    return snapshot
@@ -18,6 +18,22 @@ CREATE TABLE pharmacies (
     email VARCHAR(255),
     owner_name VARCHAR(255) NOT NULL,
     gst_number VARCHAR(50),
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    timezone VARCHAR(64) NOT NULL DEFAULT 'Asia/Kolkata',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Offline geocoding table (postal/PIN code centroids)
+CREATE TABLE postal_code_locations (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    postal_code VARCHAR(10) UNIQUE NOT NULL,
+    place_name VARCHAR(255),
+    district VARCHAR(255),
+    state VARCHAR(255),
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -148,6 +164,9 @@ CREATE TABLE rare_medicine_requests (
     requested_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     response_date TIMESTAMP WITH TIME ZONE,
     fulfilled_date TIMESTAMP WITH TIME ZONE,
+    fanned_out_at TIMESTAMP WITH TIME ZONE,
+    leased_by VARCHAR(255),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -188,7 +207,11 @@ CREATE TABLE sales_transactions (
     payment_status VARCHAR(50) DEFAULT 'Paid' CHECK (payment_status IN ('Pending', 'Paid', 'Partial', 'Refunded')),
     cashier_name VARCHAR(255),
     notes TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    idempotency_key VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_idempotency_key_per_pharmacy UNIQUE (pharmacy_id, idempotency_key)
 );
 
 -- Sales transaction items
@@ -208,13 +231,144 @@ CREATE TABLE sales_transaction_items (
     CONSTRAINT check_positive_unit_price CHECK (unit_price > 0)
 );
 
+-- Daily sales rollups (checkouts append delta rows; nightly compaction merges them)
+CREATE TABLE daily_sales_rollups (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    sales_date DATE NOT NULL,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    subtotal DECIMAL(12,2) NOT NULL DEFAULT 0,
+    discount_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    tax_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE daily_medicine_sales_rollups (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    sales_date DATE NOT NULL,
+    medicine_id UUID REFERENCES medicines(id) ON DELETE SET NULL,
+    medicine_name VARCHAR(255) NOT NULL,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Heavy-hitter sketches (per worker, per pharmacy, per day) for top-N medicines
+CREATE TABLE heavy_hitter_sketches (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    kind VARCHAR(50) NOT NULL,
+    window_date DATE NOT NULL,
+    node_id VARCHAR(255) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    counters JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_sketch_per_node_day UNIQUE (pharmacy_id, kind, window_date, node_id)
+);
+
+-- Demand forecasts and reorder points (recomputed nightly from daily_medicine_sales_rollups)
+CREATE TABLE demand_forecasts (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    medicine_id UUID REFERENCES medicines(id) ON DELETE CASCADE,
+    method VARCHAR(20) NOT NULL,
+    daily_demand DOUBLE PRECISION NOT NULL DEFAULT 0,
+    demand_std DOUBLE PRECISION NOT NULL DEFAULT 0,
+    lead_time_days INTEGER NOT NULL,
+    safety_stock INTEGER NOT NULL DEFAULT 0,
+    reorder_point INTEGER NOT NULL DEFAULT 0,
+    history_days INTEGER NOT NULL DEFAULT 0,
+    demand_days INTEGER NOT NULL DEFAULT 0,
+    forecast_date DATE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_forecast_per_medicine UNIQUE (pharmacy_id, medicine_id)
+);
+
+-- Expiry risk per inventory batch (recomputed nightly from demand_forecasts)
+CREATE TABLE expiry_risk_scores (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    inventory_id UUID REFERENCES inventory(id) ON DELETE CASCADE,
+    medicine_id UUID REFERENCES medicines(id) ON DELETE CASCADE,
+    medicine_name VARCHAR(255) NOT NULL,
+    batch_number VARCHAR(100) NOT NULL,
+    expiry_date DATE NOT NULL,
+    quantity_available INTEGER NOT NULL,
+    daily_demand DOUBLE PRECISION NOT NULL DEFAULT 0,
+    expected_units_sold INTEGER NOT NULL DEFAULT 0,
+    units_at_risk INTEGER NOT NULL DEFAULT 0,
+    value_at_risk DECIMAL(12,2) NOT NULL DEFAULT 0,
+    risk_ratio DOUBLE PRECISION NOT NULL DEFAULT 0,
+    scored_date DATE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_expiry_risk_per_batch UNIQUE (inventory_id)
+);
+
+-- Stored FIFO inventory valuations
+CREATE TABLE inventory_valuation_snapshots (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    as_of_date DATE NOT NULL,
+    period_start DATE,
+    totals JSONB NOT NULL,
+    medicines JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Asynchronous report exports
+CREATE TABLE report_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    report_type VARCHAR(50) NOT NULL,
+    format VARCHAR(10) NOT NULL,
+    parameters JSONB,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    row_count INTEGER,
+    file_path VARCHAR(500),
+    file_size BIGINT,
+    error TEXT,
+    started_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Transaction number counters (hi-lo block reservation per pharmacy per day)
+CREATE TABLE transaction_number_counters (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    business_date DATE NOT NULL,
+    next_value INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_counter_per_pharmacy_day UNIQUE (pharmacy_id, business_date)
+);
+
 -- ============================================================================
 -- NOTIFICATIONS AND ALERTS
 -- ============================================================================
 
--- System notifications
+-- System notifications, partitioned by month on created_at. Monthly
+-- partitions (notifications_pYYYYMM) are created ahead and dropped past
+-- retention by `flask purge-notifications`; the default partition catches the rest.
 CREATE TABLE notifications (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
     type VARCHAR(50) NOT NULL CHECK (type IN ('Low Stock', 'Expiry Alert', 'Rare Medicine', 'Prescription', 'System', 'Payment')),
     priority VARCHAR(20) DEFAULT 'Normal' CHECK (priority IN ('Low', 'Normal', 'High', 'Critical')),
@@ -224,8 +378,29 @@ CREATE TABLE notifications (
     read_status BOOLEAN DEFAULT false,
     action_required BOOLEAN DEFAULT false,
     expires_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    read_at TIMESTAMP WITH TIME ZONE,
+    
+    -- A partitioned table's primary key must include the partition key
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Monthly partitions (notifications_pYYYYMM) are created by `flask partition-notifications`;
+-- run it once after loading this schema, and purge-notifications keeps them ahead
+CREATE TABLE notifications_default PARTITION OF notifications DEFAULT;
+
+-- Unread notification counters (maintained in the same transaction as each notification write)
+CREATE TABLE notification_counters (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    pharmacy_id UUID REFERENCES pharmacies(id) ON DELETE CASCADE,
+    type VARCHAR(50) NOT NULL,
+    priority VARCHAR(20) NOT NULL,
+    unread INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    read_at TIMESTAMP WITH TIME ZONE
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    
+    -- Constraints
+    CONSTRAINT unique_counter_per_type_priority UNIQUE (pharmacy_id, type, priority)
 );
 
 -- ============================================================================
@@ -252,6 +427,7 @@ CREATE TABLE translation_cache (
 
 -- Inventory indexes
 CREATE INDEX idx_inventory_pharmacy_medicine ON inventory(pharmacy_id, medicine_id);
+CREATE INDEX idx_inventory_medicine_pharmacy ON inventory(medicine_id, pharmacy_id, expiry_date);
 CREATE INDEX idx_inventory_expiry_date ON inventory(expiry_date);
 CREATE INDEX idx_inventory_low_stock ON inventory(pharmacy_id, quantity_available, minimum_threshold);
 
@@ -264,10 +440,23 @@ CREATE INDEX idx_prescriptions_date ON prescriptions(prescription_date);
 -- Sales indexes
 CREATE INDEX idx_sales_pharmacy_date ON sales_transactions(pharmacy_id, transaction_date);
 CREATE INDEX idx_sales_patient ON sales_transactions(patient_id);
+CREATE INDEX idx_daily_sales_pharmacy_date ON daily_sales_rollups(pharmacy_id, sales_date);
+CREATE INDEX idx_daily_medicine_sales_pharmacy_date ON daily_medicine_sales_rollups(pharmacy_id, sales_date);
+CREATE INDEX idx_expiry_risk_pharmacy_value ON expiry_risk_scores(pharmacy_id, value_at_risk DESC);
+CREATE INDEX idx_report_jobs_pharmacy_created ON report_jobs(pharmacy_id, created_at);
+CREATE INDEX idx_valuation_snapshots_pharmacy_date ON inventory_valuation_snapshots(pharmacy_id, as_of_date);
+
+-- Rare medicine fan-out queue
+CREATE INDEX idx_rare_requests_fanout ON rare_medicine_requests(urgency_level, requested_date) WHERE fanned_out_at IS NULL;
+-- The lease order depends on the current time, so this only narrows it to pending rows
+CREATE INDEX idx_rare_requests_queue ON rare_medicine_requests(requested_date, id) WHERE status = 'Pending';
 
 -- Notification indexes
 CREATE INDEX idx_notifications_pharmacy_unread ON notifications(pharmacy_id, read_status);
 CREATE INDEX idx_notifications_type_priority ON notifications(type, priority);
+CREATE INDEX idx_notifications_pharmacy_created ON notifications(pharmacy_id, created_at);
+CREATE INDEX idx_notifications_created ON notifications(created_at);
+CREATE INDEX idx_notifications_expires ON notifications(expires_at);
 
 -- Medicine search indexes
 CREATE INDEX idx_medicines_name ON medicines USING gin(name gin_trgm_ops);
@@ -112,13 +112,22 @@ export const apiService = {
     getById: (id: string) => api.get(`/api/notifications/${id}`),
     markAsRead: (id: string) => api.put(`/api/notifications/${id}/read`),
     markAllAsRead: () => api.put('/api/notifications/read-all'),
+    getUnreadCount: () => api.get('/api/notifications/unread-count'),
     delete: (id: string) => api.delete(`/api/notifications/${id}`),
+    // Server-Sent Events: 'notification', 'unread_count' and 'resync' messages.
+    // EventSource resends Last-Event-ID on reconnect, so missed notifications are replayed.
+    stream: () =>
+      new EventSource(
+        `${api.defaults.baseURL}/api/notifications/stream?jwt=${encodeURIComponent(localStorage.getItem('authToken') || '')}`
+      ),
   },
 
   // Analytics
   analytics: {
     getDashboard: () => api.get('/api/analytics/dashboard'),
     getSales: (period?: string) => api.get('/api/analytics/sales', { params: { period } }),
+    getSalesTimeseries: (params?: { interval?: 'hour' | 'day' | 'week'; start?: string; end?: string; tz?: string }) =>
+      api.get('/api/analytics/sales/timeseries', { params }),
     getInventory: () => api.get('/api/analytics/inventory'),
     getPrescriptions: (period?: string) => api.get('/api/analytics/prescriptions', { params: { period } }),
     getPatients: () => api.get('/api/analytics/patients'),